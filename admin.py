@@ -1,22 +1,27 @@
 from fastapi import FastAPI, HTTPException, Depends, Body, Request, status, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel, EmailStr
 from typing import List, Dict, Optional, Any
 import json
 import os
-import pymongo
 from datetime import datetime, timedelta
 import random
 import secrets
 import jinja2
 import pdfkit
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 import os.path
+from admin_auth import get_current_admin
+from db import get_collection, pool_stats, run_db
+from mail_outbox import MailOutbox, mail_settings_complete
+from reminder_queue import ReminderQueue, upsert_pending_reminders
+from report_views import (ReportListItem, ReportRenderView, ReportReminderView, attach_reminder_summaries, find_report,
+                          find_reports)
+from settings_cache import SETTINGS_CHANGE_STREAM, SettingsCache
+from template_engine import render_template
 
 # 創建FastAPI應用
 app = FastAPI(title="健康問卷管理後台API")
@@ -30,27 +35,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 安全認證
-security = HTTPBasic()
-
-# 管理員憑證
-ADMIN_USERNAME = "forest"
-ADMIN_PASSWORD = "lillian1231235555"
-
 # 確保數據目錄存在
 os.makedirs("data", exist_ok=True)
 
 # 確保模板目錄存在
 os.makedirs("templates", exist_ok=True)
 
+# 提醒郵件中重新評估的鏈接
+ASSESSMENT_URL = os.environ.get("ASSESSMENT_URL", "https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer")
+
 # 連接到MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
-    db = client["health_app"]
-    users_collection = db["users"]
-    reports_collection = db["reports"]
-    reminders_collection = db["reminders"]
-    settings_collection = db["settings"]
+    users_collection = get_collection("users")
+    reports_collection = get_collection("reports")
+    reminders_collection = get_collection("reminders")
+    settings_collection = get_collection("settings")
+    settings_cache = SettingsCache(settings_collection)
+    # 提醒郵件加入發件箱，由報告服務的工作任務發送
+    mail_outbox = MailOutbox(get_collection("mail_outbox"))
+    # 到期提醒通過租約領取，多個進程同時處理時不會重複發送
+    reminder_queue = ReminderQueue(
+        reminders_collection,
+        mail_outbox,
+        lambda reminder: generate_reminder_email(reminder),
+        enrich=lambda reminders: attach_reminder_summaries(reports_collection, reminders)
+    )
 except Exception as e:
     print(f"MongoDB連接錯誤: {e}")
     # 如果無法連接到MongoDB，使用內存存儲作為備用
@@ -94,25 +103,11 @@ class EmailSettings(BaseModel):
 class OpenAISettings(BaseModel):
     api_key: str
 
-# 認證函數
-def get_current_admin(credentials: HTTPBasicCredentials = Depends(security)):
-    is_correct_username = secrets.compare_digest(credentials.username, ADMIN_USERNAME)
-    is_correct_password = secrets.compare_digest(credentials.password, ADMIN_PASSWORD)
-    
-    if not (is_correct_username and is_correct_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="認證失敗",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    
-    return credentials.username
-
 # 輔助函數
 def get_reminder_settings():
     """獲取提醒設置"""
     try:
-        settings = settings_collection.find_one({"type": "reminder"})
+        settings = settings_cache.get("reminder")
         if settings:
             return {
                 "days": settings.get("days", 15),
@@ -122,6 +117,7 @@ def get_reminder_settings():
             # 如果設置不存在，創建默認設置
             default_settings = {"type": "reminder", "days": 15, "enabled": True}
             settings_collection.insert_one(default_settings)
+            settings_cache.invalidate("reminder")
             return {"days": 15, "enabled": True}
     except Exception as e:
         print(f"獲取提醒設置時出錯: {e}")
@@ -136,7 +132,7 @@ def get_reminder_settings():
 def get_email_settings():
     """獲取郵件設置"""
     try:
-        settings = settings_collection.find_one({"type": "email"})
+        settings = settings_cache.get("email")
         if settings:
             return {
                 "gmail_user": settings.get("gmail_user", ""),
@@ -157,7 +153,7 @@ def get_email_settings():
 def get_openai_settings():
     """獲取OpenAI設置"""
     try:
-        settings = settings_collection.find_one({"type": "openai"})
+        settings = settings_cache.get("openai")
         if settings:
             return {"api_key": settings.get("api_key", "")}
         else:
@@ -179,27 +175,18 @@ def create_reminder(user_email, report_id):
             return
         
         # 獲取報告數據
-        report = reports_collection.find_one({"report_id": report_id})
+        report = find_report(reports_collection, ReportReminderView, report_id)
         if not report:
             print(f"找不到報告: {report_id}")
             return
         
-        # 計算提醒日期
-        reminder_date = datetime.now() + timedelta(days=reminder_settings["days"])
-        
-        # 創建提醒數據
-        reminder_data = {
+        # 寫入用戶的待發送提醒，用戶已有未發送的提醒時改為引用這份報告
+        upsert_pending_reminders(reminders_collection, [{
             "user_email": user_email,
             "report_id": report_id,
             "created_at": datetime.now(),
-            "reminder_date": reminder_date,
-            "sent": False,
-            "health_data": report.get("health_data", {}),
-            "recommendations": report.get("recommendations", {})
-        }
-        
-        # 保存到數據庫
-        reminders_collection.insert_one(reminder_data)
+            "summary": report.summary()
+        }], reminder_settings["days"])
     except Exception as e:
         print(f"創建提醒時出錯: {e}")
         # 如果數據庫操作失敗，使用內存存儲
@@ -213,107 +200,30 @@ def create_reminder(user_email, report_id):
             }
             reminders_db.append(reminder_data)
 
-def send_email(to_email, subject, html_content, pdf_path=None):
-    """發送郵件"""
-    try:
-        # 獲取郵件設置
-        email_settings = get_email_settings()
-        
-        if not email_settings["gmail_user"] or not email_settings["gmail_password"]:
-            print("郵件設置不完整")
-            return False
-        
-        # 創建郵件
-        msg = MIMEMultipart()
-        msg['From'] = email_settings["gmail_user"]
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        # 添加HTML內容
-        msg.attach(MIMEText(html_content, 'html'))
-        
-        # 如果有PDF附件，添加到郵件
-        if pdf_path and os.path.exists(pdf_path):
-            with open(pdf_path, 'rb') as f:
-                attach = MIMEApplication(f.read(), _subtype="pdf")
-                attach.add_header('Content-Disposition', 'attachment', filename=os.path.basename(pdf_path))
-                msg.attach(attach)
-        
-        # 發送郵件
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(email_settings["gmail_user"], email_settings["gmail_password"])
-        server.send_message(msg)
-        server.quit()
-        
-        return True
-    except Exception as e:
-        print(f"發送郵件時出錯: {e}")
-        return False
-
 def generate_reminder_email(reminder):
     """生成提醒郵件內容"""
     try:
-        # 獲取用戶數據
-        user_email = reminder.get("user_email")
-        health_data = reminder.get("health_data", {})
-        recommendations = reminder.get("recommendations", {})
+        # 提醒中保存的報告摘要（發送前由 attach_reminder_summaries 補充）
+        summary = reminder.get("summary", {})
         
         # 獲取基本信息
-        basic_info = health_data.get("basicInfo", {})
-        gender = "男" if basic_info.get("gender") == "male" else "女" if basic_info.get("gender") == "female" else "其他"
-        age = basic_info.get("age", "")
+        gender = "男" if summary.get("gender") == "male" else "女" if summary.get("gender") == "female" else "其他"
+        age = summary.get("age", "")
         
         # 獲取症狀和推薦
-        symptoms = health_data.get("symptoms", [])
-        supplements = recommendations.get("supplements", [])
+        symptoms = summary.get("symptoms", [])
+        supplements = summary.get("supplements", [])
         
-        # 生成郵件內容
-        html_content = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                h1 {{ color: #2c3e50; }}
-                h2 {{ color: #3498db; }}
-                .highlight {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; }}
-                .button {{ display: inline-block; background-color: #3498db; color: white; padding: 10px 20px; 
-                          text-decoration: none; border-radius: 5px; margin-top: 20px; }}
-                .footer {{ margin-top: 30px; font-size: 12px; color: #7f8c8d; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>健康評估跟進提醒</h1>
-                <p>親愛的用戶：</p>
-                <p>距離您上次的健康評估已經快三個月了，我們建議您進行一次健康重新評估，以了解您的健康狀況變化並調整保健方案。</p>
-                
-                <div class="highlight">
-                    <h2>您上次的健康評估摘要</h2>
-                    <p><strong>基本信息：</strong> {gender}性，{age}歲</p>
-                    <p><strong>主要健康問題：</strong> {', '.join(symptoms) if symptoms else '無特定症狀'}</p>
-                    <p><strong>推薦保健品：</strong> {', '.join(supplements[:3]) if supplements else '無特定推薦'}</p>
-                </div>
-                
-                <p>定期的健康評估可以幫助您：</p>
-                <ul>
-                    <li>追蹤健康狀況的改善情況</li>
-                    <li>調整保健品使用方案</li>
-                    <li>發現潛在的健康問題</li>
-                    <li>獲得更個性化的健康建議</li>
-                </ul>
-                
-                <a href="https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer" class="button">立即進行健康重新評估</a>
-                
-                <div class="footer">
-                    <p>此郵件是系統自動發送的。如果您有任何問題，請回覆此郵件或聯繫我們的客服團隊。</p>
-                    <p>© {datetime.now().year} 健康問卷與保健品推薦系統. 保留所有權利.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        # 使用已編譯的提醒郵件模板渲染
+        html_content = render_template(
+            "reminder_email",
+            gender=gender,
+            age=age,
+            symptoms=symptoms,
+            supplements=supplements,
+            assessment_url=ASSESSMENT_URL,
+            current_year=datetime.now().year
+        )
         
         return html_content
     except Exception as e:
@@ -324,13 +234,13 @@ def generate_reminder_email(reminder):
             <h1>健康評估跟進提醒</h1>
             <p>親愛的用戶：</p>
             <p>距離您上次的健康評估已經快三個月了，我們建議您進行一次健康重新評估，以了解您的健康狀況變化並調整保健方案。</p>
-            <a href="https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer">立即進行健康重新評估</a>
+            <a href="{ASSESSMENT_URL}">立即進行健康重新評估</a>
         </body>
         </html>
         """
 
-def check_and_send_reminders(background_tasks: BackgroundTasks):
-    """檢查並發送提醒"""
+def check_and_send_reminders():
+    """檢查今天及之前到期的提醒，把提醒郵件加入發件箱；郵件送達後提醒才標記為已發送"""
     try:
         # 獲取提醒設置
         reminder_settings = get_reminder_settings()
@@ -338,56 +248,66 @@ def check_and_send_reminders(background_tasks: BackgroundTasks):
         if not reminder_settings["enabled"]:
             return {"success": True, "message": "提醒功能已禁用"}
         
-        # 獲取今天應該發送的提醒
+        # 郵件設置不完整時不領取提醒，提醒保持待發送，保存設置後再加入發件箱
+        if not mail_settings_complete(get_email_settings()):
+            return {"success": False, "message": "郵件設置不完整，提醒暫不發送，請檢查郵件設置"}
+        
+        # 獲取今天結束前應該發送、尚未加入發件箱的提醒（包括停機期間錯過的）
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         tomorrow = today + timedelta(days=1)
         
-        reminders = reminders_collection.find({
-            "reminder_date": {"$gte": today, "$lt": tomorrow},
-            "sent": False
-        })
-        
-        sent_count = 0
-        for reminder in reminders:
-            user_email = reminder.get("user_email")
-            if not user_email:
-                continue
-            
-            # 生成提醒郵件內容
-            html_content = generate_reminder_email(reminder)
-            
-            # 發送郵件
-            background_tasks.add_task(
-                send_email,
-                user_email,
-                "健康評估跟進提醒",
-                html_content
-            )
-            
-            # 更新提醒狀態
-            reminders_collection.update_one(
-                {"_id": reminder["_id"]},
-                {"$set": {"sent": True, "sent_at": datetime.now()}}
-            )
-            
-            sent_count += 1
+        # 分批領取，多個進程同時檢查時每個提醒只會被一個進程領取
+        queued_count = 0
+        while True:
+            claimed, queued = reminder_queue.dispatch(due_before=tomorrow)
+            if not claimed:
+                break
+            queued_count += queued
         
-        return {"success": True, "message": f"已發送{sent_count}個提醒"}
+        return {"success": True, "message": f"已將{queued_count}個提醒加入發送隊列"}
     except Exception as e:
         print(f"檢查並發送提醒時出錯: {e}")
         return {"success": False, "message": f"發送提醒時出錯: {str(e)}"}
 
+# 生命週期事件
+@app.on_event("startup")
+async def watch_settings():
+    """監聽設置變更，其他服務修改設置後本服務的緩存立即失效"""
+    if SETTINGS_CHANGE_STREAM and 'settings_cache' in globals():
+        settings_cache.watch()
+
+@app.on_event("shutdown")
+async def stop_settings_watch():
+    """停止監聽設置變更"""
+    if 'settings_cache' in globals():
+        settings_cache.stop()
+
 # API端點
 @app.get("/")
 async def root():
     return {"message": "健康問卷管理後台API"}
 
+@app.get("/api/db/metrics", response_model=Dict[str, Any])
+async def get_db_metrics(_: str = Depends(get_current_admin)):
+    """獲取MongoDB連接池統計"""
+    return pool_stats()
+
+@app.get("/api/settings/cache", response_model=Dict[str, Any])
+async def get_settings_cache_metrics(_: str = Depends(get_current_admin)):
+    """獲取設置緩存統計"""
+    return settings_cache.stats() if 'settings_cache' in globals() else {}
+
+@app.get("/api/mail/outbox", response_model=Dict[str, Any])
+async def get_outbox_depth(_: str = Depends(get_current_admin)):
+    """獲取發件箱中各狀態的郵件數（郵件由報告服務發送）"""
+    return {"depth": await run_db(mail_outbox.depth)}
+
 # 用戶管理API端點
 @app.get("/api/admin/users", response_model=List[Dict[str, Any]])
 async def get_users(_: str = Depends(get_current_admin)):
     """獲取所有用戶"""
     try:
-        users = list(users_collection.find({}, {"_id": 0}))
+        users = await run_db(lambda: list(users_collection.find({}, {"_id": 0})))
         return users
     except Exception as e:
         print(f"獲取用戶時出錯: {e}")
@@ -400,7 +320,7 @@ async def get_users(_: str = Depends(get_current_admin)):
 async def get_user(email: str, _: str = Depends(get_current_admin)):
     """獲取特定用戶"""
     try:
-        user = users_collection.find_one({"email": email}, {"_id": 0})
+        user = await run_db(users_collection.find_one, {"email": email}, {"_id": 0})
         if not user:
             raise HTTPException(status_code=404, detail=f"找不到用戶: {email}")
         return user
@@ -418,10 +338,10 @@ async def get_user(email: str, _: str = Depends(get_current_admin)):
 
 @app.get("/api/admin/reports", response_model=List[Dict[str, Any]])
 async def get_reports(_: str = Depends(get_current_admin)):
-    """獲取所有報告"""
+    """獲取所有報告（列表視圖，不含AI問答和劑量說明）"""
     try:
-        reports = list(reports_collection.find({}, {"_id": 0}))
-        return reports
+        reports = await run_db(find_reports, reports_collection, ReportListItem)
+        return [report.to_dict() for report in reports]
     except Exception as e:
         print(f"獲取報告時出錯: {e}")
         # 如果數據庫操作失敗，使用內存存儲
@@ -433,10 +353,10 @@ async def get_reports(_: str = Depends(get_current_admin)):
 async def get_report(report_id: str, _: str = Depends(get_current_admin)):
     """獲取特定報告"""
     try:
-        report = reports_collection.find_one({"report_id": report_id}, {"_id": 0})
+        report = await run_db(find_report, reports_collection, ReportRenderView, report_id)
         if not report:
             raise HTTPException(status_code=404, detail=f"找不到報告: {report_id}")
-        return report
+        return report.to_dict()
     except HTTPException:
         raise
     except Exception as e:
@@ -453,7 +373,7 @@ async def get_report(report_id: str, _: str = Depends(get_current_admin)):
 @app.get("/api/admin/reminders/settings", response_model=ReminderSettings)
 async def get_reminder_settings_api(_: str = Depends(get_current_admin)):
     """獲取提醒設置"""
-    settings = get_reminder_settings()
+    settings = await run_db(get_reminder_settings)
     return ReminderSettings(**settings)
 
 @app.post("/api/admin/reminders/settings", response_model=ReminderSettings)
@@ -461,11 +381,13 @@ async def update_reminder_settings_api(settings: ReminderSettings, _: str = Depe
     """更新提醒設置"""
     try:
         settings_dict = settings.dict()
-        settings_collection.update_one(
+        await run_db(
+            settings_collection.update_one,
             {"type": "reminder"},
             {"$set": settings_dict},
             upsert=True
         )
+        settings_cache.invalidate("reminder")
         return settings
     except Exception as e:
         print(f"更新提醒設置時出錯: {e}")
@@ -480,10 +402,16 @@ async def update_reminder_settings_api(settings: ReminderSettings, _: str = Depe
 async def get_reminders(_: str = Depends(get_current_admin)):
     """獲取所有提醒"""
     try:
-        reminders = list(reminders_collection.find({}, {"_id": 0}))
+        reminders = await run_db(lambda: list(reminders_collection.find({}, {"_id": 0})))
         return reminders
     except Exception as e:
         print(f"獲取提醒時出錯: {e}")
         # 如果數據庫操作失敗，使用內存存儲
-        if 'reminders_db' i
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+        if 'reminders_db' in globals():
+            return reminders_db
+        return []
+
+# 啟動應用
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,25 @@
+import secrets
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+
+# 管理後台、提醒服務和報告服務共用的管理員認證
+security = HTTPBasic()
+
+# 管理員憑證
+ADMIN_USERNAME = "forest"
+ADMIN_PASSWORD = "lillian1231235555"
+
+# 認證函數
+def get_current_admin(credentials: HTTPBasicCredentials = Depends(security)):
+    is_correct_username = secrets.compare_digest(credentials.username, ADMIN_USERNAME)
+    is_correct_password = secrets.compare_digest(credentials.password, ADMIN_PASSWORD)
+    
+    if not (is_correct_username and is_correct_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="認證失敗",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    
+    return credentials.username
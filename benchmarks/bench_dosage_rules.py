@@ -0,0 +1,87 @@
+"""劑量規則引擎基準測試：比較逐條子串判斷、Aho–Corasick自動機和預計算查表
+
+用法: python benchmarks/bench_dosage_rules.py [--rules 5000] [--supplements 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from dosage_rules import DEFAULT_DOSAGE_RULES, DosageRuleEngine  # noqa: E402
+
+# 用於生成隨機關鍵詞和保健品名稱的字符
+ALPHABET = "鈣鎂鋅鐵硒碘維他命群魚油酵素蘆薈花青素葉黃素膠原蛋白益生菌纖維粉ABCDEQ0123456789"
+
+def build_rules(count, rng):
+    """生成包含count條關鍵詞規則和count/10條精確名稱規則的規則表"""
+    contains = list(DEFAULT_DOSAGE_RULES["contains"])
+    seen = {rule["keyword"] for rule in contains}
+    while len(contains) < count:
+        keyword = "".join(rng.choices(ALPHABET, k=rng.randint(2, 5)))
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        contains.append({"keyword": keyword, "dosage": f"劑量{len(contains)}", "usage": f"用法{len(contains)}"})
+    exact = {
+        "".join(rng.choices(ALPHABET, k=8)): {"dosage": f"精確劑量{i}", "usage": f"精確用法{i}"}
+        for i in range(count // 10)
+    }
+    return {"default": DEFAULT_DOSAGE_RULES["default"], "exact": exact, "contains": contains}
+
+def naive_match(rules, supplement):
+    """原來的做法：依次判斷每條規則的子串"""
+    rule = rules["exact"].get(supplement)
+    if rule is not None:
+        return (rule["dosage"], rule["usage"])
+    for rule in rules["contains"]:
+        if rule["keyword"] in supplement:
+            return (rule["dosage"], rule["usage"])
+    default = rules["default"]
+    return (default["dosage"], default["usage"])
+
+def timed(label, func, supplements, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for supplement in supplements:
+            func(supplement)
+    elapsed = time.perf_counter() - start
+    per_lookup = elapsed / (repeat * len(supplements)) * 1e6
+    print(f"{label:<14} {per_lookup:9.2f}µs/次")
+
+def main():
+    parser = argparse.ArgumentParser(description="劑量規則引擎基準測試")
+    parser.add_argument("--rules", type=int, default=5000)
+    parser.add_argument("--supplements", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules = build_rules(args.rules, rng)
+    supplements = ["".join(rng.choices(ALPHABET, k=rng.randint(3, 12))) for _ in range(args.supplements)]
+    supplements += rng.sample(list(rules["exact"]), min(len(rules["exact"]), args.supplements // 10))
+
+    start = time.perf_counter()
+    engine = DosageRuleEngine(rules)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    table = engine.precompute(supplements)
+    precompute_ms = (time.perf_counter() - start) * 1000
+
+    # 驗證自動機與逐條判斷的結果一致
+    for supplement in supplements:
+        assert engine.match(supplement) == naive_match(rules, supplement), supplement
+
+    print(f"規則數 {len(rules['contains'])} (+{len(rules['exact'])} 條精確名稱)，保健品 {len(supplements)} 種")
+    print(f"自動機編譯 {compile_ms:.1f}ms，預計算 {precompute_ms:.1f}ms")
+    timed("逐條子串", lambda s: naive_match(rules, s), supplements, args.repeat)
+    timed("自動機", engine.match, supplements, args.repeat)
+    timed("預計算查表", table.__getitem__, supplements, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""首次查看延遲基準測試：比較報告提交後直接打開PDF與預渲染後再打開的延遲
+
+模擬用戶提交問卷後隔 --think-ms 毫秒打開報告PDF。before 不預渲染，after 在提交時調用
+/api/report/prerender。需要wkhtmltopdf；沒有時可加 --simulate-ms，用 time.sleep 模擬PDF渲染耗時。
+用法: python benchmarks/bench_first_view.py [--reports 20] [--think-ms 1000] [--simulate-ms 300]
+"""
+import argparse
+import asyncio
+import copy
+import os
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import report_service  # noqa: E402
+from bench_report_render import SAMPLE_REPORT  # noqa: E402
+
+class InMemoryReports:
+    """按report_id保存報告的內存集合"""
+
+    def __init__(self):
+        self.reports = {}
+
+    def insert(self, report):
+        self.reports[report["report_id"]] = report
+
+    def find_one(self, query, projection=None):
+        return self.reports.get(query.get("report_id"))
+
+def new_report(label, position):
+    report = copy.deepcopy(SAMPLE_REPORT)
+    report["report_id"] = f"RPT-BENCH-{label}-{position:04d}-{time.time_ns()}"
+    report["created_at"] = datetime.now()
+    return report
+
+async def first_views(client, reports, label, count, think_ms, prerender):
+    """逐個提交報告並在思考時間後打開PDF，返回首次打開的延遲（毫秒）"""
+    latencies = []
+    for position in range(count):
+        report = new_report(label, position)
+        reports.insert(report)
+        if prerender:
+            await client.post("/api/report/prerender", json={"report_ids": [report["report_id"]]})
+        await asyncio.sleep(think_ms / 1000)
+        start = time.perf_counter()
+        response = await client.get(f"/api/report/{report['report_id']}/pdf")
+        assert response.status_code == 200, response.text
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+def summarize(label, latencies):
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:<8} 首次打開PDF p50 {p50:8.2f}ms  p95 {p95:8.2f}ms  max {latencies[-1]:8.2f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description="首次查看延遲基準測試")
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--think-ms", type=int, default=1000)
+    parser.add_argument("--simulate-ms", type=int, default=0, help="用time.sleep模擬PDF渲染，不需要wkhtmltopdf")
+    args = parser.parse_args()
+
+    if args.simulate_ms:
+        def simulated_render(html_content, timeout=None):
+            time.sleep(args.simulate_ms / 1000)
+            return b"%PDF-simulated"
+        report_service.render_report_pdf = simulated_render
+
+    reports = InMemoryReports()
+    report_service.reports_collection = reports
+    await report_service.prerenderer.start()
+    transport = httpx.ASGITransport(app=report_service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        summarize("before", await first_views(client, reports, "cold", args.reports, args.think_ms, False))
+        summarize("after", await first_views(client, reports, "warm", args.reports, args.think_ms, True))
+        print(f"預渲染統計: {report_service.prerenderer.metrics()}")
+    await report_service.prerenderer.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""推薦索引微基準測試：比較舊的逐層遍歷算法與預建倒排索引的單次請求延遲
+
+用法: python benchmarks/bench_recommendations.py [--scale 100] [--requests 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from recommendation_index import (  # noqa: E402
+    RecommendationIndex,
+    SYMPTOM_CATEGORY,
+    SYSTEM_CATEGORY,
+    CONDITION_CATEGORY,
+)
+
+def legacy_recommend(supplements_data, symptoms, systems, conditions):
+    """舊版 generate_recommendations 的保健品選擇部分"""
+    recommended_supplements = []
+
+    for symptom in symptoms:
+        if symptom in supplements_data.get(SYMPTOM_CATEGORY, {}):
+            for supplement in supplements_data[SYMPTOM_CATEGORY][symptom]:
+                if supplement not in recommended_supplements:
+                    recommended_supplements.append(supplement)
+
+    for system in systems:
+        if system in supplements_data.get(SYSTEM_CATEGORY, {}):
+            for supplement in supplements_data[SYSTEM_CATEGORY][system]:
+                if supplement not in recommended_supplements:
+                    recommended_supplements.append(supplement)
+
+    for condition in conditions:
+        if condition in supplements_data.get(CONDITION_CATEGORY, {}):
+            condition_data = supplements_data[CONDITION_CATEGORY][condition]
+            if isinstance(condition_data, list):
+                for supplement in condition_data:
+                    if supplement not in recommended_supplements:
+                        recommended_supplements.append(supplement)
+            elif isinstance(condition_data, dict):
+                for key, supplements in condition_data.items():
+                    for supplement in supplements:
+                        if supplement not in recommended_supplements:
+                            recommended_supplements.append(supplement)
+
+    if len(recommended_supplements) < 2:
+        for supplement in ["綜合維他命", "魚油", "B群"]:
+            if supplement not in recommended_supplements:
+                recommended_supplements.append(supplement)
+                if len(recommended_supplements) >= 3:
+                    break
+
+    return recommended_supplements
+
+def build_synthetic_catalogue(base, scale):
+    """將原始目錄按 scale 倍複製，名稱和保健品都加上副本編號"""
+    catalogue = {}
+    for category, section in base.items():
+        if not isinstance(section, dict) or category not in (SYMPTOM_CATEGORY, SYSTEM_CATEGORY, CONDITION_CATEGORY):
+            catalogue[category] = section
+            continue
+        scaled = {}
+        for copy in range(scale):
+            for name, value in section.items():
+                # 每份副本與上一份共享一半的保健品，使合併時出現重複
+                if isinstance(value, dict):
+                    scaled[f"{name}#{copy}"] = {
+                        key: [f"{s}#{copy // 2}" for s in items] for key, items in value.items()
+                    }
+                else:
+                    scaled[f"{name}#{copy}"] = [f"{s}#{copy // 2}" for s in value]
+        catalogue[category] = scaled
+    return catalogue
+
+def random_questionnaires(catalogue, count, picks, seed=42):
+    """隨機生成問卷（症狀、身體系統、特定狀況）"""
+    rng = random.Random(seed)
+    symptoms = list(catalogue.get(SYMPTOM_CATEGORY, {}))
+    systems = list(catalogue.get(SYSTEM_CATEGORY, {}))
+    conditions = list(catalogue.get(CONDITION_CATEGORY, {}))
+    return [
+        (
+            rng.sample(symptoms, min(picks, len(symptoms))),
+            rng.sample(systems, min(picks, len(systems))),
+            rng.sample(conditions, min(picks * 2, len(conditions))),
+        )
+        for _ in range(count)
+    ]
+
+def measure(func, questionnaires):
+    """返回每次請求的延遲列表（微秒）"""
+    latencies = []
+    for symptoms, systems, conditions in questionnaires:
+        start = time.perf_counter()
+        func(symptoms, systems, conditions)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return latencies
+
+def summarize(label, latencies):
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    mean = sum(latencies) / len(latencies)
+    print(f"{label:<12} mean={mean:9.1f}µs  p50={p50:9.1f}µs  p99={p99:9.1f}µs")
+
+def main():
+    parser = argparse.ArgumentParser(description="推薦索引微基準測試")
+    parser.add_argument("--catalogue", default=os.path.join(ROOT_DIR, "health_supplements.json"))
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--picks", type=int, default=20, help="每份問卷選擇的症狀/系統數量")
+    args = parser.parse_args()
+
+    with open(args.catalogue, "r", encoding="utf-8") as f:
+        base = json.load(f)
+
+    catalogue = build_synthetic_catalogue(base, args.scale)
+    questionnaires = random_questionnaires(catalogue, args.requests, args.picks)
+
+    start = time.perf_counter()
+    index = RecommendationIndex(catalogue)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # 先驗證兩種算法結果一致
+    for symptoms, systems, conditions in questionnaires[:100]:
+        assert legacy_recommend(catalogue, symptoms, systems, conditions) == index.lookup(symptoms, systems, conditions)
+
+    print(f"目錄規模: {args.scale}x，索引建立耗時 {build_ms:.1f}ms，請求數 {args.requests}")
+    summarize("before", measure(lambda *q: legacy_recommend(catalogue, *q), questionnaires))
+    summarize("after", measure(index.lookup, questionnaires))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""提醒發送結果寫回基準測試：比較每個提醒單獨 update_one 與 ReminderStatusWriter 按塊 bulk_write 的總耗時
+
+默認在本地MongoDB的臨時數據庫中運行，結束後刪除該數據庫。沒有mongod時可加 --simulate，
+在內存中更新文檔並在每次數據庫請求前等待 --rtt-ms 毫秒，只模擬應用服務器和數據庫之間的網絡往返。
+用法: python benchmarks/bench_reminder_status.py [--reminders 10000] [--chunk-sizes 100,500,1000] [--simulate --rtt-ms 0.5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mail_outbox import STATUS_FAILED, STATUS_PENDING, STATUS_SENT  # noqa: E402
+from reminder_queue import ReminderStatusWriter, reminder_outcome  # noqa: E402
+
+class SimulatedCollection:
+    """內存中的提醒集合，每次請求前等待一次網絡往返；bulk_write 在一次往返中執行整塊更新"""
+
+    def __init__(self, rtt_ms):
+        self._rtt = rtt_ms / 1000
+        self._documents = {}
+
+    def _apply(self, query, update):
+        document = self._documents.get(query["_id"])
+        if document is not None:
+            document.update(update.get("$set", {}))
+            for field in update.get("$unset", {}):
+                document.pop(field, None)
+
+    def drop(self):
+        self._documents.clear()
+
+    def insert_many(self, documents):
+        ids = []
+        for position, document in enumerate(documents):
+            document["_id"] = position
+            self._documents[position] = document
+            ids.append(position)
+        return SimpleNamespace(inserted_ids=ids)
+
+    def update_one(self, query, update):
+        time.sleep(self._rtt)
+        self._apply(query, update)
+
+    def bulk_write(self, requests, ordered=True):
+        time.sleep(self._rtt)
+        for request in requests:
+            self._apply(request._filter, request._doc)
+
+    def count_documents(self, query):
+        return sum(all(document.get(field) == value for field, value in query.items())
+                   for document in self._documents.values())
+
+def sample_outcomes(reminder_ids):
+    """發件箱一輪發送的結果：大部分送達，少量等待重試或最終失敗"""
+    now = datetime.now()
+    messages = []
+    for position, reminder_id in enumerate(reminder_ids):
+        message = {"reminder_id": reminder_id, "attempts": 1}
+        if position % 50 == 0:
+            message.update(status=STATUS_FAILED, last_error="550 no such user", failed_at=now)
+        elif position % 10 == 0:
+            message.update(status=STATUS_PENDING, last_error="421 try again later", next_attempt_at=now + timedelta(seconds=30))
+        else:
+            message.update(status=STATUS_SENT, sent_at=now)
+        messages.append(message)
+    return messages
+
+def prepare(collection, reminders):
+    collection.drop()
+    now = datetime.now()
+    result = collection.insert_many([
+        {"user_email": f"user{position}@example.com", "reminder_date": now, "sent": False, "queued_at": now}
+        for position in range(reminders)
+    ])
+    return result.inserted_ids
+
+def per_document(collection, messages):
+    """舊方式：每個提醒一次 update_one"""
+    for message in messages:
+        collection.update_one({"_id": message["reminder_id"]}, reminder_outcome(message)[1])
+
+def chunked(collection, messages, chunk_size, record_size):
+    """新方式：發件箱每批結果交給 ReminderStatusWriter，累積滿一塊時寫回"""
+    writer = ReminderStatusWriter(collection, chunk_size=chunk_size)
+    for start in range(0, len(messages), record_size):
+        writer.record(messages[start:start + record_size])
+    writer.flush()
+    return writer
+
+def main():
+    parser = argparse.ArgumentParser(description="提醒發送結果寫回基準測試")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="health_app_reminder_status_bench")
+    parser.add_argument("--reminders", type=int, default=10000)
+    parser.add_argument("--chunk-sizes", default="100,500,1000", help="逗號分隔的每塊寫回數量")
+    parser.add_argument("--record-size", type=int, default=10, help="發件箱每批交給寫回的結果數")
+    parser.add_argument("--simulate", action="store_true", help="不連接MongoDB，在內存中更新並模擬網絡往返")
+    parser.add_argument("--rtt-ms", type=float, default=0.5)
+    args = parser.parse_args()
+
+    client = None
+    if args.simulate:
+        collection = SimulatedCollection(args.rtt_ms)
+    else:
+        import pymongo
+        client = pymongo.MongoClient(args.mongo)
+        collection = client[args.database]["reminders"]
+
+    try:
+        messages = sample_outcomes(prepare(collection, args.reminders))
+        start = time.perf_counter()
+        per_document(collection, messages)
+        before = time.perf_counter() - start
+        print(f"{'update_one':<16} {before:8.2f}秒  {args.reminders} 次請求")
+
+        for chunk_size in [int(value) for value in args.chunk_sizes.split(",")]:
+            messages = sample_outcomes(prepare(collection, args.reminders))
+            start = time.perf_counter()
+            writer = chunked(collection, messages, chunk_size, args.record_size)
+            elapsed = time.perf_counter() - start
+            print(f"{f'bulk_write/{chunk_size}':<16} {elapsed:8.2f}秒  {writer.chunks} 次請求  提升 {before / elapsed:6.1f}x")
+
+        stored = {status: collection.count_documents({"status": status}) for status in ("sent", "retry", "failed")}
+        assert sum(stored.values()) == args.reminders, f"結果未全部寫回: {stored}"
+        print(f"寫回結果: {stored}")
+    finally:
+        if client is not None:
+            client.drop_database(args.database)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""報告讀取投影基準測試：比較讀取完整報告文檔與各用途投影（渲染、列表、提醒）的傳輸字節數和反序列化耗時
+
+默認連接本地mongod，在 health_app_load_test 庫中寫入樣本報告，以RawBSONDocument讀取得到每份文檔實際傳輸的BSON字節數，
+再分別計時BSON解碼和構建讀取模型對象。沒有mongod時可加 --simulate，在本地按投影裁剪文檔後編碼為BSON測量。
+用法: python benchmarks/bench_report_projection.py [--reports 2000] [--answers 12] [--simulate]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from report_views import ReportListItem, ReportReminderView, ReportRenderView  # noqa: E402
+
+SUPPLEMENTS = ["魚油", "B群", "鎂", "益生菌", "維生素D", "鋅", "葉黃素", "輔酶Q10"]
+VIEWS = (("render", ReportRenderView), ("list", ReportListItem), ("reminder", ReportReminderView))
+
+def sample_report(position, answers):
+    """構造一份接近真實大小的報告：AI問答和每種保健品的劑量、使用方法"""
+    return {
+        "report_id": f"RPT-BENCH-{position:06d}",
+        "created_at": datetime(2025, 1, 1) + timedelta(minutes=position),
+        "email": f"user{position % 500}@example.com",
+        "health_data": {
+            "basicInfo": {"age": "35", "gender": "female", "height": "165", "weight": "55"},
+            "symptoms": ["疲勞", "失眠", "頭痛", "注意力不集中"],
+            "bodySystemIssues": ["消化系統", "免疫系統"],
+            "specificConditions": ["高血壓"],
+            "aiAnswers": {
+                f"問題{i}：請描述您最近一個月在這方面的狀況和頻率？": f"回答{i}：大約每週三到四次，通常在下午或晚上比較明顯，休息後會稍微改善。"
+                for i in range(answers)
+            }
+        },
+        "recommendations": {
+            "supplements": SUPPLEMENTS,
+            "dosage": {name: "每日1-2粒，隨餐服用，連續服用至少8週後評估效果" for name in SUPPLEMENTS},
+            "usage": {name: "建議早餐或午餐後服用，避免與咖啡或茶同時服用以免影響吸收" for name in SUPPLEMENTS},
+            "explanation": "根據您的健康狀況和生活習慣，我們推薦以下保健品組合，以支持能量代謝、睡眠品質和免疫功能。" * 3
+        }
+    }
+
+def apply_projection(doc, projection):
+    """在本地按包含式投影（支持點路徑）裁剪文檔，模擬服務器端投影"""
+    result = {}
+    for path, include in projection.items():
+        if not include:
+            continue
+        source, target = doc, result
+        parts = path.split(".")
+        for part in parts[:-1]:
+            if part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return result
+
+def fetch_raw(reports, projection, simulate, collection):
+    """返回每份報告傳輸的原始BSON"""
+    if simulate:
+        full = [dict(report, _id=bson.ObjectId()) for report in reports]
+        if projection is None:
+            return [bson.encode(doc) for doc in full]
+        return [bson.encode(apply_projection(doc, projection)) for doc in full]
+    raw = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    return [doc.raw for doc in raw.find({}, projection)]
+
+def measure(raws, view, repeat):
+    """返回 (平均字節數, 每份文檔的解碼微秒, 每份文檔的解碼+構建讀取模型微秒)"""
+    size = sum(len(raw) for raw in raws) / len(raws)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        docs = [bson.decode(raw) for raw in raws]
+    decode_us = (time.perf_counter() - start) / repeat / len(raws) * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        docs = [bson.decode(raw) for raw in raws]
+        [view.from_document(doc) for doc in docs]
+    build_us = (time.perf_counter() - start) / repeat / len(raws) * 1e6
+    return size, decode_us, build_us
+
+def main():
+    parser = argparse.ArgumentParser(description="報告讀取投影基準測試")
+    parser.add_argument("--reports", type=int, default=2000)
+    parser.add_argument("--answers", type=int, default=12, help="每份報告的AI問答數")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--simulate", action="store_true", help="不連接MongoDB，在本地裁剪並編碼BSON")
+    args = parser.parse_args()
+
+    reports = [sample_report(position, args.answers) for position in range(args.reports)]
+    collection = None
+    if not args.simulate:
+        from db import get_database
+        collection = get_database("health_app_load_test")["reports"]
+        collection.drop()
+        collection.insert_many(copy.deepcopy(reports))
+
+    try:
+        full_raws = fetch_raw(reports, None, args.simulate, collection)
+        print(f"{'視圖':<10}{'字節/份':>10}{'節省':>8}{'解碼µs':>10}{'解碼+構建µs':>14}{'完整文檔解碼µs':>16}")
+        for label, view in VIEWS:
+            full_size, full_decode, _ = measure(full_raws, view, args.repeat)
+            size, decode_us, build_us = measure(fetch_raw(reports, view.PROJECTION, args.simulate, collection), view, args.repeat)
+            print(f"{label:<10}{size:>10.0f}{1 - size / full_size:>8.0%}{decode_us:>10.1f}{build_us:>14.1f}{full_decode:>16.1f}")
+        print(f"完整文檔平均 {full_size:.0f} 字節/份，共 {args.reports} 份")
+    finally:
+        if collection is not None:
+            collection.drop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""報告渲染基準測試：比較每次請求重新編譯模板與使用已編譯模板的渲染吞吐量
+
+分兩層測量：generate_report_html 函數本身，以及經過 /api/report/{report_id} 端點的完整請求
+（用內存中的報告集合代替MongoDB，只測量渲染和框架開銷）。cached 一行的端點請求命中渲染結果緩存。
+用法: python benchmarks/bench_report_render.py [--renders 2000] [--requests 1000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+import httpx
+import jinja2
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import report_rendering  # noqa: E402
+import report_service  # noqa: E402
+from report_views import ReportRenderView  # noqa: E402
+from template_engine import TEMPLATE_DIR, TEMPLATES  # noqa: E402
+
+SAMPLE_REPORT = {
+    "report_id": "RPT-20250101000000-0001",
+    "created_at": datetime(2025, 1, 1),
+    "email": "someone@example.com",
+    "health_data": {
+        "basicInfo": {"age": "35", "gender": "female", "height": "165", "weight": "55"},
+        "symptoms": ["疲勞", "失眠", "頭痛"],
+        "bodySystemIssues": ["消化系統", "免疫系統"],
+        "specificConditions": ["高血壓"],
+        "aiAnswers": {"您每天睡幾個小時？": "大約5小時", "您每週運動幾次？": "1次"}
+    },
+    "recommendations": {
+        "supplements": ["魚油", "B群", "鎂", "益生菌", "維生素D"],
+        "dosage": {name: "每日1-2粒" for name in ["魚油", "B群", "鎂", "益生菌", "維生素D"]},
+        "usage": {name: "餐後服用" for name in ["魚油", "B群", "鎂", "益生菌", "維生素D"]},
+        "explanation": "根據您的健康狀況推薦以下保健品。"
+    }
+}
+
+SAMPLE_VIEW = ReportRenderView.from_document(SAMPLE_REPORT)
+
+with open(os.path.join(TEMPLATE_DIR, TEMPLATES["report"]), encoding="utf-8") as f:
+    REPORT_TEMPLATE_SOURCE = f.read()
+
+def legacy_render(**context):
+    """舊版每次請求新建Environment並重新編譯模板"""
+    env = jinja2.Environment()
+    return env.from_string(REPORT_TEMPLATE_SOURCE).render(**context)
+
+class InMemoryReports:
+    """只實現find_one的內存報告集合"""
+
+    def find_one(self, query, projection=None):
+        return SAMPLE_REPORT if query.get("report_id") == SAMPLE_REPORT["report_id"] else None
+
+def bench_function(renders):
+    start = time.perf_counter()
+    for _ in range(renders):
+        report_service.generate_report_html(SAMPLE_VIEW)
+    return renders / (time.perf_counter() - start)
+
+async def bench_endpoint(requests):
+    transport = httpx.ASGITransport(app=report_service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        url = f"/api/report/{SAMPLE_REPORT['report_id']}"
+        assert (await client.get(url)).status_code == 200
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.get(url)
+        return requests / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="報告渲染基準測試")
+    parser.add_argument("--renders", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    report_service.reports_collection = InMemoryReports()
+    compiled = report_rendering.render_template
+
+    html_maxsize = report_service.render_cache.html.maxsize
+    results = {}
+    for label, render, cache_size in (
+        ("before", lambda name, **context: legacy_render(**context), 0),
+        ("after", compiled, 0),
+        ("cached", compiled, html_maxsize),
+    ):
+        # 端點會使用渲染結果緩存，前兩組關閉緩存只比較模板編譯
+        report_rendering.render_template = render
+        report_service.render_cache.html.maxsize = cache_size
+        report_service.render_cache.html.clear()
+        results[label] = (bench_function(args.renders), asyncio.run(bench_endpoint(args.requests)))
+    report_rendering.render_template = compiled
+    report_service.render_cache.html.maxsize = html_maxsize
+
+    for label, (function_rate, endpoint_rate) in results.items():
+        print(f"{label:<8} generate_report_html {function_rate:10.0f} 次/秒   /api/report/{{id}} {endpoint_rate:8.0f} 請求/秒")
+    print(f"提升     generate_report_html {results['after'][0] / results['before'][0]:9.1f}x   "
+          f"/api/report/{{id}} {results['after'][1] / results['before'][1]:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""SMTP連接池基準測試：比較每封郵件新建連接（登錄、發送、退出）與複用連接池中已登錄連接的發送吞吐量
+
+使用 aiosmtpd 在本地啟動一個接受登錄、丟棄郵件的SMTP服務器（pip install aiosmtpd）。
+本地連接沒有TLS和網絡延遲，--handshake-ms 在每次EHLO時延遲，模擬真實服務器的TLS握手和登錄開銷。
+用法: python benchmarks/bench_smtp_pool.py [--messages 500] [--concurrency 4] [--handshake-ms 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import smtplib
+import socket
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mail_transport import SmtpConnectionPool  # noqa: E402
+
+USERNAME = "bench@example.com"
+PASSWORD = "secret"
+
+class SinkHandler:
+    """接受並丟棄所有郵件"""
+
+    def __init__(self, handshake_ms):
+        self.handshake_ms = handshake_ms
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        await asyncio.sleep(self.handshake_ms / 1000)
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+def authenticate(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=auth_data.login == USERNAME.encode() and auth_data.password == PASSWORD.encode())
+
+def build_message(position):
+    msg = MIMEMultipart()
+    msg["From"] = USERNAME
+    msg["To"] = f"user{position}@example.com"
+    msg["Subject"] = "健康評估跟進提醒"
+    msg.attach(MIMEText("<p>距離您上次的健康評估已經快三個月了。</p>" * 20, "html"))
+    return msg
+
+def send_fresh(host, port, msg):
+    """舊方式：每封郵件單獨連接、登錄、發送、退出"""
+    server = smtplib.SMTP(host, port, timeout=30)
+    server.login(USERNAME, PASSWORD)
+    server.send_message(msg)
+    server.quit()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run(label, send, messages, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, (build_message(position) for position in range(messages))))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {messages / elapsed:8.1f} 封/秒  ({elapsed:.2f}秒)")
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP連接池基準測試")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--handshake-ms", type=float, default=50.0, help="每次建立連接時模擬的握手延遲")
+    args = parser.parse_args()
+
+    # 本地測試服務器不啟用TLS，關閉aiosmtpd相關的警告和逐條日誌
+    warnings.filterwarnings("ignore", message="Requiring AUTH while not requiring TLS")
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    handler = SinkHandler(args.handshake_ms)
+    controller = Controller(
+        handler,
+        hostname="127.0.0.1",
+        port=free_port(),
+        authenticator=authenticate,
+        auth_required=True,
+        auth_require_tls=False
+    )
+    controller.start()
+    host, port = controller.hostname, controller.port
+    try:
+        before = run("before", lambda msg: send_fresh(host, port, msg), args.messages, args.concurrency)
+        pool = SmtpConnectionPool(USERNAME, PASSWORD, host=host, port=port, size=args.concurrency, starttls=False)
+        after = run("pool", pool.send, args.messages, args.concurrency)
+        metrics = pool.metrics()
+        pool.close()
+        print(f"提升     {after / before:8.1f}x  連接數 {metrics['connects']}，複用率 {metrics['reuse_rate']:.0%}，"
+              f"服務器收到 {handler.received} 封")
+    finally:
+        controller.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""提醒領取多進程測試：多個工作進程同時處理同一批到期提醒，驗證沒有重複發送，並測量吞吐量隨進程數的變化
+
+比較舊方式（每個進程遍歷同一個游標，逐個 update_one 標記後加入發件箱）與 ReminderQueue 的租約批量領取。
+--render-ms 模擬每個提醒渲染郵件模板的耗時。在本地MongoDB的臨時數據庫中運行，結束後刪除該數據庫。
+用法: python benchmarks/concurrent_reminder_claims.py [--mongo mongodb://localhost:27017/] [--reminders 5000] [--workers 1,2,4,8]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pymongo
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mail_outbox import MailOutbox  # noqa: E402
+from migrations import _reminder_claim_indexes, _reminder_indexes  # noqa: E402
+from reminder_queue import ReminderQueue  # noqa: E402
+
+def render(reminder, render_ms):
+    time.sleep(render_ms / 1000)
+    return f"<p>{reminder['user_email']}，距離您上次的健康評估已經快三個月了。</p>"
+
+def legacy_drain(db, outbox, render_ms, due_before):
+    """舊方式：遍歷到期提醒，逐個標記後加入發件箱"""
+    handled = 0
+    for reminder in db["reminders"].find({"reminder_date": {"$lt": due_before}, "sent": False, "queued_at": {"$exists": False}}):
+        claimed = db["reminders"].update_one(
+            {"_id": reminder["_id"], "queued_at": {"$exists": False}},
+            {"$set": {"queued_at": datetime.now()}}
+        )
+        if claimed.modified_count == 0:
+            continue
+        outbox.enqueue(reminder["user_email"], "健康評估跟進提醒", render(reminder, render_ms),
+                       kind="reminder", reminder_id=reminder["_id"])
+        handled += 1
+    return handled
+
+def lease_drain(db, outbox, render_ms, due_before, batch_size):
+    """新方式：按租約批量領取"""
+    queue = ReminderQueue(db["reminders"], outbox, lambda reminder: render(reminder, render_ms))
+    handled = 0
+    while True:
+        claimed, _ = queue.dispatch(batch_size, due_before=due_before)
+        if not claimed:
+            return handled
+        handled += claimed
+
+def worker(mode, mongo, database, render_ms, batch_size, due_before, start, results):
+    client = pymongo.MongoClient(mongo)
+    db = client[database]
+    outbox = MailOutbox(db["mail_outbox"])
+    start.wait()
+    started = time.perf_counter()
+    if mode == "lease":
+        handled = lease_drain(db, outbox, render_ms, due_before, batch_size)
+    else:
+        handled = legacy_drain(db, outbox, render_ms, due_before)
+    results.put((handled, time.perf_counter() - started))
+    client.close()
+
+def prepare(db, reminders):
+    db["reminders"].drop()
+    db["mail_outbox"].drop()
+    _reminder_indexes(db)
+    _reminder_claim_indexes(db)
+    now = datetime.now()
+    db["reminders"].insert_many([
+        {
+            "user_email": f"user{position}@example.com",
+            "report_id": f"RPT-BENCH-{position:06d}",
+            "reminder_date": now - timedelta(seconds=position),
+            "sent": False,
+            "summary": {"gender": "female", "age": "35", "symptoms": ["疲勞"], "supplements": ["魚油", "B群"]}
+        }
+        for position in range(reminders)
+    ])
+
+def run(context, mode, args, workers):
+    client = pymongo.MongoClient(args.mongo)
+    db = client[args.database]
+    prepare(db, args.reminders)
+    start = context.Event()
+    results = context.Queue()
+    due_before = datetime.now() + timedelta(seconds=1)
+    processes = [
+        context.Process(target=worker, args=(mode, args.mongo, args.database, args.render_ms, args.batch_size,
+                                             due_before, start, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # 所有進程連接完成後同時開始
+    time.sleep(1)
+    start.set()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    elapsed = max(seconds for _, seconds in outcomes)
+    queued = db["mail_outbox"].count_documents({})
+    distinct = len(db["mail_outbox"].distinct("reminder_id"))
+    duplicates = queued - distinct
+    missing = args.reminders - distinct
+    client.close()
+    return args.reminders / elapsed, duplicates, missing, [handled for handled, _ in outcomes]
+
+def main():
+    parser = argparse.ArgumentParser(description="提醒領取多進程測試")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="health_app_reminder_claims_bench")
+    parser.add_argument("--reminders", type=int, default=5000)
+    parser.add_argument("--workers", default="1,2,4,8", help="逗號分隔的進程數")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--render-ms", type=float, default=2.0, help="每個提醒模擬的渲染耗時")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    client = pymongo.MongoClient(args.mongo)
+    try:
+        for mode in ("legacy", "lease"):
+            baseline = None
+            for workers in [int(value) for value in args.workers.split(",")]:
+                rate, duplicates, missing, handled = run(context, mode, args, workers)
+                baseline = baseline or rate
+                print(f"{mode:<7} {workers:2d}進程 {rate:9.1f} 個/秒  加速 {rate / baseline:5.2f}x  "
+                      f"重複 {duplicates}  遺漏 {missing}  各進程 {handled}")
+                if mode == "lease":
+                    assert duplicates == 0, f"出現重複郵件: {duplicates}"
+                    assert missing == 0, f"提醒未加入發件箱: {missing}"
+        print("lease: 沒有重複郵件，所有提醒均已加入發件箱")
+    finally:
+        client.drop_database(args.database)
+        client.close()
+
+if __name__ == "__main__":
+    main()
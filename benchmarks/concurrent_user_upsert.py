@@ -0,0 +1,95 @@
+"""用戶寫入並發測試：同一郵箱大量並發提交時，比較舊的 find_one + insert/update 與單次原子upsert
+
+在本地MongoDB的臨時數據庫中運行，結束後刪除該數據庫。
+用法: python benchmarks/concurrent_user_upsert.py [--mongo mongodb://localhost:27017/] [--submissions 500]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from main import build_user_update  # noqa: E402
+
+EMAIL = "concurrent@example.com"
+BASIC_INFO = {"age": "35", "gender": "female", "height": "165", "weight": "55"}
+
+def legacy_write(collection, report_id):
+    """舊的寫入方式：先查詢，再插入或更新"""
+    existing_user = collection.find_one({"email": EMAIL})
+    if existing_user:
+        collection.update_one(
+            {"email": EMAIL},
+            {
+                "$set": {"basic_info": BASIC_INFO, "last_report_id": report_id, "last_assessment_date": datetime.now()},
+                "$push": {"reports": report_id}
+            }
+        )
+    else:
+        collection.insert_one({
+            "email": EMAIL,
+            "basic_info": BASIC_INFO,
+            "last_report_id": report_id,
+            "last_assessment_date": datetime.now(),
+            "reports": [report_id]
+        })
+
+def upsert_write(collection, report_id):
+    """新的寫入方式：與 main.upsert_user 相同的單次原子upsert"""
+    update = build_user_update(BASIC_INFO, [report_id], datetime.now())
+    try:
+        collection.update_one({"email": EMAIL}, update, upsert=True)
+    except DuplicateKeyError:
+        collection.update_one({"email": EMAIL}, update, upsert=True)
+
+def run(label, collection, write, submissions, concurrency):
+    def timed(index):
+        start = time.perf_counter()
+        write(collection, f"RPT-{index:06d}")
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, range(submissions)))
+    elapsed = time.perf_counter() - start
+
+    documents = collection.count_documents({"email": EMAIL})
+    stored = sum(len(user.get("reports", [])) for user in collection.find({"email": EMAIL}, {"reports": 1}))
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<8} 用戶文檔 {documents:4d}  已記錄報告 {stored:5d}/{submissions}  "
+          f"p50 {p50:7.2f}ms  p99 {p99:7.2f}ms  總耗時 {elapsed:6.2f}s")
+    return documents, stored
+
+def main():
+    parser = argparse.ArgumentParser(description="用戶寫入並發測試")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="health_app_upsert_bench")
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo, maxPoolSize=args.concurrency)
+    client.drop_database(args.database)
+    db = client[args.database]
+    try:
+        run("舊方式", db["users_legacy"], legacy_write, args.submissions, args.concurrency)
+
+        users = db["users_upsert"]
+        users.create_index("email", unique=True)
+        documents, stored = run("upsert", users, upsert_write, args.submissions, args.concurrency)
+        assert documents == 1, f"出現重複用戶文檔: {documents}"
+        assert stored == args.submissions, f"報告ID丟失: {stored}/{args.submissions}"
+        print("upsert: 沒有重複用戶，所有報告ID均已記錄")
+    finally:
+        client.drop_database(args.database)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""慢查詢壓力測試：在併發慢查詢期間測量快速請求的p99延遲，比較直接調用pymongo與 db.run_db
+
+直接在 async 處理函數中調用同步pymongo會阻塞整個事件循環；run_db 把調用放到有界線程池中執行。
+默認使用MongoDB的 $where sleep 製造慢查詢（需要本地mongod並允許服務器端JavaScript）；
+沒有mongod時可加 --simulate，用 time.sleep 模擬同步驅動的阻塞。
+用法: python benchmarks/load_slow_queries.py [--slow-ms 200] [--slow-requests 20] [--fast-requests 200] [--simulate]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from db import get_database, run_db  # noqa: E402
+
+def build_app(slow_ms, simulate):
+    """構建包含阻塞和非阻塞兩種慢查詢端點的測試應用"""
+    app = FastAPI()
+    collection = get_database("health_app_load_test")["slow"]
+
+    def slow_query():
+        if simulate:
+            time.sleep(slow_ms / 1000)
+            return None
+        return collection.find_one({"$where": f"sleep({slow_ms}) || true"})
+
+    @app.get("/blocking/slow")
+    async def blocking_slow():
+        slow_query()
+        return {"ok": True}
+
+    @app.get("/async/slow")
+    async def async_slow():
+        await run_db(slow_query)
+        return {"ok": True}
+
+    @app.get("/fast")
+    async def fast():
+        return {"ok": True}
+
+    if not simulate:
+        collection.delete_many({})
+        collection.insert_one({"seed": True})
+    return app
+
+async def measure(client, mode, slow_requests, fast_requests):
+    """併發發出慢請求的同時逐個發出快速請求，返回快速請求延遲（毫秒）"""
+    latencies = []
+
+    async def fast_loop():
+        # 按固定節奏發送，延遲從計劃發送時間算起，事件循環被阻塞的時間也會計入
+        interval = 0.005
+        begin = time.perf_counter()
+        for i in range(fast_requests):
+            scheduled = begin + i * interval
+            await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+            await client.get("/fast")
+            latencies.append((time.perf_counter() - scheduled) * 1000)
+
+    slow = [client.get(f"/{mode}/slow") for _ in range(slow_requests)]
+    await asyncio.gather(fast_loop(), *slow)
+    latencies.sort()
+    return latencies
+
+def summarize(label, latencies):
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<10} 快速請求 p50 {p50:8.2f}ms  p99 {p99:8.2f}ms  max {latencies[-1]:8.2f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description="慢查詢壓力測試")
+    parser.add_argument("--slow-ms", type=int, default=200)
+    parser.add_argument("--slow-requests", type=int, default=20)
+    parser.add_argument("--fast-requests", type=int, default=200)
+    parser.add_argument("--simulate", action="store_true", help="用time.sleep模擬慢查詢，不需要mongod")
+    args = parser.parse_args()
+
+    app = build_app(args.slow_ms, args.simulate)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        summarize("before", await measure(client, "blocking", args.slow_requests, args.fast_requests))
+        summarize("after", await measure(client, "async", args.slow_requests, args.fast_requests))
+
+if __name__ == "__main__":
+    asyncio.run(main())
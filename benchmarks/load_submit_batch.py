@@ -0,0 +1,85 @@
+"""批量提交壓力測試：比較逐條 /api/submit 與 /api/submit/batch 的吞吐量
+
+需要先啟動 main.py 和 MongoDB。
+用法: python benchmarks/load_submit_batch.py [--url http://localhost:8000] [--records 5000] [--batch-size 1000]
+"""
+import argparse
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SYMPTOMS = ["失眠", "止痛", "胃藥", "止瀉", "消炎"]
+SYSTEMS = ["神經系統", "呼吸系統", "消化系統", "骨骼系統", "免疫系統", "心血管系統", "內分泌系統"]
+CONDITIONS = ["掉髮", "健髮", "乾眼症", "氣喘", "過敏性鼻炎", "牙周病", "糖尿病"]
+
+def random_submission(rng, index):
+    return {
+        "healthData": {
+            "basicInfo": {
+                "age": str(rng.randint(18, 80)),
+                "gender": rng.choice(["male", "female"]),
+                "height": str(rng.randint(150, 190)),
+                "weight": str(rng.randint(45, 100))
+            },
+            "symptoms": rng.sample(SYMPTOMS, rng.randint(0, 2)),
+            "bodySystemIssues": rng.sample(SYSTEMS, rng.randint(0, 2)),
+            "specificConditions": rng.sample(CONDITIONS, rng.randint(0, 2)),
+            "aiAnswers": {}
+        },
+        "email": f"loadtest{index % 500}@example.com"
+    }
+
+def post(url, body, content_type="application/json"):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    with urllib.request.urlopen(request, timeout=300) as response:
+        return json.loads(response.read())
+
+def run_single(url, submissions, concurrency):
+    """逐條調用 /api/submit"""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda s: post(f"{url}/api/submit", json.dumps(s).encode("utf-8")), submissions))
+
+def run_batch(url, submissions, batch_size, ndjson):
+    """按批調用 /api/submit/batch，返回失敗記錄數"""
+    failed = 0
+    for start in range(0, len(submissions), batch_size):
+        chunk = submissions[start:start + batch_size]
+        if ndjson:
+            body = "\n".join(json.dumps(s, ensure_ascii=False) for s in chunk).encode("utf-8")
+            result = post(f"{url}/api/submit/batch", body, "application/x-ndjson")
+        else:
+            result = post(f"{url}/api/submit/batch", json.dumps(chunk, ensure_ascii=False).encode("utf-8"))
+        failed += result["failed"]
+    return failed
+
+def report(label, records, elapsed):
+    print(f"{label:<22} {records} 條記錄，耗時 {elapsed:7.2f}s，吞吐量 {records / elapsed:9.1f} 條/秒")
+
+def main():
+    parser = argparse.ArgumentParser(description="批量提交壓力測試")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16, help="逐條提交時的並發數")
+    parser.add_argument("--single-records", type=int, default=1000, help="逐條提交的記錄數")
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    submissions = [random_submission(rng, i) for i in range(args.records)]
+
+    start = time.perf_counter()
+    run_single(args.url, submissions[:args.single_records], args.concurrency)
+    report("/api/submit", args.single_records, time.perf_counter() - start)
+
+    for ndjson in (False, True):
+        start = time.perf_counter()
+        failed = run_batch(args.url, submissions, args.batch_size, ndjson)
+        label = "/api/submit/batch" + (" ndjson" if ndjson else "")
+        report(label, args.records, time.perf_counter() - start)
+        if failed:
+            print(f"  失敗記錄: {failed}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import bson
+
+from dosage_rules import DEFAULT_DOSAGE_RULES, DosageRuleEngine, load_dosage_rules
+from recommendation_index import RecommendationIndex, SYMPTOM_CATEGORY, SYSTEM_CATEGORY, CONDITION_CATEGORY
+
+class CatalogueSnapshot:
+    """某一版本的保健品目錄及其索引，建立後不再修改"""
+
+    __slots__ = ("version", "data", "index", "rules", "dosage", "source", "loaded_at")
+
+    def __init__(self, version: int, data: Dict, source: str, rules: DosageRuleEngine):
+        self.version = version
+        self.data = data
+        self.index = RecommendationIndex(data)
+        self.rules = rules
+        # 預先計算目錄中每種保健品的劑量和使用方法
+        self.dosage = rules.precompute(self.index.supplement_names())
+        self.source = source
+        self.loaded_at = datetime.now()
+
+    def advice(self, supplement: str) -> Tuple[str, str]:
+        """返回保健品的 (劑量, 使用方法)"""
+        advice = self.dosage.get(supplement)
+        if advice is None:
+            advice = self.rules.match(supplement)
+        return advice
+
+def _is_name_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+def validate_catalogue(data) -> Dict:
+    """驗證保健品目錄結構，格式錯誤時拋出ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("保健品目錄必須是JSON對象")
+    for category in (SYMPTOM_CATEGORY, SYSTEM_CATEGORY, CONDITION_CATEGORY):
+        section = data.get(category, {})
+        if not isinstance(section, dict):
+            raise ValueError(f"分類 {category} 必須是對象")
+        for name, value in section.items():
+            if _is_name_list(value):
+                continue
+            if category == CONDITION_CATEGORY and isinstance(value, dict) and all(
+                _is_name_list(items) for items in value.values()
+            ):
+                continue
+            raise ValueError(f"分類 {category} 中的 {name} 格式不正確")
+    return data
+
+def load_catalogue_file(path: str) -> Dict:
+    """從JSON文件讀取保健品目錄"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_catalogue_documents(collection) -> List[Dict]:
+    """按插入順序讀取supplements集合中構成目錄的字段"""
+    return list(collection.find({}, {"_id": 0, "category": 1, "subcategory": 1, "usage": 1, "product": 1}).sort("_id", 1))
+
+def catalogue_digest(docs: List[Dict]) -> str:
+    """目錄文檔的內容摘要，任何文檔被增刪或原地修改時都會改變"""
+    digest = hashlib.sha1()
+    for doc in docs:
+        digest.update(bson.encode(doc))
+    return digest.hexdigest()
+
+def load_catalogue_collection(collection, docs: Optional[List[Dict]] = None) -> Dict:
+    """從init_db.py寫入的supplements集合重建保健品目錄"""
+    data = {}
+    for doc in docs if docs is not None else read_catalogue_documents(collection):
+        category = doc.get("category")
+        subcategory = doc.get("subcategory")
+        if not category or not subcategory:
+            continue
+        section = data.setdefault(category, {})
+        if doc.get("usage"):
+            section.setdefault(subcategory, {}).setdefault(doc["usage"], []).append(doc["product"])
+        else:
+            section.setdefault(subcategory, []).append(doc["product"])
+    return data
+
+class CatalogueManager:
+    """監視保健品目錄和劑量規則，在後台重新加載並原子替換快照"""
+
+    def __init__(self, path: str = "data/health_supplements.json", collection=None,
+                 rules_path: str = "data/dosage_rules.json", poll_interval: float = 5.0):
+        self.path = path
+        self.rules_path = rules_path
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.source = "mongodb" if collection is not None else path
+        self._snapshot = CatalogueSnapshot(0, {}, self.source, DosageRuleEngine(DEFAULT_DOSAGE_RULES))
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._fingerprint = None
+        # 計算指紋時讀取的集合文檔，需要重新加載時直接使用
+        self._documents: Optional[List[Dict]] = None
+        self._listeners: List[Callable[[CatalogueSnapshot], None]] = []
+        self.reload_count = 0
+        self.reload_failures = 0
+        self.last_reload_seconds = 0.0
+        self.last_reload_at = None
+        self.last_error = None
+
+    def current(self) -> CatalogueSnapshot:
+        """獲取當前快照；請求應在開始時取得一次並全程使用"""
+        return self._snapshot
+
+    def add_listener(self, listener: Callable[[CatalogueSnapshot], None]):
+        """註冊快照替換後的回調（例如清空推薦緩存）"""
+        self._listeners.append(listener)
+
+    def _read_fingerprint(self):
+        """讀取來源的變更標記，用於判斷是否需要重新加載"""
+        try:
+            stat = os.stat(self.rules_path)
+            rules_fingerprint = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            rules_fingerprint = None
+        if self.collection is not None:
+            # 按內容計算指紋，原地修改的文檔也會觸發重新加載；目錄只有數百條短文檔，每次輪詢全部讀取的代價很小
+            self._documents = read_catalogue_documents(self.collection)
+            return (catalogue_digest(self._documents), rules_fingerprint)
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size, rules_fingerprint)
+
+    def _load(self) -> Dict:
+        if self.collection is not None:
+            return load_catalogue_collection(self.collection, self._documents)
+        return load_catalogue_file(self.path)
+
+    def reload(self, force: bool = False) -> bool:
+        """解析、驗證並建立新快照，成功後原子替換；返回是否發生了替換"""
+        with self._reload_lock:
+            start = time.perf_counter()
+            try:
+                fingerprint = self._read_fingerprint()
+                if not force and fingerprint == self._fingerprint:
+                    return False
+                data = validate_catalogue(self._load())
+                rules = load_dosage_rules(self.rules_path)
+                snapshot = CatalogueSnapshot(self._snapshot.version + 1, data, self.source, rules)
+            except Exception as e:
+                # 加載失敗時保留舊快照，而不是退回空目錄
+                error = f"{type(e).__name__}: {e}"
+                self.reload_failures += 1
+                if error != self.last_error:
+                    print(f"加載保健品目錄失敗 ({self.source}): {e}")
+                self.last_error = error
+                return False
+
+            self._snapshot = snapshot
+            self._fingerprint = fingerprint
+            self.reload_count += 1
+            self.last_reload_seconds = time.perf_counter() - start
+            self.last_reload_at = snapshot.loaded_at
+            self.last_error = None
+
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"保健品目錄更新回調出錯: {e}")
+        return True
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.reload()
+
+    def start(self):
+        """啟動後台監視線程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="catalogue-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止後台監視線程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval)
+            self._thread = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回目錄版本和重新加載統計"""
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "source": self.source,
+            "loaded_at": snapshot.loaded_at,
+            "reload_count": self.reload_count,
+            "reload_failures": self.reload_failures,
+            "last_reload_seconds": self.last_reload_seconds,
+            "last_reload_at": self.last_reload_at,
+            "last_error": self.last_error
+        }
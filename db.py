@@ -0,0 +1,183 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import pymongo
+from pymongo import monitoring
+
+# MongoDB連接配置（可通過環境變量調整）
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.environ.get("MONGO_DATABASE", "health_app")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+MONGO_WRITE_CONCERN = os.environ.get("MONGO_WRITE_CONCERN", "1")
+
+# 執行同步pymongo調用的線程數，默認與連接池大小一致
+MONGO_EXECUTOR_WORKERS = int(os.environ.get("MONGO_EXECUTOR_WORKERS", str(MONGO_MAX_POOL_SIZE)))
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """統計連接池的借出數量和等待時間"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        wait = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": self.total_wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000
+            }
+
+_lock = threading.Lock()
+_pid = None
+_client = None
+_executor = None
+_pool_listener = None
+_executor_in_flight = 0
+
+def _write_concern():
+    return int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+
+def _ensure_process_state():
+    """為當前進程延遲創建客戶端和線程池（fork後重新創建）"""
+    global _pid, _client, _executor, _pool_listener, _executor_in_flight
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pool_listener = PoolStatsListener()
+        # connect=False：首次操作時才建立連接，導入模塊不做任何網絡工作
+        _client = pymongo.MongoClient(
+            MONGO_URI,
+            connect=False,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            readPreference=MONGO_READ_PREFERENCE,
+            w=_write_concern(),
+            event_listeners=[_pool_listener]
+        )
+        _executor = ThreadPoolExecutor(max_workers=MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+        _executor_in_flight = 0
+        _pid = os.getpid()
+
+def get_client() -> pymongo.MongoClient:
+    """獲取當前進程共享的MongoDB客戶端"""
+    _ensure_process_state()
+    return _client
+
+def get_database(name: str = MONGO_DATABASE):
+    """獲取共享客戶端上的數據庫"""
+    return get_client()[name]
+
+class LazyCollection:
+    """集合代理，首次使用時才創建客戶端，可以在模塊導入時安全定義"""
+
+    __slots__ = ("_name", "_database")
+
+    def __init__(self, name: str, database: str = MONGO_DATABASE):
+        self._name = name
+        self._database = database
+
+    def __getattr__(self, attr):
+        return getattr(get_database(self._database)[self._name], attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._database}.{self._name})"
+
+def get_collection(name: str, database: str = MONGO_DATABASE) -> LazyCollection:
+    """獲取延遲連接的集合"""
+    return LazyCollection(name, database)
+
+async def run_db(func, *args, **kwargs):
+    """在有界線程池中執行同步的數據庫操作，避免阻塞事件循環"""
+    global _executor_in_flight
+    _ensure_process_state()
+    loop = asyncio.get_running_loop()
+    _executor_in_flight += 1
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        _executor_in_flight -= 1
+
+def pool_stats() -> Dict[str, Any]:
+    """返回連接池和數據庫線程池的統計數據"""
+    if _pid != os.getpid():
+        return {"initialized": False}
+    stats = _pool_listener.stats()
+    stats.update({
+        "initialized": True,
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "executor_workers": MONGO_EXECUTOR_WORKERS,
+        "executor_in_flight": _executor_in_flight
+    })
+    return stats
@@ -0,0 +1,122 @@
+import json
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 內置規則，與原來 generate_recommendations 中的 if/elif 判斷順序一致
+DEFAULT_DOSAGE_RULES = {
+    "default": {"dosage": "每日1次，每次1片", "usage": "飯後服用，效果更佳"},
+    "exact": {},
+    "contains": [
+        {"keyword": "鈣", "dosage": "每日1-2次，每次1片", "usage": "飯後服用，避免與茶、咖啡同時服用"},
+        {"keyword": "B群", "dosage": "每日1次，每次1片", "usage": "早餐後服用，增加能量代謝"},
+        {"keyword": "魚油", "dosage": "每日1次，每次1-2粒", "usage": "餐後服用，幫助吸收"},
+        {"keyword": "OPC", "dosage": "每日1次，每次1匙", "usage": "早上空腹服用，用30ml水調勻"},
+        {"keyword": "酵素", "dosage": "每餐前服用，每次1-2粒", "usage": "餐前15-30分鐘服用，幫助消化"},
+        {"keyword": "蘆薈", "dosage": "每日2-3次，每次30ml", "usage": "稀釋後飲用，可緩解發炎症狀"}
+    ]
+}
+
+Advice = Tuple[str, str]
+
+def _advice(rule, where: str) -> Advice:
+    if not isinstance(rule, dict) or not isinstance(rule.get("dosage"), str) or not isinstance(rule.get("usage"), str):
+        raise ValueError(f"劑量規則 {where} 缺少dosage或usage")
+    return (rule["dosage"], rule["usage"])
+
+class KeywordAutomaton:
+    """Aho–Corasick自動機，返回名稱中出現的優先級最高（序號最小）的關鍵詞"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[Optional[int]] = [None]
+        for priority, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._output.append(None)
+                node = next_node
+            # 相同關鍵詞保留先出現的規則
+            if self._output[node] is None:
+                self._output[node] = priority
+
+        # 廣度優先建立失敗指針，並把後綴節點的最佳輸出合併進來
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                inherited = self._output[self._fail[child]]
+                if inherited is not None and (self._output[child] is None or inherited < self._output[child]):
+                    self._output[child] = inherited
+                queue.append(child)
+
+    def search(self, text: str) -> Optional[int]:
+        """返回命中的最小規則序號，沒有命中時返回None"""
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        best = None
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = output[node]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+        return best
+
+class DosageRuleEngine:
+    """表驅動的劑量/使用方法規則：精確名稱 -> 關鍵詞（按順序優先）-> 默認"""
+
+    def __init__(self, rules: Dict):
+        if not isinstance(rules, dict):
+            raise ValueError("劑量規則必須是JSON對象")
+        self.default = _advice(rules.get("default"), "default")
+        exact = rules.get("exact", {})
+        if not isinstance(exact, dict):
+            raise ValueError("劑量規則 exact 必須是對象")
+        self.exact = {name: _advice(rule, name) for name, rule in exact.items()}
+        contains = rules.get("contains", [])
+        if not isinstance(contains, list):
+            raise ValueError("劑量規則 contains 必須是列表")
+        keywords = []
+        self.keyword_advice: List[Advice] = []
+        for position, rule in enumerate(contains):
+            keyword = rule.get("keyword") if isinstance(rule, dict) else None
+            if not isinstance(keyword, str) or not keyword:
+                raise ValueError(f"劑量規則 contains[{position}] 缺少keyword")
+            keywords.append(keyword)
+            self.keyword_advice.append(_advice(rule, keyword))
+        self.automaton = KeywordAutomaton(keywords)
+
+    def match(self, supplement: str) -> Advice:
+        """返回保健品的 (劑量, 使用方法)"""
+        advice = self.exact.get(supplement)
+        if advice is not None:
+            return advice
+        priority = self.automaton.search(supplement)
+        if priority is not None:
+            return self.keyword_advice[priority]
+        return self.default
+
+    def precompute(self, supplements: Iterable[str]) -> Dict[str, Advice]:
+        """為目錄中的所有保健品預先計算劑量和使用方法"""
+        return {supplement: self.match(supplement) for supplement in supplements}
+
+def load_dosage_rules(path: str) -> DosageRuleEngine:
+    """從JSON文件加載劑量規則，文件不存在時使用內置規則"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+    except FileNotFoundError:
+        rules = DEFAULT_DOSAGE_RULES
+    return DosageRuleEngine(rules)
@@ -1,4 +1,5 @@
-from pymongo import MongoClient
+from db import get_database
+from migrations import run_migrations
 import json
 from datetime import datetime
 import os
@@ -6,19 +7,11 @@ import os
 # 資料庫初始化腳本
 def initialize_database():
     try:
-        # 連接到MongoDB
-        client = MongoClient('mongodb://localhost:27017/')
+        # 創建或獲取資料庫（連接配置見db.py）
+        db = get_database()
         
-        # 創建或獲取資料庫
-        db = client['health_app']
-        
-        # 創建集合
-        users_collection = db['users']
-        recommendations_collection = db['recommendations']
-        
-        # 創建索引
-        users_collection.create_index([('created_at', -1)])
-        recommendations_collection.create_index([('user_id', 1)])
+        # 創建索引（版本化遷移，可重複執行）
+        run_migrations(db)
         
         # 載入保健品資料
         supplements_data = {}
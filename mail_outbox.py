@@ -0,0 +1,323 @@
+import asyncio
+import os
+import random
+import smtplib
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import Binary
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from db import run_db
+
+# 發件箱發送配置（可通過環境變量調整）
+# Gmail對每個賬號有發送頻率和每日數量限制，默認每分鐘20封
+MAIL_RATE_PER_MINUTE = float(os.environ.get("MAIL_RATE_PER_MINUTE", "20"))
+MAIL_RATE_BURST = int(os.environ.get("MAIL_RATE_BURST", "10"))
+MAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("MAIL_OUTBOX_BATCH_SIZE", "10"))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", "5"))
+# 第一次重試的等待秒數，之後每次翻倍，最多等待 MAIL_MAX_RETRY_DELAY 秒
+MAIL_RETRY_DELAY = float(os.environ.get("MAIL_RETRY_DELAY", "30"))
+MAIL_MAX_RETRY_DELAY = float(os.environ.get("MAIL_MAX_RETRY_DELAY", "3600"))
+MAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get("MAIL_OUTBOX_POLL_INTERVAL", "2"))
+MAIL_OUTBOX_LEASE = float(os.environ.get("MAIL_OUTBOX_LEASE", "300"))
+
+# 發件箱狀態：待發送 -> 發送中 -> 已發送 / 失敗
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+class MailSettingsError(Exception):
+    """郵件設置不完整：保存設置後可以成功，郵件保持等待重試"""
+
+def mail_settings_complete(email_settings: Dict[str, str]) -> bool:
+    """郵件設置是否可以用於發送"""
+    return bool(email_settings.get("gmail_user") and email_settings.get("gmail_password"))
+
+def is_permanent_error(error: Exception) -> bool:
+    """收件人被拒收、郵件被拒絕等重試也不會成功的錯誤"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # 賬號或密碼錯誤：修改郵件設置後可以成功
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+def build_mime_message(message: Dict[str, Any], sender: str) -> MIMEMultipart:
+    """把發件箱中的郵件轉換為MIME郵件"""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = message["to"]
+    msg['Subject'] = message["subject"]
+    msg.attach(MIMEText(message["html"], 'html'))
+    for attachment in message.get("attachments", []):
+        part = MIMEApplication(bytes(attachment["content"]), _subtype=attachment.get("subtype", "octet-stream"))
+        part.add_header('Content-Disposition', 'attachment', filename=attachment["filename"])
+        msg.attach(part)
+    return msg
+
+class MailOutbox:
+    """保存在MongoDB中的發件箱：郵件先寫入集合，再由 OutboxWorker 發送"""
+
+    def __init__(self, collection, lease: float = MAIL_OUTBOX_LEASE):
+        self.collection = collection
+        # 發送中的郵件超過這個秒數沒有完成（工作進程崩潰）時重新發送
+        self.lease = lease
+
+    def _message(self, to: str, subject: str, html: str, attachments: Optional[List[Dict[str, Any]]] = None,
+                 kind: str = "mail", reminder_id: Any = None) -> Dict[str, Any]:
+        now = datetime.now()
+        message = {
+            "to": to,
+            "subject": subject,
+            "html": html,
+            "attachments": [
+                {"filename": item["filename"], "content": Binary(item["content"]), "subtype": item.get("subtype", "pdf")}
+                for item in attachments or []
+            ],
+            "kind": kind,
+            "status": STATUS_PENDING,
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now
+        }
+        if reminder_id is not None:
+            message["reminder_id"] = reminder_id
+            # 最終結果寫回提醒後設為True；進程在寫回前崩潰時由 ReminderStatusWriter.reconcile 補寫
+            message["reminder_synced"] = False
+        return message
+
+    def enqueue(self, to: str, subject: str, html: str, attachments: Optional[List[Dict[str, Any]]] = None,
+                kind: str = "mail", reminder_id: Any = None) -> Any:
+        """加入發件箱，返回郵件ID；attachments 為 [{"filename", "content", "subtype"}]"""
+        return self.collection.insert_one(self._message(to, subject, html, attachments, kind, reminder_id)).inserted_id
+
+    def enqueue_many(self, messages: List[Dict[str, Any]]) -> int:
+        """批量加入發件箱（每項為 enqueue 的參數），返回新加入的郵件數
+
+        同一提醒只會加入一次（mail_outbox.reminder_id 唯一索引）：提醒的領取租約過期後被重新領取時，
+        已經加入過的郵件被跳過，不會重複發送。
+        """
+        if not messages:
+            return 0
+        try:
+            return len(self.collection.insert_many([self._message(**message) for message in messages], ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
+
+    def claim(self, worker_id: str, limit: int) -> List[Dict[str, Any]]:
+        """原子地領取最多limit封到期的郵件（包括租約過期的發送中郵件）
+
+        先按下次發送時間選出候選郵件，再用一次 update_many 條件更新寫入領取令牌，
+        已被其他工作任務搶先領取的候選郵件不會被更新；最後按令牌一次讀回本次領取的郵件。
+        """
+        now = datetime.now()
+        due = {"$or": [
+            {"status": STATUS_PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": STATUS_SENDING, "claimed_at": {"$lt": now - timedelta(seconds=self.lease)}}
+        ]}
+        candidates = [
+            message["_id"]
+            for message in self.collection.find(due, {"_id": 1}).sort("next_attempt_at", 1).limit(limit)
+        ]
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        result = self.collection.update_many(
+            {**due, "_id": {"$in": candidates}},
+            {"$set": {"status": STATUS_SENDING, "claimed_by": worker_id, "claim_token": token, "claimed_at": now}}
+        )
+        if not result.modified_count:
+            return []
+        return list(self.collection.find({"_id": {"$in": candidates}, "claim_token": token}).sort("next_attempt_at", 1))
+
+    def complete(self, outcomes: List[Dict[str, Any]]):
+        """批量寫回一批郵件的發送結果"""
+        if outcomes:
+            self.collection.bulk_write([
+                UpdateOne({"_id": outcome["_id"], "status": STATUS_SENDING}, {"$set": outcome["set"]})
+                for outcome in outcomes
+            ], ordered=False)
+
+    def depth(self) -> Dict[str, int]:
+        """各狀態的郵件數"""
+        counts = {status: 0 for status in (STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED)}
+        for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+class TokenBucket:
+    """令牌桶限速：平均每秒 rate 個令牌，最多累積 capacity 個"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """取得一個令牌，不足時等待"""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class OutboxWorker:
+    """發件箱工作任務：分批領取到期郵件，按令牌桶限速發送，失敗時以指數退避重試
+
+    send 同步發送一封發件箱郵件（在線程池中執行）。on_complete 在結果寫回發件箱後，以同一批郵件
+    （包含本次發送結果：status 為 sent、failed，或等待重試的 pending 和 next_attempt_at）調用（在線程池中執行）。
+    多個進程可以同時運行工作任務，
+    郵件通過原子更新領取，不會重複發送；限速按進程計算。
+    """
+
+    def __init__(self, outbox: MailOutbox, send: Callable[[Dict[str, Any]], Any],
+                 on_complete: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 rate_per_minute: float = MAIL_RATE_PER_MINUTE, burst: int = MAIL_RATE_BURST,
+                 batch_size: int = MAIL_OUTBOX_BATCH_SIZE, max_attempts: int = MAIL_MAX_ATTEMPTS,
+                 retry_delay: float = MAIL_RETRY_DELAY, max_retry_delay: float = MAIL_MAX_RETRY_DELAY,
+                 poll_interval: float = MAIL_OUTBOX_POLL_INTERVAL):
+        self.outbox = outbox
+        self._send = send
+        self._on_complete = on_complete
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._sent_times = deque()
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """啟動後台發送任務"""
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止發送；正在發送的郵件在租約過期後由其他工作任務重新領取"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """有新郵件加入時立即領取，不等下一次輪詢"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        # 加入隨機抖動，避免大量郵件同時重試
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _deliver(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """發送一封郵件，返回要寫回發件箱的結果"""
+        await self.bucket.acquire()
+        attempts = message.get("attempts", 0) + 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._send, message)
+        except MailSettingsError as e:
+            # 郵件設置不完整不是郵件本身的問題：不計入嘗試次數，按等待次數退避，保存設置後繼續發送
+            self.last_error = str(e)
+            self.retries += 1
+            waits = message.get("settings_waits", 0) + 1
+            delay = self._backoff(waits)
+            print(f"郵件設置不完整（{message['to']}），{delay:.0f}秒後重試")
+            return {"_id": message["_id"], "set": {
+                "status": STATUS_PENDING, "settings_waits": waits, "last_error": str(e),
+                "next_attempt_at": datetime.now() + timedelta(seconds=delay)
+            }}
+        except Exception as e:
+            self.last_error = str(e)
+            if is_permanent_error(e) or attempts >= self.max_attempts:
+                self.failed += 1
+                print(f"郵件發送失敗（{message['to']}，第{attempts}次），不再重試: {e}")
+                return {"_id": message["_id"], "set": {
+                    "status": STATUS_FAILED, "attempts": attempts, "last_error": str(e), "failed_at": datetime.now()
+                }}
+            self.retries += 1
+            delay = self._backoff(attempts)
+            print(f"郵件發送失敗（{message['to']}，第{attempts}次），{delay:.0f}秒後重試: {e}")
+            return {"_id": message["_id"], "set": {
+                "status": STATUS_PENDING, "attempts": attempts, "last_error": str(e),
+                "next_attempt_at": datetime.now() + timedelta(seconds=delay)
+            }}
+        self.sent += 1
+        self._sent_times.append(time.monotonic())
+        return {"_id": message["_id"], "set": {"status": STATUS_SENT, "attempts": attempts, "sent_at": datetime.now()}}
+
+    async def _run_batch(self, batch: List[Dict[str, Any]]):
+        outcomes = await asyncio.gather(*(self._deliver(message) for message in batch))
+        await run_db(self.outbox.complete, outcomes)
+        self.batches += 1
+        # 回調收到的郵件包含本次發送的結果（sent_at、last_error等）
+        if self._on_complete is not None:
+            await run_db(self._on_complete, [{**message, **outcome["set"]} for message, outcome in zip(batch, outcomes)])
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await run_db(self.outbox.claim, self.worker_id, self.batch_size)
+                if batch:
+                    await self._run_batch(batch)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"處理發件箱時出錯: {e}")
+            # 沒有到期郵件（或出錯）時等待新郵件或下一次輪詢
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回發送速率和失敗統計（發件箱深度通過 MailOutbox.depth 查詢）"""
+        now = time.monotonic()
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "worker_id": self.worker_id,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "batches": self.batches,
+            "sent_last_minute": len(self._sent_times),
+            "rate_limit_per_minute": self.bucket.rate * 60,
+            "tokens": round(self.bucket.tokens, 2),
+            "last_error": self.last_error
+        }
@@ -0,0 +1,233 @@
+import os
+import smtplib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# SMTP服務器和連接池配置（可通過環境變量調整）
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "30"))
+# 同時發送的最大連接數
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "4"))
+# 空閒超過這個秒數的連接直接關閉（服務器通常會斷開長時間空閒的連接）
+SMTP_IDLE_TIMEOUT = float(os.environ.get("SMTP_IDLE_TIMEOUT", "120"))
+# 空閒超過這個秒數的連接在使用前先發送NOOP檢查
+SMTP_CHECK_AFTER = float(os.environ.get("SMTP_CHECK_AFTER", "10"))
+# 每個連接最多發送的郵件數，之後重新連接
+SMTP_MAX_MESSAGES = int(os.environ.get("SMTP_MAX_MESSAGES", "100"))
+# 等待空閒連接的秒數
+SMTP_ACQUIRE_TIMEOUT = float(os.environ.get("SMTP_ACQUIRE_TIMEOUT", "30"))
+
+class MailPoolTimeoutError(Exception):
+    """等待空閒SMTP連接超時"""
+
+def is_connection_error(error: Exception) -> bool:
+    """錯誤是否表示連接已不可用（需要換新連接），而不是郵件本身被拒絕"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 421：服務器即將關閉連接
+        return error.smtp_code == 421
+    # SMTPException 也是 OSError 的子類，其餘SMTP錯誤說明連接仍然可用
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+class PooledConnection:
+    """連接池中的一個已登錄SMTP連接"""
+
+    __slots__ = ("smtp", "created_at", "last_used", "sent")
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.sent = 0
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+class SmtpConnectionPool:
+    """保持登錄狀態的SMTP連接池：複用連接，避免每封郵件都重新握手TLS和登錄
+
+    size 限制同時使用的連接數。空閒較久的連接在使用前用NOOP檢查，連接斷開時自動重連並重試一次。
+    send 在調用線程中同步執行，服務中通過線程池或後台任務調用。
+    """
+
+    def __init__(self, username: str, password: str, host: str = SMTP_HOST, port: int = SMTP_PORT,
+                 size: int = SMTP_POOL_SIZE, starttls: bool = SMTP_STARTTLS, timeout: float = SMTP_TIMEOUT,
+                 idle_timeout: float = SMTP_IDLE_TIMEOUT, check_after: float = SMTP_CHECK_AFTER,
+                 max_messages: int = SMTP_MAX_MESSAGES, acquire_timeout: float = SMTP_ACQUIRE_TIMEOUT):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.size = size
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.max_messages = max_messages
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: List[PooledConnection] = []
+        self._closed = False
+        self.in_use = 0
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.health_check_failures = 0
+        self.sent = 0
+        self.failed = 0
+        self._total_connect = 0.0
+        self._total_send = 0.0
+
+    def _connect(self) -> PooledConnection:
+        started = time.perf_counter()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.connects += 1
+            self._total_connect += time.perf_counter() - started
+        return PooledConnection(smtp)
+
+    def _is_healthy(self, connection: PooledConnection) -> bool:
+        """檢查空閒連接是否可用：超過空閒時間或發送數上限的不再使用，空閒較久的發送NOOP"""
+        now = time.monotonic()
+        if connection.sent >= self.max_messages or now - connection.last_used > self.idle_timeout:
+            return False
+        if now - connection.last_used < self.check_after:
+            return True
+        try:
+            code, _ = connection.smtp.noop()
+        except Exception:
+            code = None
+        if code != 250:
+            with self._lock:
+                self.health_check_failures += 1
+            return False
+        return True
+
+    def _acquire(self) -> Tuple[PooledConnection, bool]:
+        """取出一個可用連接，返回 (連接, 是否複用)"""
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                return self._connect(), False
+            if self._is_healthy(connection):
+                return connection, True
+            connection.close()
+
+    def _release(self, connection: PooledConnection):
+        connection.last_used = time.monotonic()
+        with self._lock:
+            if not self._closed and connection.sent < self.max_messages:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def send(self, msg) -> Dict[str, Any]:
+        """發送一封郵件，返回被拒收的收件人；連接斷開時用新連接重試一次，其他錯誤直接拋出"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise MailPoolTimeoutError(f"{self.acquire_timeout}秒內沒有空閒的SMTP連接")
+        with self._lock:
+            self.in_use += 1
+        try:
+            for attempt in range(2):
+                connection, reused = self._acquire()
+                started = time.perf_counter()
+                try:
+                    refused = connection.smtp.send_message(msg)
+                except Exception as e:
+                    if not is_connection_error(e):
+                        # 收件人被拒收等錯誤：連接仍然可用
+                        self._release(connection)
+                        raise
+                    connection.smtp.close()
+                    # 只有複用的連接可能是服務器已斷開的舊連接，新連接出錯時不再重試
+                    if attempt == 0 and reused:
+                        with self._lock:
+                            self.reconnects += 1
+                        continue
+                    raise
+                connection.sent += 1
+                with self._lock:
+                    self.sent += 1
+                    self.reuses += 1 if reused else 0
+                    self._total_send += time.perf_counter() - started
+                self._release(connection)
+                return refused
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def close(self):
+        """關閉所有空閒連接，正在使用的連接在歸還時關閉"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回連接數、複用率和發送耗時統計"""
+        with self._lock:
+            return {
+                "host": f"{self.host}:{self.port}",
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "reconnects": self.reconnects,
+                "health_check_failures": self.health_check_failures,
+                "sent": self.sent,
+                "failed": self.failed,
+                "reuse_rate": self.reuses / self.sent if self.sent else 0.0,
+                "avg_connect_ms": self._total_connect / self.connects * 1000 if self.connects else 0.0,
+                "avg_send_ms": self._total_send / self.sent * 1000 if self.sent else 0.0
+            }
+
+# 每組登錄憑證一個連接池；郵件設置修改後舊連接池會被關閉
+_pool: Optional[SmtpConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_mail_pool(username: str, password: str) -> SmtpConnectionPool:
+    """返回當前郵件賬號的SMTP連接池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or (_pool.username, _pool.password) != (username, password):
+            if _pool is not None:
+                _pool.close()
+            _pool = SmtpConnectionPool(username, password)
+        return _pool
+
+def close_mail_pool():
+    """關閉SMTP連接池（服務關閉時調用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def mail_pool_metrics() -> Dict[str, Any]:
+    """返回SMTP連接池統計，尚未發送過郵件時返回空字典"""
+    with _pool_lock:
+        return _pool.metrics() if _pool is not None else {}
@@ -1,13 +1,26 @@
 from fastapi import FastAPI, HTTPException, Depends, Body, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr
-from typing import List, Dict, Optional, Any
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure
+from typing import Awaitable, Callable, List, Dict, Optional, Any
+import asyncio
 import json
 import os
+import urllib.request
 import pymongo
 from datetime import datetime
 import random
+from catalogue import CatalogueManager, CatalogueSnapshot
+from recommendation_cache import RecommendationCache, questionnaire_signature
+from db import get_collection, pool_stats, run_db
+from reminder_queue import ensure_pending_reminder_index, upsert_pending_reminders
+from report_views import ReportReminderView
+from settings_cache import SETTINGS_CHANGE_STREAM, SettingsCache
+from write_behind import QueueFullError, WriteBehindQueue
 
 # 創建FastAPI應用
 app = FastAPI(title="健康問卷與保健品推薦系統API")
@@ -24,20 +37,14 @@ app.add_middleware(
 # 確保數據目錄存在
 os.makedirs("data", exist_ok=True)
 
-# 加載保健品數據
-try:
-    with open("data/health_supplements.json", "r", encoding="utf-8") as f:
-        supplements_data = json.load(f)
-except FileNotFoundError:
-    supplements_data = {}
-
 # 連接到MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
-    db = client["health_app"]
-    users_collection = db["users"]
-    reports_collection = db["reports"]
-    products_collection = db["products"]
+    users_collection = get_collection("users")
+    reports_collection = get_collection("reports")
+    products_collection = get_collection("products")
+    reminders_collection = get_collection("reminders")
+    # 提醒設置由管理服務修改，提交問卷時經緩存讀取
+    settings_cache = SettingsCache(get_collection("settings"))
 except Exception as e:
     print(f"MongoDB連接錯誤: {e}")
     # 如果無法連接到MongoDB，使用內存存儲作為備用
@@ -45,6 +52,25 @@ except Exception as e:
     reports_db = []
     products_db = []
 
+# 批量提交的最大記錄數
+SUBMIT_BATCH_MAX_SIZE = int(os.environ.get("SUBMIT_BATCH_MAX_SIZE", "10000"))
+
+# 推薦結果緩存（大小和TTL可通過環境變量配置）
+recommendation_cache = RecommendationCache(
+    maxsize=int(os.environ.get("RECOMMENDATION_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("RECOMMENDATION_CACHE_TTL", "3600"))
+)
+
+# 加載保健品數據和劑量規則（SUPPLEMENTS_SOURCE=mongodb 時從init_db.py寫入的supplements集合加載）
+catalogue = CatalogueManager(
+    "data/health_supplements.json",
+    collection=get_collection("supplements") if os.environ.get("SUPPLEMENTS_SOURCE") == "mongodb" else None,
+    rules_path="data/dosage_rules.json",
+    poll_interval=float(os.environ.get("CATALOGUE_POLL_INTERVAL", "5"))
+)
+# 目錄更新後清空舊版本的推薦緩存
+catalogue.add_listener(lambda snapshot: recommendation_cache.clear())
+
 # 數據模型
 class BasicInfo(BaseModel):
     age: str
@@ -65,6 +91,10 @@ class RecommendationData(BaseModel):
     usage: Dict[str, str]
     explanation: str
 
+    class Config:
+        # 緩存的推薦結果在請求之間共享，不允許修改
+        frozen = True
+
 class UserSubmission(BaseModel):
     healthData: HealthData
     email: Optional[str] = None
@@ -78,77 +108,35 @@ class Product(BaseModel):
     image_url: Optional[str] = None
 
 # 輔助函數
-def generate_recommendations(health_data: HealthData) -> RecommendationData:
-    """根據健康數據生成保健品推薦"""
-    recommended_supplements = []
+def generate_recommendations(health_data: HealthData, snapshot: Optional[CatalogueSnapshot] = None) -> RecommendationData:
+    """根據健康數據生成保健品推薦（相同的選項組合共享緩存結果）"""
+    # 整個請求使用同一個目錄快照，重新加載不影響進行中的請求
+    snapshot = snapshot or catalogue.current()
+    symptoms, systems, conditions = snapshot.index.canonical(
+        health_data.symptoms,
+        health_data.bodySystemIssues,
+        health_data.specificConditions
+    )
+    cache_key = (snapshot.version, questionnaire_signature(symptoms, systems, conditions))
+    recommendations = recommendation_cache.get(cache_key)
+    if recommendations is None:
+        recommendations = build_recommendations(snapshot, symptoms, systems, conditions)
+        recommendation_cache.put(cache_key, recommendations)
+    return recommendations
+
+def build_recommendations(snapshot: CatalogueSnapshot, symptoms, systems, conditions) -> RecommendationData:
+    """根據規範化的問卷選項生成保健品推薦"""
+    recommended_supplements = snapshot.index.lookup(symptoms, systems, conditions)
     dosage = {}
     usage = {}
     
-    # 處理症狀
-    for symptom in health_data.symptoms:
-        if symptom in supplements_data.get("生理癥狀的營養免疫調理法", {}):
-            for supplement in supplements_data["生理癥狀的營養免疫調理法"][symptom]:
-                if supplement not in recommended_supplements:
-                    recommended_supplements.append(supplement)
-    
-    # 處理身體系統
-    for system in health_data.bodySystemIssues:
-        if system in supplements_data.get("身體系統的營養支持", {}):
-            for supplement in supplements_data["身體系統的營養支持"][system]:
-                if supplement not in recommended_supplements:
-                    recommended_supplements.append(supplement)
-    
-    # 處理特定狀況
-    for condition in health_data.specificConditions:
-        if condition in supplements_data.get("具體身體狀況的營養對策", {}):
-            condition_data = supplements_data["具體身體狀況的營養對策"][condition]
-            if isinstance(condition_data, list):
-                for supplement in condition_data:
-                    if supplement not in recommended_supplements:
-                        recommended_supplements.append(supplement)
-            elif isinstance(condition_data, dict):
-                for key, supplements in condition_data.items():
-                    for supplement in supplements:
-                        if supplement not in recommended_supplements:
-                            recommended_supplements.append(supplement)
-    
-    # 如果沒有足夠的推薦，添加一些基本保健品
-    if len(recommended_supplements) < 2:
-        basic_supplements = ["綜合維他命", "魚油", "B群"]
-        for supplement in basic_supplements:
-            if supplement not in recommended_supplements:
-                recommended_supplements.append(supplement)
-                if len(recommended_supplements) >= 3:
-                    break
-    
-    # 生成劑量和使用方法
+    # 生成劑量和使用方法（按規則表預先計算）
     for supplement in recommended_supplements:
-        # 模擬劑量和使用方法
-        if "鈣" in supplement:
-            dosage[supplement] = "每日1-2次，每次1片"
-            usage[supplement] = "飯後服用，避免與茶、咖啡同時服用"
-        elif "B群" in supplement:
-            dosage[supplement] = "每日1次，每次1片"
-            usage[supplement] = "早餐後服用，增加能量代謝"
-        elif "魚油" in supplement:
-            dosage[supplement] = "每日1次，每次1-2粒"
-            usage[supplement] = "餐後服用，幫助吸收"
-        elif "OPC" in supplement:
-            dosage[supplement] = "每日1次，每次1匙"
-            usage[supplement] = "早上空腹服用，用30ml水調勻"
-        elif "酵素" in supplement:
-            dosage[supplement] = "每餐前服用，每次1-2粒"
-            usage[supplement] = "餐前15-30分鐘服用，幫助消化"
-        elif "蘆薈" in supplement:
-            dosage[supplement] = "每日2-3次，每次30ml"
-            usage[supplement] = "稀釋後飲用，可緩解發炎症狀"
-        else:
-            dosage[supplement] = "每日1次，每次1片"
-            usage[supplement] = "飯後服用，效果更佳"
+        dosage[supplement], usage[supplement] = snapshot.advice(supplement)
     
     # 生成解釋文本
-    symptoms_text = "、".join(health_data.symptoms) if health_data.symptoms else "一般健康維護"
-    systems_text = "、".join(health_data.bodySystemIssues) if health_data.bodySystemIssues else "整體身體系統"
+    symptoms_text = "、".join(symptoms) if symptoms else "一般健康維護"
+    systems_text = "、".join(systems) if systems else "整體身體系統"
     
     explanation = f"""根據您提供的健康信息，我們為您推薦了{len(recommended_supplements)}種保健品。
     這些保健品針對您的{symptoms_text}等症狀，以及{systems_text}等身體系統需求進行了優化選擇。
@@ -162,12 +150,331 @@ def generate_recommendations(health_data: HealthData) -> RecommendationData:
         explanation=explanation
     )
 
-def generate_report_id():
+def generate_report_id(suffix_length=4):
     """生成唯一的報告ID"""
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    random_suffix = ''.join(random.choices('0123456789', k=4))
+    random_suffix = ''.join(random.choices('0123456789', k=suffix_length))
     return f"RPT-{timestamp}-{random_suffix}"
 
+def generate_batch_report_ids(count):
+    """為批量提交生成互不重複的報告ID（同一秒內數量多，使用更長的隨機後綴）"""
+    report_ids = {}
+    while len(report_ids) < count:
+        report_ids[generate_report_id(suffix_length=8)] = None
+    return list(report_ids)
+
+def build_user_update(basic_info, report_ids, now):
+    """構建用戶記錄的upsert更新，新用戶和已有用戶都只需一次寫入"""
+    return {
+        "$setOnInsert": {"created_at": now},
+        "$set": {
+            "basic_info": basic_info,
+            "last_report_id": report_ids[-1],
+            "last_assessment_date": now
+        },
+        # $addToSet使重放的寫入（後寫日誌恢復）不會重複添加報告ID
+        "$addToSet": {"reports": {"$each": report_ids}}
+    }
+
+def upsert_user(email, basic_info, report_id, now):
+    """以單次原子upsert寫入用戶記錄"""
+    update = build_user_update(basic_info, [report_id], now)
+    try:
+        users_collection.update_one({"email": email}, update, upsert=True)
+    except DuplicateKeyError:
+        # 同一郵箱並發插入時唯一索引只允許一個成功，重試即成為更新
+        users_collection.update_one({"email": email}, update, upsert=True)
+
+# report_id 與其他報告衝突時換新ID重新插入的次數
+REPORT_ID_RETRIES = 5
+
+def _same_submission(stored, report):
+    """沒有預先分配 _id 的舊日誌任務：郵箱和提交時間（MongoDB精確到毫秒）相同即為同一次提交"""
+    return (
+        stored is not None
+        and stored.get("email") == report.get("email")
+        and stored.get("created_at") == report["created_at"].replace(microsecond=report["created_at"].microsecond // 1000 * 1000)
+    )
+
+def _resolve_report_conflicts(reports, positions):
+    """處理重複鍵錯誤的報告：已經寫入過的同一份報告（日誌重放）改用已保存的報告ID，
+    返回報告ID與其他提交的報告衝突的位置"""
+    conflicts = [reports[position] for position in positions]
+    stored_ids = {
+        doc["_id"]: doc["report_id"]
+        for doc in reports_collection.find({"_id": {"$in": [report["_id"] for report in conflicts]}}, {"report_id": 1})
+    }
+    stored_reports = {
+        doc["report_id"]: doc
+        for doc in reports_collection.find(
+            {"report_id": {"$in": [report["report_id"] for report in conflicts]}},
+            {"report_id": 1, "email": 1, "created_at": 1}
+        )
+    }
+    collisions = []
+    for position, report in zip(positions, conflicts):
+        if report["_id"] in stored_ids:
+            report["report_id"] = stored_ids[report["_id"]]
+        elif not _same_submission(stored_reports.get(report["report_id"]), report):
+            collisions.append(position)
+    return collisions
+
+def insert_reports(reports, rename=True):
+    """無序批量插入報告，返回寫入失敗的報告 {位置: 錯誤信息}
+
+    報告在寫入前（後寫模式在寫入日誌前）分配 _id，重複鍵錯誤時據此區分日誌重放和報告ID衝突。
+    rename 為True時衝突的報告換新ID重新插入，直接修改傳入的報告，調用方應使用報告中最終的 report_id；
+    為False時（報告ID已經返回給客戶端）衝突的報告作為失敗返回，不會以其他ID保存。
+    """
+    for report in reports:
+        report.setdefault("_id", ObjectId())
+    failed = {}
+    pending = list(range(len(reports)))
+    for _ in range(REPORT_ID_RETRIES):
+        try:
+            reports_collection.insert_many([reports[position] for position in pending], ordered=False)
+            return failed
+        except BulkWriteError as e:
+            duplicates = []
+            for error in e.details.get("writeErrors", []):
+                position = pending[error["index"]]
+                if error.get("code") == 11000:
+                    duplicates.append(position)
+                else:
+                    failed[position] = error.get("errmsg", "寫入報告失敗")
+        pending = _resolve_report_conflicts(reports, duplicates) if duplicates else []
+        if not rename:
+            for position in pending:
+                failed[position] = f"報告ID {reports[position]['report_id']} 與已有報告衝突"
+            return failed
+        for position in pending:
+            new_id = generate_report_id(suffix_length=8)
+            print(f"報告ID {reports[position]['report_id']} 與已有報告衝突，改為 {new_id}")
+            reports[position]["report_id"] = new_id
+        if not pending:
+            return failed
+    for position in pending:
+        failed[position] = "報告ID多次衝突"
+    return failed
+
+def persist_submissions(jobs):
+    """批量持久化後寫隊列中的提交：報告一次無序insert_many，用戶和提醒各一次bulk_write
+
+    報告ID已經返回給客戶端，不能更換：與其他報告衝突（或因文檔本身被拒絕）的任務不寫入用戶和提醒，
+    作為無法寫入的任務返回 {位置: 錯誤信息}，由後寫隊列移到死信文件。
+    """
+    reports = [job["report"] for job in jobs]
+    rejected = insert_reports(reports, rename=False)
+
+    users = {}
+    for position, job in enumerate(jobs):
+        if not job.get("user") or position in rejected:
+            continue
+        user = users.setdefault(job["user"]["email"], {"reports": []})
+        user["basic_info"] = job["user"]["basic_info"]
+        user["reports"].append(job["report"]["report_id"])
+        user["now"] = job["report"]["created_at"]
+    if not users:
+        return rejected
+
+    user_operations = [
+        UpdateOne({"email": email}, build_user_update(user["basic_info"], user["reports"], user["now"]), upsert=True)
+        for email, user in users.items()
+    ]
+    try:
+        users_collection.bulk_write(user_operations, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        users_collection.bulk_write([user_operations[error["index"]] for error in errors], ordered=False)
+    # 日誌重放時提醒已經指向同一份報告，重複寫入不會產生新的提醒
+    schedule_reminders([job["report"] for position, job in enumerate(jobs) if job.get("user") and position not in rejected])
+    return rejected
+
+def get_reminder_settings():
+    """經設置緩存讀取提醒設置，設置不存在時使用默認值"""
+    settings = settings_cache.get("reminder") or {}
+    return {
+        "days": settings.get("days", 15),
+        "enabled": settings.get("enabled", True)
+    }
+
+def schedule_reminders(reports):
+    """為帶郵箱的新報告寫入待發送提醒：摘要取自內存中的報告數據，同一用戶只保留最新報告的提醒"""
+    reminder_settings = get_reminder_settings()
+    if not reminder_settings["enabled"]:
+        return
+    reminders = [
+        {
+            "user_email": report["email"],
+            "report_id": report["report_id"],
+            "created_at": report["created_at"],
+            "summary": ReportReminderView.from_document(report).summary()
+        }
+        for report in reports if report.get("email")
+    ]
+    if reminders:
+        upsert_pending_reminders(reminders_collection, reminders, reminder_settings["days"])
+
+# 報告保存後的回調，參數為報告ID列表，在後台執行不阻塞請求
+report_created_hooks: List[Callable[[List[str]], Awaitable[None]]] = []
+_hook_tasks = set()
+
+def add_report_created_hook(hook):
+    """註冊報告保存後的回調"""
+    report_created_hooks.append(hook)
+    return hook
+
+async def _run_report_created_hook(hook, report_ids):
+    try:
+        await hook(report_ids)
+    except Exception as e:
+        print(f"執行報告保存回調時出錯: {e}")
+
+def notify_reports_created(report_ids):
+    """報告寫入數據庫後調用所有回調"""
+    if not report_ids:
+        return
+    for hook in report_created_hooks:
+        task = asyncio.create_task(_run_report_created_hook(hook, list(report_ids)))
+        _hook_tasks.add(task)
+        task.add_done_callback(_hook_tasks.discard)
+
+# 報告服務的預渲染接口，新報告保存後通知它提前渲染HTML和PDF（設為空字符串關閉）
+REPORT_PRERENDER_URL = os.environ.get("REPORT_PRERENDER_URL", "http://localhost:8002/api/report/prerender")
+# 與報告服務共享的服務令牌，未設置時不請求預渲染
+SERVICE_TOKEN = os.environ.get("SERVICE_TOKEN", "")
+# 每次請求預渲染的報告數
+REPORT_PRERENDER_CHUNK_SIZE = int(os.environ.get("REPORT_PRERENDER_CHUNK_SIZE", "200"))
+
+def post_prerender_request(report_ids):
+    """分塊請求報告服務預渲染報告；預渲染隊列已滿時停止提交剩餘的報告（首次訪問時仍會正常渲染）"""
+    for start in range(0, len(report_ids), REPORT_PRERENDER_CHUNK_SIZE):
+        request = urllib.request.Request(
+            REPORT_PRERENDER_URL,
+            data=json.dumps({"report_ids": report_ids[start:start + REPORT_PRERENDER_CHUNK_SIZE]}).encode("utf-8"),
+            headers={"Content-Type": "application/json", "X-Service-Token": SERVICE_TOKEN},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=2) as response:
+            result = json.loads(response.read() or b"{}")
+        if result.get("dropped"):
+            skipped = len(report_ids) - start - result.get("queued", 0)
+            print(f"預渲染隊列已滿，{skipped}個報告未預渲染")
+            return
+
+if REPORT_PRERENDER_URL and SERVICE_TOKEN:
+    @add_report_created_hook
+    async def request_prerender(report_ids):
+        await run_in_threadpool(post_prerender_request, report_ids)
+
+async def flush_submissions(jobs):
+    """後寫隊列的批量寫入函數，返回無法寫入的任務 {位置: 錯誤信息}"""
+    rejected = await run_db(persist_submissions, jobs)
+    notify_reports_created([job["report"]["report_id"] for position, job in enumerate(jobs) if position not in rejected])
+    return rejected
+
+# 後寫模式：/api/submit 把持久化任務放入隊列後立即返回（SUBMIT_WRITE_BEHIND=1 開啟）
+SUBMIT_WRITE_BEHIND = os.environ.get("SUBMIT_WRITE_BEHIND", "0") == "1"
+write_behind = WriteBehindQueue(
+    flush_submissions,
+    journal_path=os.environ.get("WRITE_BEHIND_JOURNAL", "data/write_behind.journal"),
+    maxsize=int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", "10000")),
+    batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "500")),
+    put_timeout=float(os.environ.get("WRITE_BEHIND_PUT_TIMEOUT", "1.0")),
+    fsync=os.environ.get("WRITE_BEHIND_FSYNC", "0") == "1",
+    max_attempts=int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "5")),
+    # 數據庫連接錯誤一直重試，恢復後繼續寫入；其他錯誤多次失敗後移到死信文件
+    transient=lambda error: isinstance(error, ConnectionFailure),
+    close_timeout=float(os.environ.get("WRITE_BEHIND_CLOSE_TIMEOUT", "30"))
+)
+
+async def parse_batch_submissions(request: Request):
+    """解析批量提交的請求體（JSON數組或NDJSON），無法解析的行以異常對象佔位"""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError as e:
+                        items.append(ValueError(f"無法解析的JSON行: {e}"))
+        if buffer.strip():
+            try:
+                items.append(json.loads(buffer))
+            except ValueError as e:
+                items.append(ValueError(f"無法解析的JSON行: {e}"))
+        return items
+
+    items = json.loads(await request.body())
+    if not isinstance(items, list):
+        raise ValueError("請求體必須是問卷數組")
+    return items
+
+# 生命週期事件
+@app.on_event("startup")
+async def start_catalogue_watcher():
+    """首次加載保健品目錄（從MongoDB加載時不在導入模塊時連接數據庫）並啟動監視"""
+    await run_db(catalogue.reload, True)
+    catalogue.start()
+
+@app.on_event("shutdown")
+async def stop_catalogue_watcher():
+    """停止保健品目錄監視"""
+    catalogue.stop()
+
+@app.on_event("startup")
+async def start_write_behind():
+    """啟動後寫隊列，恢復日誌中上次未寫入的提交"""
+    if SUBMIT_WRITE_BEHIND:
+        await write_behind.start()
+
+@app.on_event("shutdown")
+async def flush_write_behind():
+    """關閉前寫完後寫隊列中的所有提交"""
+    if SUBMIT_WRITE_BEHIND:
+        await write_behind.close()
+
+@app.on_event("startup")
+async def watch_settings():
+    """監聽設置變更，管理服務修改提醒設置後本服務的緩存立即失效"""
+    if SETTINGS_CHANGE_STREAM and 'settings_cache' in globals():
+        settings_cache.watch()
+
+@app.on_event("shutdown")
+async def stop_settings_watch():
+    """停止監聽設置變更"""
+    if 'settings_cache' in globals():
+        settings_cache.stop()
+
+@app.on_event("startup")
+async def ensure_reminder_index():
+    """確保提醒的pending_key唯一索引存在；已有重複的待發送提醒（遷移未執行）時拒絕啟動"""
+    try:
+        await run_db(ensure_pending_reminder_index, reminders_collection)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        # 數據庫暫時不可用時在第一次寫入提醒前再創建
+        print(f"創建提醒索引時出錯: {e}")
+
+@app.on_event("startup")
+async def ensure_user_email_index():
+    """確保users.email唯一索引存在，用於原子upsert去重；已有重複用戶時拒絕啟動"""
+    try:
+        await run_db(users_collection.create_index, "email", unique=True)
+    except OperationFailure as e:
+        # 沒有唯一索引時並發的首次提交會再次創建重複用戶
+        raise RuntimeError(f"無法創建users.email唯一索引，請先執行數據庫遷移（python migrations.py）合併重複用戶: {e}")
+    except Exception as e:
+        print(f"創建用戶郵箱索引時出錯: {e}")
+
 # API端點
 @app.get("/")
 async def root():
@@ -180,11 +487,13 @@ async def submit_questionnaire(submission: UserSubmission):
         # 生成推薦
         recommendations = generate_recommendations(submission.healthData)
         
-        # 生成報告ID
-        report_id = generate_report_id()
+        # 生成報告ID（後寫模式在寫入前就返回報告ID，衝突時無法更換，使用更長的隨機後綴）
+        report_id = generate_report_id(suffix_length=8 if SUBMIT_WRITE_BEHIND else 4)
         
         # 創建報告數據
+        # _id 預先分配並寫入後寫日誌，重放時據此識別已經寫入的報告
         report_data = {
+            "_id": ObjectId(),
             "report_id": report_id,
             "created_at": datetime.now(),
             "health_data": submission.healthData.dict(),
@@ -192,38 +501,40 @@ async def submit_questionnaire(submission: UserSubmission):
             "email": submission.email
         }
         
+        # 後寫模式：放入隊列即返回，由後台寫入器批量保存
+        if SUBMIT_WRITE_BEHIND:
+            user = None
+            if submission.email:
+                user = {"email": submission.email, "basic_info": submission.healthData.basicInfo.dict()}
+            try:
+                await write_behind.put({"report": report_data, "user": user})
+            except QueueFullError as e:
+                raise HTTPException(status_code=503, detail=f"系統繁忙，請稍後重試: {str(e)}")
+            return {
+                "success": True,
+                "report_id": report_id,
+                "recommendations": recommendations.dict()
+            }
+
         # 保存到數據庫
         try:
-            reports_collection.insert_one(report_data)
-            
-            # 如果提供了電子郵件，保存用戶信息
+            failed = await run_db(insert_reports, [report_data])
+            if failed:
+                raise RuntimeError(failed[0])
+            # 報告ID與其他報告衝突時已換成新ID
+            report_id = report_data["report_id"]
+
+            # 如果提供了電子郵件，保存用戶信息（單次原子upsert）
             if submission.email:
-                user_data = {
-                    "email": submission.email,
-                    "basic_info": submission.healthData.basicInfo.dict(),
-                    "last_report_id": report_id,
-                    "last_assessment_date": datetime.now(),
-                    "reports": [report_id]
-                }
-                
-                # 檢查用戶是否已存在
-                existing_user = users_collection.find_one({"email": submission.email})
-                if existing_user:
-                    # 更新現有用戶
-                    users_collection.update_one(
-                        {"email": submission.email},
-                        {
-                            "$set": {
-                                "basic_info": submission.healthData.basicInfo.dict(),
-                                "last_report_id": report_id,
-                                "last_assessment_date": datetime.now()
-                            },
-                            "$push": {"reports": report_id}
-                        }
-                    )
-                else:
-                    # 創建新用戶
-                    users_collection.insert_one(user_data)
+                await run_db(
+                    upsert_user,
+                    submission.email,
+                    submission.healthData.basicInfo.dict(),
+                    report_id,
+                    report_data["created_at"]
+                )
+                await run_db(schedule_reminders, [report_data])
+            notify_reports_created([report_id])
         except Exception as e:
             print(f"數據庫操作錯誤: {e}")
             # 如果數據庫操作失敗，使用內存存儲
@@ -245,9 +556,154 @@ async def submit_questionnaire(submission: UserSubmission):
             "report_id": report_id,
             "recommendations": recommendations.dict()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"處理問卷時出錯: {str(e)}")
 
+@app.post("/api/submit/batch", response_model=Dict[str, Any])
+async def submit_questionnaire_batch(request: Request):
+    """批量提交健康問卷（JSON數組或NDJSON），一次寫入所有報告和用戶"""
+    try:
+        items = await parse_batch_submissions(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"無法解析批量提交: {str(e)}")
+
+    if len(items) > SUBMIT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"批量提交最多{SUBMIT_BATCH_MAX_SIZE}條記錄")
+
+    try:
+        # 整批使用同一個目錄快照，相同的選項組合只計算一次推薦
+        snapshot = catalogue.current()
+        now = datetime.now()
+        report_ids = generate_batch_report_ids(len(items))
+        results = []
+        reports = []
+        submissions = []
+        batch_recommendations = {}
+
+        for position, item in enumerate(items):
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                submission = UserSubmission(**item)
+            except (ValueError, TypeError) as e:
+                results.append({"index": position, "success": False, "error": str(e)})
+                continue
+
+            health_data = submission.healthData
+            key = snapshot.index.canonical(health_data.symptoms, health_data.bodySystemIssues, health_data.specificConditions)
+            recommendations = batch_recommendations.get(key)
+            if recommendations is None:
+                recommendations = generate_recommendations(health_data, snapshot).dict()
+                batch_recommendations[key] = recommendations
+
+            report_id = report_ids[position]
+            reports.append({
+                "report_id": report_id,
+                "created_at": now,
+                "health_data": health_data.dict(),
+                "recommendations": recommendations,
+                "email": submission.email
+            })
+            submissions.append(submission)
+            results.append({"index": position, "success": True, "report_id": report_id})
+
+        # 保存到數據庫：報告一次無序insert_many，用戶和提醒各一次bulk_write
+        try:
+            # 報告ID與並發提交的報告衝突時換新ID重試，不作為失敗返回
+            failed = await run_db(insert_reports, reports) if reports else {}
+
+            users = {}
+            for offset, submission in enumerate(submissions):
+                if offset in failed or not submission.email:
+                    continue
+                user = users.setdefault(submission.email, {"reports": []})
+                user["basic_info"] = submission.healthData.basicInfo.dict()
+                user["reports"].append(reports[offset]["report_id"])
+
+            if users:
+                user_operations = [
+                    UpdateOne(
+                        {"email": email},
+                        build_user_update(user["basic_info"], user["reports"], now),
+                        upsert=True
+                    )
+                    for email, user in users.items()
+                ]
+                try:
+                    await run_db(users_collection.bulk_write, user_operations, ordered=False)
+                except BulkWriteError as e:
+                    # 同一郵箱並發插入導致的重複鍵錯誤，重試即成為更新
+                    errors = e.details.get("writeErrors", [])
+                    if any(error.get("code") != 11000 for error in errors):
+                        raise
+                    await run_db(
+                        users_collection.bulk_write,
+                        [user_operations[error["index"]] for error in errors],
+                        ordered=False
+                    )
+                await run_db(schedule_reminders, [
+                    report for offset, report in enumerate(reports) if offset not in failed
+                ])
+
+            notify_reports_created([
+                report["report_id"] for offset, report in enumerate(reports) if offset not in failed
+            ])
+
+            report_results = [result for result in results if result["success"]]
+            for offset, result in enumerate(report_results):
+                if offset in failed:
+                    result.update({"success": False, "error": failed[offset]})
+                    result.pop("report_id", None)
+                else:
+                    result["report_id"] = reports[offset]["report_id"]
+        except Exception as e:
+            print(f"數據庫操作錯誤: {e}")
+            # 如果數據庫操作失敗，使用內存存儲
+            if 'users_db' in globals():
+                for report_data, submission in zip(reports, submissions):
+                    if submission.email:
+                        users_db.append({
+                            "email": submission.email,
+                            "basic_info": submission.healthData.basicInfo.dict(),
+                            "last_report_id": report_data["report_id"],
+                            "last_assessment_date": now,
+                            "reports": [report_data["report_id"]]
+                        })
+                    reports_db.append(report_data)
+
+        succeeded = sum(1 for result in results if result["success"])
+        return {
+            "success": True,
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "results": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量處理問卷時出錯: {str(e)}")
+
+@app.get("/api/recommendations/cache", response_model=Dict[str, Any])
+async def get_recommendation_cache_stats():
+    """獲取推薦緩存的命中統計"""
+    return recommendation_cache.stats()
+
+@app.get("/api/db/metrics", response_model=Dict[str, Any])
+async def get_db_metrics():
+    """獲取MongoDB連接池統計"""
+    return pool_stats()
+
+@app.get("/api/submit/queue", response_model=Dict[str, Any])
+async def get_write_behind_metrics():
+    """獲取後寫隊列深度和寫入延遲"""
+    return {"enabled": SUBMIT_WRITE_BEHIND, **write_behind.metrics()}
+
+@app.get("/api/catalogue/metrics", response_model=Dict[str, Any])
+async def get_catalogue_metrics():
+    """獲取保健品目錄版本和重新加載耗時"""
+    return catalogue.metrics()
+
 @app.post("/api/ai-questions", response_model=Dict[str, Any])
 async def generate_ai_questions(health_data: HealthData):
     """根據健康數據生成AI問題"""
@@ -332,7 +788,7 @@ async def send_report_email(data: Dict[str, str] = Body(...)):
 async def get_products():
     """獲取所有產品"""
     try:
-        products = list(products_collection.find({}, {"_id": 0}))
+        products = await run_db(lambda: list(products_collection.find({}, {"_id": 0})))
         return products
     except Exception as e:
         print(f"獲取產品時出錯: {e}")
@@ -346,7 +802,7 @@ async def create_product(product: Product):
     """創建新產品"""
     try:
         product_dict = product.dict()
-        products_collection.insert_one(product_dict)
+        await run_db(products_collection.insert_one, product_dict)
         # 移除MongoDB的_id字段
         product_dict.pop("_id", None)
         return product_dict
@@ -363,7 +819,8 @@ async def update_product(product_name: str, product: Product):
     """更新產品"""
     try:
         product_dict = product.dict()
-        result = products_collection.update_one(
+        result = await run_db(
+            products_collection.update_one,
             {"name": product_name},
             {"$set": product_dict}
         )
@@ -389,7 +846,7 @@ async def update_product(product_name: str, product: Product):
 async def delete_product(product_name: str):
     """刪除產品"""
     try:
-        result = products_collection.delete_one({"name": product_name})
+        result = await run_db(products_collection.delete_one, {"name": product_name})
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail=f"找不到產品: {product_name}")
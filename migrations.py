@@ -0,0 +1,312 @@
+import sys
+from datetime import datetime, timedelta
+
+import bson
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from db import get_database
+from reminder_queue import ensure_pending_reminder_index
+from report_views import ReportReminderView
+
+# 已執行的遷移記錄在這個集合中
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+def _initial_indexes(db):
+    """原init_db.py創建的索引"""
+    db["users"].create_index([("created_at", DESCENDING)])
+    db["recommendations"].create_index([("user_id", ASCENDING)])
+
+def _duplicate_groups(collection, key):
+    """按 key 分組，返回有多條記錄的 (值, [_id]) 列表；缺少 key 的記錄在唯一索引中同樣互相衝突，無法自動處理"""
+    groups = collection.aggregate([
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    duplicates = []
+    for group in groups:
+        if group["_id"] is None:
+            raise RuntimeError(
+                f"{collection.name} 有 {group['count']} 條記錄缺少 {key}，無法創建唯一索引，請先手動處理: {group['ids'][:20]}"
+            )
+        duplicates.append((group["_id"], group["ids"]))
+    return duplicates
+
+def _newest(docs):
+    """ObjectId 最大（最近插入）的記錄"""
+    return max(docs, key=lambda doc: doc["_id"] if isinstance(doc["_id"], bson.ObjectId) else bson.ObjectId("0" * 24))
+
+def _dedupe_users(db):
+    """合併同一郵箱的多條用戶記錄（唯一索引創建前並發的首次提交會產生重複），
+    保留最早創建的一條，報告列表取並集，基本信息和最近報告取最近一次評估的記錄"""
+    users = db["users"]
+    merged = 0
+    for _, ids in _duplicate_groups(users, "email"):
+        docs = list(users.find({"_id": {"$in": ids}}))
+        keep = min(docs, key=lambda doc: doc.get("created_at") or datetime.max)
+        latest = max(docs, key=lambda doc: doc.get("last_assessment_date") or datetime.min)
+        reports = []
+        for doc in docs:
+            reports.extend(report_id for report_id in doc.get("reports", []) if report_id not in reports)
+        update = {key: latest[key] for key in ("basic_info", "last_report_id", "last_assessment_date") if key in latest}
+        update["reports"] = reports
+        users.update_one({"_id": keep["_id"]}, {"$set": update})
+        users.delete_many({"_id": {"$in": [doc["_id"] for doc in docs if doc["_id"] != keep["_id"]]}})
+        merged += len(docs) - 1
+    if merged:
+        print(f"已合併 {merged} 條重複的用戶記錄")
+
+def _rename_duplicate_reports(db):
+    """報告ID重複時（原來的ID只有4位隨機後綴）最早創建的報告保留原ID，其餘改為 原ID-序號；
+    與保留的報告屬於不同用戶時，同時更新該用戶的報告列表、最近報告和提醒中的引用"""
+    reports = db["reports"]
+    renamed = []
+    for report_id, ids in _duplicate_groups(reports, "report_id"):
+        docs = sorted(reports.find({"_id": {"$in": ids}}, {"email": 1, "created_at": 1}),
+                      key=lambda doc: doc.get("created_at") or datetime.min)
+        owner = docs[0].get("email")
+        suffix = 1
+        for doc in docs[1:]:
+            while reports.count_documents({"report_id": f"{report_id}-{suffix}"}, limit=1):
+                suffix += 1
+            new_id = f"{report_id}-{suffix}"
+            suffix += 1
+            reports.update_one({"_id": doc["_id"]}, {"$set": {"report_id": new_id}})
+            email = doc.get("email")
+            if email and email != owner:
+                db["users"].update_many({"email": email, "reports": report_id}, {"$set": {"reports.$": new_id}})
+                db["users"].update_many({"email": email, "last_report_id": report_id}, {"$set": {"last_report_id": new_id}})
+                db["reminders"].update_many({"user_email": email, "report_id": report_id}, {"$set": {"report_id": new_id}})
+            elif email:
+                # 同一用戶的兩份報告：原ID仍指向保留的報告，把新ID加入報告列表
+                db["users"].update_many({"email": email}, {"$addToSet": {"reports": new_id}})
+            renamed.append(f"{report_id} -> {new_id}")
+    if renamed:
+        print(f"已重命名 {len(renamed)} 個重複的報告ID: {', '.join(renamed)}")
+
+def _dedupe_newest(db, collection_name, key):
+    """同一 key 只保留最近插入的記錄，刪除其餘的"""
+    collection = db[collection_name]
+    removed = []
+    for value, ids in _duplicate_groups(collection, key):
+        keep = _newest(list(collection.find({"_id": {"$in": ids}}, {"_id": 1})))
+        collection.delete_many({"_id": {"$in": [_id for _id in ids if _id != keep["_id"]]}})
+        removed.append(f"{value}（{len(ids) - 1}條）")
+    if removed:
+        print(f"已刪除 {collection_name} 中 {key} 重複的舊記錄: {', '.join(removed)}")
+
+def _lookup_indexes(db):
+    """服務按鍵查詢的唯一索引"""
+    # 有重複記錄時唯一索引無法創建，這一步之前可能沒有執行成功過，先處理重複記錄
+    _rename_duplicate_reports(db)
+    _dedupe_users(db)
+    _dedupe_newest(db, "products", "name")
+    _dedupe_newest(db, "settings", "type")
+    db["reports"].create_index([("report_id", ASCENDING)], unique=True)
+    db["users"].create_index([("email", ASCENDING)], unique=True)
+    db["products"].create_index([("name", ASCENDING)], unique=True)
+    db["settings"].create_index([("type", ASCENDING)], unique=True)
+
+def _report_indexes(db):
+    """按郵箱和日期查詢報告的索引"""
+    db["reports"].create_index([("email", ASCENDING), ("created_at", DESCENDING)])
+    db["reports"].create_index([("created_at", DESCENDING)])
+
+def _reminder_indexes(db):
+    """待發送提醒的部分索引，已發送的提醒不佔索引空間"""
+    db["reminders"].create_index(
+        [("sent", ASCENDING), ("reminder_date", ASCENDING)],
+        name="pending_reminder_date",
+        partialFilterExpression={"sent": False}
+    )
+    db["reminders"].create_index([("user_email", ASCENDING)])
+    db["reminders"].create_index([("report_id", ASCENDING)])
+
+def _supplement_indexes(db):
+    """保健品目錄的分類索引"""
+    db["supplements"].create_index([("category", ASCENDING), ("subcategory", ASCENDING)])
+
+def _export_indexes(db):
+    """批量導出按 (created_at, report_id) 排序續傳，按郵箱導出時先按郵箱過濾"""
+    db["reports"].create_index([("created_at", ASCENDING), ("report_id", ASCENDING)])
+    db["reports"].create_index([("email", ASCENDING), ("created_at", ASCENDING), ("report_id", ASCENDING)])
+
+def _outbox_indexes(db):
+    """發件箱按狀態和下次發送時間領取郵件；提醒按是否已加入發件箱過濾"""
+    db["mail_outbox"].create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+    db["mail_outbox"].create_index([("status", ASCENDING), ("claimed_at", ASCENDING)])
+
+def _reminder_claim_indexes(db):
+    """同一提醒只能加入發件箱一次：提醒的領取租約過期後被重新領取時不會重複發送"""
+    db["mail_outbox"].create_index(
+        [("reminder_id", ASCENDING)],
+        name="unique_reminder_id",
+        unique=True,
+        partialFilterExpression={"reminder_id": {"$exists": True}}
+    )
+
+def _slim_reminders(db, chunk_size=1000):
+    """提醒只保留報告引用和郵件摘要，刪除嵌入的報告內容，並輸出節省的空間"""
+    reminders = db["reminders"]
+    embedded = {"summary": {"$exists": False}, "$or": [{"health_data": {"$exists": True}}, {"recommendations": {"$exists": True}}]}
+    before = after = converted = 0
+    updates = []
+    for reminder in reminders.find(embedded):
+        summary = ReportReminderView.from_document(reminder).summary()
+        slim = {key: value for key, value in reminder.items() if key not in ("health_data", "recommendations")}
+        before += len(bson.encode(reminder))
+        after += len(bson.encode({**slim, "summary": summary}))
+        updates.append(UpdateOne(
+            {"_id": reminder["_id"]},
+            {"$set": {"summary": summary}, "$unset": {"health_data": "", "recommendations": ""}}
+        ))
+        if len(updates) >= chunk_size:
+            reminders.bulk_write(updates, ordered=False)
+            converted += len(updates)
+            updates = []
+    if updates:
+        reminders.bulk_write(updates, ordered=False)
+        converted += len(updates)
+    if converted:
+        print(f"已精簡 {converted} 個提醒：{before / 1024:.1f} KB -> {after / 1024:.1f} KB，"
+              f"節省 {(before - after) / 1024:.1f} KB（{1 - after / before:.0%}）；磁盤空間需執行 compact 後才會釋放")
+    else:
+        print("沒有需要精簡的提醒")
+
+def _pending_reminder_keys(db, chunk_size=1000):
+    """每個用戶只保留一個待發送提醒：保留最新的提醒並以 pending_key 標記，刪除較舊的重複提醒，再創建唯一索引"""
+    reminders = db["reminders"]
+    pending = {
+        "sent": False,
+        "queued_at": {"$exists": False},
+        "claim_token": {"$exists": False},
+        "pending_key": {"$exists": False},
+        "user_email": {"$nin": [None, ""]}
+    }
+    keyed = set(reminders.distinct("pending_key", {"pending_key": {"$exists": True}}))
+    updates, duplicates = [], []
+    for reminder in reminders.find(pending, {"user_email": 1, "created_at": 1}).sort("created_at", DESCENDING):
+        email = reminder["user_email"]
+        if email in keyed:
+            duplicates.append(reminder["_id"])
+            continue
+        keyed.add(email)
+        updates.append(UpdateOne(
+            {"_id": reminder["_id"]},
+            {"$set": {"pending_key": email, "scheduled_from": reminder.get("created_at") or datetime.now()}}
+        ))
+    for start in range(0, len(updates), chunk_size):
+        reminders.bulk_write(updates[start:start + chunk_size], ordered=False)
+    for start in range(0, len(duplicates), chunk_size):
+        reminders.delete_many({"_id": {"$in": duplicates[start:start + chunk_size]}})
+    ensure_pending_reminder_index(reminders)
+    print(f"已標記 {len(updates)} 個待發送提醒，刪除 {len(duplicates)} 個被同一用戶較新提醒取代的提醒")
+
+def _reminder_sync_index(db):
+    """發件箱中提醒郵件的結果是否已寫回提醒：已有的提醒郵件標記為未寫回，由報告服務補寫一次（重複寫入不改變結果）"""
+    db["mail_outbox"].update_many(
+        {"reminder_id": {"$exists": True}, "reminder_synced": {"$exists": False}},
+        {"$set": {"reminder_synced": False}}
+    )
+    db["mail_outbox"].create_index(
+        [("reminder_synced", ASCENDING), ("status", ASCENDING)],
+        name="unsynced_reminder_outcomes",
+        partialFilterExpression={"reminder_synced": False}
+    )
+
+# 按版本順序排列的遷移，已發佈的遷移不要修改，新的變更追加到末尾
+MIGRATIONS = [
+    (1, "原有的users/recommendations索引", _initial_indexes),
+    (2, "reports/users/products/settings唯一索引", _lookup_indexes),
+    (3, "reports郵箱和日期索引", _report_indexes),
+    (4, "reminders待發送部分索引", _reminder_indexes),
+    (5, "supplements分類索引", _supplement_indexes),
+    (6, "reports導出排序索引", _export_indexes),
+    (7, "mail_outbox發送隊列索引", _outbox_indexes),
+    (8, "mail_outbox提醒唯一索引", _reminder_claim_indexes),
+    (9, "reminders改為報告引用和摘要", _slim_reminders),
+    (10, "reminders每個用戶一個待發送提醒", _pending_reminder_keys),
+    (11, "mail_outbox提醒結果寫回索引", _reminder_sync_index),
+]
+
+def applied_versions(db):
+    """返回已執行的遷移版本"""
+    return {doc["_id"] for doc in db[MIGRATIONS_COLLECTION].find({}, {"_id": 1})}
+
+def run_migrations(db=None):
+    """按順序執行未執行的遷移，可以重複運行；返回本次執行的版本"""
+    db = db if db is not None else get_database()
+    done = applied_versions(db)
+    executed = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"執行遷移 {version}: {description}")
+        migrate(db)
+        db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": version},
+            {"$set": {"description": description, "applied_at": datetime.now()}},
+            upsert=True
+        )
+        executed.append(version)
+    if not executed:
+        print("數據庫已是最新版本")
+    return executed
+
+def _plan_summary(stage):
+    """把執行計劃壓縮成 FETCH <- IXSCAN(索引名) 的形式"""
+    parts = []
+    while stage:
+        name = stage.get("stage", "?")
+        if stage.get("indexName"):
+            name += f"({stage['indexName']})"
+        parts.append(name)
+        stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+    return " <- ".join(parts)
+
+def hot_queries():
+    """各服務的熱點查詢"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        ("reports", {"report_id": "RPT-00000000000000-0000"}),
+        ("users", {"email": "someone@example.com"}),
+        ("products", {"name": "魚油"}),
+        ("settings", {"type": "email"}),
+        ("reminders", {"reminder_date": {"$lt": today + timedelta(days=1)}, "sent": False}),
+        ("reminders", {"pending_key": "someone@example.com"}),
+        ("mail_outbox", {"status": "pending", "next_attempt_at": {"$lte": datetime.now()}}),
+        ("mail_outbox", {"reminder_synced": False, "status": {"$in": ["sent", "failed"]}}),
+    ]
+
+def verify(db=None):
+    """輸出每個熱點查詢的執行計劃，有全表掃描時返回False"""
+    db = db if db is not None else get_database()
+    ok = True
+    for collection, query in hot_queries():
+        plan = db[collection].find(query).explain()
+        winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+        # 新版MongoDB把查詢計劃包在queryPlan中
+        summary = _plan_summary(winning_plan.get("queryPlan", winning_plan))
+        if "COLLSCAN" in summary:
+            ok = False
+        print(f"{collection:<10} {query}\n    {summary}")
+    return ok
+
+def status(db=None):
+    """列出每個遷移的執行狀態"""
+    db = db if db is not None else get_database()
+    done = applied_versions(db)
+    for version, description, _ in MIGRATIONS:
+        print(f"[{'x' if version in done else ' '}] {version}: {description}")
+
+if __name__ == "__main__":
+    # 用法: python migrations.py [migrate|status|verify]
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        run_migrations()
+    elif command == "status":
+        status()
+    elif command == "verify":
+        sys.exit(0 if verify() else 1)
+    else:
+        print(f"未知命令: {command}")
+        sys.exit(2)
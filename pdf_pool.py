@@ -0,0 +1,150 @@
+import asyncio
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import pdfkit
+
+class PdfQueueFullError(Exception):
+    """PDF渲染隊列已滿"""
+
+class PdfTimeoutError(Exception):
+    """wkhtmltopdf在限定時間內沒有完成"""
+
+def run_wkhtmltopdf(source: str, source_type: str, path: Optional[str] = None, timeout: Optional[float] = None,
+                    options: Optional[Dict[str, Any]] = None):
+    """調用wkhtmltopdf，超時後結束進程；path為None時返回PDF字節"""
+    kit = pdfkit.PDFKit(source, source_type, options=options)
+    args = kit.command(path)
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=kit.environ
+    )
+    data = kit.source.to_s().encode("utf-8") if kit.source.isString() else None
+    try:
+        stdout, stderr = process.communicate(input=data, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise PdfTimeoutError(f"wkhtmltopdf超過{timeout}秒未完成")
+    kit.handle_error(process.returncode, stderr.decode("utf-8", errors="replace"))
+    return stdout if path is None else path
+
+class PdfRenderPool:
+    """有界的PDF渲染池：限制同時運行的wkhtmltopdf數量，同一報告的併發請求只渲染一次
+
+    渲染函數在線程池中執行，調用時會傳入 timeout 關鍵字參數，應在超時後結束渲染進程並拋出PdfTimeoutError。
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 30.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._pid = None
+        self._executor = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending = 0
+        self._running = 0
+        self._running_lock = threading.Lock()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self._total_wait = 0.0
+        self._total_render = 0.0
+        self.max_wait = 0.0
+        self.max_render = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # fork後重新創建線程池
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf")
+            self._pid = os.getpid()
+        return self._executor
+
+    async def render(self, key: str, func: Callable, *args: Any):
+        """提交渲染任務；相同key的任務正在進行時等待它的結果，隊列已滿時拋出PdfQueueFullError"""
+        existing = self._inflight.get(key)
+        if existing is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(existing)
+        if self._pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise PdfQueueFullError("PDF渲染隊列已滿")
+
+        # 在創建任務前同步佔用隊列位置，同時到達的請求不會都通過上面的檢查
+        self.submitted += 1
+        self._pending += 1
+        task = asyncio.ensure_future(self._run(func, args, time.perf_counter()))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._release(key))
+        # shield：一個請求斷開不會取消其他請求共享的渲染
+        return await asyncio.shield(task)
+
+    def _release(self, key: str):
+        # 任務結束（包括開始前被取消）時釋放隊列位置
+        self._pending -= 1
+        self._inflight.pop(key, None)
+
+    async def _run(self, func: Callable, args, enqueued_at: float):
+        timing = {}
+
+        def job():
+            timing["started"] = time.perf_counter()
+            with self._running_lock:
+                self._running += 1
+            try:
+                return func(*args, timeout=self.timeout)
+            finally:
+                with self._running_lock:
+                    self._running -= 1
+                timing["finished"] = time.perf_counter()
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), job)
+            self.completed += 1
+            return result
+        except PdfTimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            if "started" in timing:
+                wait = timing["started"] - enqueued_at
+                render = timing["finished"] - timing["started"]
+                self._total_wait += wait
+                self._total_render += render
+                self.max_wait = max(self.max_wait, wait)
+                self.max_render = max(self.max_render, render)
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回隊列深度和渲染延遲統計"""
+        started = self.completed + self.failed + self.timeouts
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "timeout": self.timeout,
+            "running": self._running,
+            "queued": self._pending - self._running,
+            "inflight_reports": len(self._inflight),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self._total_wait / started * 1000 if started else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_render_ms": self._total_render / started * 1000 if started else 0.0,
+            "max_render_ms": self.max_render * 1000
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class ReportPrerenderer:
+    """後台預渲染新提交的報告，在用戶打開之前填充渲染緩存
+
+    render 接收報告ID，渲染並緩存後返回報告的 created_at（找不到報告時返回None），用於計算預渲染延遲。
+    """
+
+    def __init__(self, render: Callable[[str], Awaitable[Optional[datetime]]], workers: int = 1, maxsize: int = 1000):
+        self._render = render
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = []
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.submitted = 0
+        self.dropped = 0
+        self.rendered = 0
+        self.missing = 0
+        self.failed = 0
+        self._total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+    async def start(self):
+        """啟動預渲染工作任務"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """停止工作任務和變更流監聽，未處理的報告在首次訪問時再渲染"""
+        self._stop.set()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def submit(self, report_id: str) -> bool:
+        """加入預渲染隊列；隊列已滿時丟棄（首次訪問時仍會正常渲染）"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(report_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    async def _run(self):
+        while True:
+            report_id = await self._queue.get()
+            try:
+                created_at = await self._render(report_id)
+                if created_at is None:
+                    self.missing += 1
+                else:
+                    self.rendered += 1
+                    lag = (datetime.now() - created_at).total_seconds() if isinstance(created_at, datetime) else 0.0
+                    self.last_lag = lag
+                    self.max_lag = max(self.max_lag, lag)
+                    self._total_lag += lag
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"預渲染報告 {report_id} 時出錯: {e}")
+            finally:
+                self._queue.task_done()
+
+    def watch(self, collection, resume_delay: float = 5.0):
+        """在後台線程中監聽集合的插入變更流（需要MongoDB副本集），新報告加入預渲染隊列"""
+        def run():
+            resume_token = None
+            while not self._stop.is_set():
+                try:
+                    with collection.watch(
+                        [{"$match": {"operationType": "insert"}}],
+                        resume_after=resume_token,
+                        max_await_time_ms=1000
+                    ) as stream:
+                        while not self._stop.is_set():
+                            change = stream.try_next()
+                            if change is None:
+                                continue
+                            resume_token = stream.resume_token
+                            report_id = change.get("fullDocument", {}).get("report_id")
+                            if report_id:
+                                self._loop.call_soon_threadsafe(self.submit, report_id)
+                except Exception as e:
+                    print(f"監聽報告變更流時出錯，{resume_delay}秒後重試: {e}")
+                    self._stop.wait(resume_delay)
+
+        self._watcher = threading.Thread(target=run, name="report-change-stream", daemon=True)
+        self._watcher.start()
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回隊列深度和預渲染延遲（從報告提交到緩存填充完成）"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "rendered": self.rendered,
+            "missing": self.missing,
+            "failed": self.failed,
+            "change_stream": self._watcher is not None and self._watcher.is_alive(),
+            "avg_lag_ms": self._total_lag / self.rendered * 1000 if self.rendered else 0.0,
+            "max_lag_ms": self.max_lag * 1000,
+            "last_lag_ms": self.last_lag * 1000
+        }
@@ -5,9 +5,9 @@ from pydantic import BaseModel, EmailStr
 from typing import List, Dict, Optional, Any
 import json
 import os
-import pymongo
 from datetime import datetime
 import random
+from db import get_collection, pool_stats, run_db
 
 # 創建FastAPI應用
 app = FastAPI(title="產品管理API")
@@ -26,9 +26,7 @@ os.makedirs("data", exist_ok=True)
 
 # 連接到MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
-    db = client["health_app"]
-    products_collection = db["products"]
+    products_collection = get_collection("products")
 except Exception as e:
     print(f"MongoDB連接錯誤: {e}")
     # 如果無法連接到MongoDB，使用內存存儲作為備用
@@ -48,11 +46,16 @@ class Product(BaseModel):
 async def root():
     return {"message": "產品管理API"}
 
+@app.get("/api/db/metrics", response_model=Dict[str, Any])
+async def get_db_metrics():
+    """獲取MongoDB連接池統計"""
+    return pool_stats()
+
 @app.get("/api/products", response_model=List[Product])
 async def get_products():
     """獲取所有產品"""
     try:
-        products = list(products_collection.find({}, {"_id": 0}))
+        products = await run_db(lambda: list(products_collection.find({}, {"_id": 0})))
         return products
     except Exception as e:
         print(f"獲取產品時出錯: {e}")
@@ -65,7 +68,7 @@ async def get_products():
 async def get_product(product_name: str):
     """獲取特定產品"""
     try:
-        product = products_collection.find_one({"name": product_name}, {"_id": 0})
+        product = await run_db(products_collection.find_one, {"name": product_name}, {"_id": 0})
         if not product:
             raise HTTPException(status_code=404, detail=f"找不到產品: {product_name}")
         return product
@@ -86,7 +89,7 @@ async def create_product(product: Product):
     """創建新產品"""
     try:
         product_dict = product.dict()
-        products_collection.insert_one(product_dict)
+        await run_db(products_collection.insert_one, product_dict)
         # 移除MongoDB的_id字段
         product_dict.pop("_id", None)
         return product_dict
@@ -103,7 +106,8 @@ async def update_product(product_name: str, product: Product):
     """更新產品"""
     try:
         product_dict = product.dict()
-        result = products_collection.update_one(
+        result = await run_db(
+            products_collection.update_one,
             {"name": product_name},
             {"$set": product_dict}
         )
@@ -129,7 +133,7 @@ async def update_product(product_name: str, product: Product):
 async def delete_product(product_name: str):
     """刪除產品"""
     try:
-        result = products_collection.delete_one({"name": product_name})
+        result = await run_db(products_collection.delete_one, {"name": product_name})
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail=f"找不到產品: {product_name}")
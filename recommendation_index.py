@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, List, Tuple
+
+# 保健品數據中的分類名稱
+SYMPTOM_CATEGORY = "生理癥狀的營養免疫調理法"
+SYSTEM_CATEGORY = "身體系統的營養支持"
+CONDITION_CATEGORY = "具體身體狀況的營養對策"
+
+# 推薦不足時補充的基本保健品
+BASIC_SUPPLEMENTS = ("綜合維他命", "魚油", "B群")
+
+def _dedupe(supplements: Iterable[str]) -> Tuple[str, ...]:
+    """保持順序去除重複的保健品"""
+    return tuple(dict.fromkeys(supplements))
+
+def _flatten_condition(condition_data) -> Tuple[str, ...]:
+    """展開特定狀況的保健品列表（支援內服/外用等嵌套字典）"""
+    if isinstance(condition_data, list):
+        return _dedupe(condition_data)
+    if isinstance(condition_data, dict):
+        return _dedupe(
+            supplement
+            for supplements in condition_data.values()
+            for supplement in supplements
+        )
+    return ()
+
+def _order_names(names: Iterable[str], ranks: Dict[str, int]) -> Tuple[str, ...]:
+    """按目錄中的順序排列並去重，不在目錄中的名稱按字母順序放在最後"""
+    unique = set(names)
+    known = sorted((name for name in unique if name in ranks), key=ranks.__getitem__)
+    unknown = sorted(name for name in unique if name not in ranks)
+    return tuple(known + unknown)
+
+def _build_section(section, flatten) -> Dict[str, Tuple[str, ...]]:
+    """為單一分類建立 名稱 -> 保健品元組 的映射"""
+    if not isinstance(section, dict):
+        return {}
+    return {name: flatten(value) for name, value in section.items()}
+
+class RecommendationIndex:
+    """保健品推薦倒排索引，在加載數據時建立一次"""
+
+    def __init__(self, supplements_data: Dict):
+        self.symptoms = _build_section(
+            supplements_data.get(SYMPTOM_CATEGORY, {}),
+            lambda value: _dedupe(value) if isinstance(value, list) else ()
+        )
+        self.systems = _build_section(
+            supplements_data.get(SYSTEM_CATEGORY, {}),
+            lambda value: _dedupe(value) if isinstance(value, list) else ()
+        )
+        self.conditions = _build_section(
+            supplements_data.get(CONDITION_CATEGORY, {}),
+            _flatten_condition
+        )
+        # 名稱在目錄中的位置，用於規範化問卷選項順序
+        self._ranks = tuple(
+            {name: rank for rank, name in enumerate(section)}
+            for section in (self.symptoms, self.systems, self.conditions)
+        )
+
+    def canonical(self, symptoms: Iterable[str], systems: Iterable[str], conditions: Iterable[str]):
+        """將問卷選項規範化為與提交順序無關的固定順序"""
+        return (
+            _order_names(symptoms, self._ranks[0]),
+            _order_names(systems, self._ranks[1]),
+            _order_names(conditions, self._ranks[2]),
+        )
+
+    def supplement_names(self) -> Tuple[str, ...]:
+        """目錄中出現的所有保健品（包括基本保健品）"""
+        names = {}
+        for section in (self.symptoms, self.systems, self.conditions):
+            for supplements in section.values():
+                names.update(dict.fromkeys(supplements))
+        names.update(dict.fromkeys(BASIC_SUPPLEMENTS))
+        return tuple(names)
+
+    def lookup(self, symptoms: Iterable[str], systems: Iterable[str], conditions: Iterable[str]) -> List[str]:
+        """按 症狀 -> 身體系統 -> 特定狀況 的順序合併推薦保健品"""
+        merged = {}
+        for names, section in (
+            (symptoms, self.symptoms),
+            (systems, self.systems),
+            (conditions, self.conditions),
+        ):
+            for name in names:
+                for supplement in section.get(name, ()):
+                    merged[supplement] = None
+
+        # 如果沒有足夠的推薦，添加一些基本保健品
+        if len(merged) < 2:
+            for supplement in BASIC_SUPPLEMENTS:
+                if supplement not in merged:
+                    merged[supplement] = None
+                    if len(merged) >= 3:
+                        break
+
+        return list(merged)
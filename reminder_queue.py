@@ -0,0 +1,385 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from db import run_db
+from mail_outbox import STATUS_FAILED, STATUS_PENDING, STATUS_SENT
+
+# 提醒領取配置（可通過環境變量調整）
+# 領取後超過這個秒數仍未加入發件箱（進程崩潰）的提醒由其他進程重新領取
+REMINDER_LEASE = float(os.environ.get("REMINDER_LEASE", "300"))
+# 每批領取的提醒數
+REMINDER_CLAIM_BATCH_SIZE = int(os.environ.get("REMINDER_CLAIM_BATCH_SIZE", "100"))
+# 候選提醒全部被其他進程搶先領取時重新查詢的次數
+REMINDER_CLAIM_RETRIES = 3
+# 提醒發送結果每塊寫回的數量，以及未滿一塊時最長的等待秒數
+REMINDER_STATUS_CHUNK_SIZE = int(os.environ.get("REMINDER_STATUS_CHUNK_SIZE", "500"))
+REMINDER_STATUS_FLUSH_INTERVAL = float(os.environ.get("REMINDER_STATUS_FLUSH_INTERVAL", "1"))
+# 從發件箱補寫未寫回的最終結果的間隔秒數
+REMINDER_STATUS_RECONCILE_INTERVAL = float(os.environ.get("REMINDER_STATUS_RECONCILE_INTERVAL", "60"))
+
+# 提醒的發送結果：已發送、最終失敗、等待發件箱重試
+REMINDER_SENT = "sent"
+REMINDER_FAILED = "failed"
+REMINDER_RETRY = "retry"
+
+class ReminderQueue:
+    """到期提醒的分佈式領取：多個 admin / reminder_service 進程可以同時處理到期提醒而不重複發送
+
+    每批先按到期時間查詢候選提醒，再用一次 bulk_write 條件更新寫入 claimed_by、領取令牌和租約到期時間，
+    只有仍未被領取（或租約已過期）的提醒會被更新，因此每個提醒只屬於一個進程。加入發件箱後再用一次
+    update_many 標記 queued_at。進程在兩步之間崩潰時，租約過期後提醒被重新領取，
+    發件箱的 reminder_id 唯一索引保證已經加入的郵件不會重複加入。
+    render 生成提醒郵件的HTML；enrich 在渲染前批量補充一批提醒需要的數據（如報告摘要）。
+    """
+
+    def __init__(self, collection, outbox, render: Callable[[Dict[str, Any]], str], lease: float = REMINDER_LEASE,
+                 subject: str = "健康評估跟進提醒",
+                 enrich: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None):
+        self.collection = collection
+        self.outbox = outbox
+        self._render = render
+        self._enrich = enrich
+        self.lease = lease
+        self.subject = subject
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _available(self, now: datetime, due_before: datetime, ids: Optional[List[Any]]) -> Dict[str, Any]:
+        """到期、未加入發件箱、未被領取或租約已過期的提醒"""
+        available = {
+            "sent": False,
+            "reminder_date": {"$lt": due_before},
+            "queued_at": {"$exists": False},
+            "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now}}]
+        }
+        if ids is not None:
+            available["_id"] = {"$in": ids}
+        return available
+
+    def claim(self, limit: int, due_before: Optional[datetime] = None,
+              ids: Optional[List[Any]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """原子地領取最多limit個到期提醒，返回 (領取令牌, 提醒列表)；ids 限定只領取這些提醒"""
+        now = datetime.now()
+        available = self._available(now, due_before or now, ids)
+        token = uuid.uuid4().hex
+        # 領取後不再是用戶的待發送提醒，用戶重新提交問卷時創建新提醒而不是修改這個提醒
+        claim = {"$set": {
+            "claimed_by": self.worker_id,
+            "claim_token": token,
+            "claimed_at": now,
+            "lease_expires_at": now + timedelta(seconds=self.lease)
+        }, "$unset": {"pending_key": ""}}
+        candidate_ids = []
+        claimed = 0
+        for _ in range(REMINDER_CLAIM_RETRIES):
+            wanted = limit - claimed
+            candidates = [
+                reminder["_id"]
+                for reminder in self.collection.find(available, {"_id": 1}).sort("reminder_date", 1).limit(wanted)
+            ]
+            if not candidates:
+                break
+            # 條件更新：其他進程已經領取的候選提醒不會被修改
+            result = self.collection.bulk_write(
+                [UpdateOne({**available, "_id": reminder_id}, claim) for reminder_id in candidates],
+                ordered=False
+            )
+            candidate_ids.extend(candidates)
+            claimed += result.modified_count
+            # 沒有被搶先領取，或已經沒有更多到期提醒
+            if claimed >= limit or result.modified_count == len(candidates) or len(candidates) < wanted:
+                break
+        if not claimed:
+            return token, []
+        return token, list(self.collection.find({"_id": {"$in": candidate_ids}, "claim_token": token}))
+
+    def release(self, token: str, ids: List[Any]):
+        """放棄一批領取（加入發件箱失敗時），提醒可以立即被重新領取"""
+        self.collection.update_many(
+            {"_id": {"$in": ids}, "claim_token": token, "queued_at": {"$exists": False}},
+            {"$unset": {"claimed_by": "", "claim_token": "", "claimed_at": "", "lease_expires_at": ""}}
+        )
+
+    def dispatch(self, limit: int = REMINDER_CLAIM_BATCH_SIZE, due_before: Optional[datetime] = None,
+                 ids: Optional[List[Any]] = None) -> Tuple[int, int]:
+        """領取一批到期提醒並加入發件箱，返回 (領取數, 新加入發件箱的郵件數)；領取數為0時表示沒有到期提醒"""
+        token, reminders = self.claim(limit, due_before, ids)
+        if not reminders:
+            return 0, 0
+        ids = [reminder["_id"] for reminder in reminders]
+        try:
+            if self._enrich is not None:
+                reminders = self._enrich(reminders)
+            messages = [
+                {
+                    "to": reminder["user_email"],
+                    "subject": self.subject,
+                    "html": self._render(reminder),
+                    "kind": "reminder",
+                    "reminder_id": reminder["_id"]
+                }
+                for reminder in reminders if reminder.get("user_email")
+            ]
+            queued = self.outbox.enqueue_many(messages)
+        except Exception:
+            self.release(token, ids)
+            raise
+        # 沒有郵箱的提醒同樣標記，不再反覆領取
+        now = datetime.now()
+        self.collection.update_many(
+            {"_id": {"$in": ids}, "claim_token": token},
+            {"$set": {"queued_at": now}, "$unset": {"lease_expires_at": ""}}
+        )
+        missing = [reminder["_id"] for reminder in reminders if not reminder.get("user_email")]
+        if missing:
+            self.collection.update_many({"_id": {"$in": missing}}, {"$set": {"send_error": "缺少電子郵件地址"}})
+        return len(reminders), queued
+
+# 已確認存在 pending_key 唯一索引的集合
+_pending_key_indexes = set()
+_pending_key_lock = threading.Lock()
+
+def ensure_pending_reminder_index(collection):
+    """確保 pending_key 唯一索引存在，每個用戶只有一個待發送提醒依賴這個索引；
+    已有重複的待發送提醒（遷移版本10未執行）時拋出RuntimeError"""
+    with _pending_key_lock:
+        if collection.full_name in _pending_key_indexes:
+            return
+        try:
+            collection.create_index(
+                [("pending_key", ASCENDING)],
+                name="unique_pending_key",
+                unique=True,
+                partialFilterExpression={"pending_key": {"$exists": True}}
+            )
+        except OperationFailure as e:
+            raise RuntimeError(f"無法創建提醒的pending_key唯一索引，請先執行數據庫遷移（python migrations.py）: {e}")
+        _pending_key_indexes.add(collection.full_name)
+
+def upsert_pending_reminders(collection, reminders: List[Dict[str, Any]], days: int) -> Dict[str, Any]:
+    """創建或更新用戶的待發送提醒，每個用戶只保留最新報告的一個待發送提醒
+
+    reminders 為 [{"user_email", "report_id", "created_at"（從這個時間起計算提醒日期）, "summary"}]。
+    待發送提醒以 pending_key（用戶郵箱，唯一索引）標識：用戶已有待發送提醒時改為引用新報告並重新計算提醒日期，
+    否則插入新提醒。比已有提醒更早的提交（如日誌重放）不會覆蓋較新的提醒。
+    返回 {"created", "superseded", "skipped", "upserted_ids"}，skipped 為因用戶已有更新的提醒而沒有寫入的數量。
+    """
+    latest = {}
+    for reminder in reminders:
+        email = reminder.get("user_email")
+        if email and (email not in latest or latest[email]["created_at"] <= reminder["created_at"]):
+            latest[email] = reminder
+    if not latest:
+        return {"created": 0, "superseded": 0, "skipped": 0, "upserted_ids": []}
+    ensure_pending_reminder_index(collection)
+
+    now = datetime.now()
+    operations = [
+        UpdateOne(
+            {"pending_key": email, "scheduled_from": {"$lte": reminder["created_at"]}},
+            {
+                "$set": {
+                    "user_email": email,
+                    "report_id": reminder["report_id"],
+                    "scheduled_from": reminder["created_at"],
+                    "reminder_date": reminder["created_at"] + timedelta(days=days),
+                    "summary": reminder["summary"],
+                    "updated_at": now
+                },
+                "$setOnInsert": {"created_at": now, "sent": False}
+            },
+            upsert=True
+        )
+        for email, reminder in latest.items()
+    ]
+    created, superseded, upserted_ids = 0, 0, []
+    pending = operations
+    for attempt in range(2):
+        try:
+            result = collection.bulk_write(pending, ordered=False)
+            created += result.upserted_count
+            superseded += result.modified_count
+            upserted_ids.extend(result.upserted_ids.values())
+            pending = []
+            break
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            created += e.details.get("nUpserted", 0)
+            superseded += e.details.get("nModified", 0)
+            upserted_ids.extend(item["_id"] for item in e.details.get("upserted", []))
+            # 同一用戶並發插入時重試即成為更新
+            pending = [pending[error["index"]] for error in errors]
+    if pending:
+        # 重試仍然衝突說明用戶已有基於更新提交的待發送提醒（如日誌重放較舊的提交）
+        print(f"{len(pending)}個提醒沒有寫入：用戶已有基於更新提交的待發送提醒")
+    return {"created": created, "superseded": superseded, "skipped": len(pending), "upserted_ids": upserted_ids}
+
+def reminder_outcome(message: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """把發件箱郵件的發送結果轉換為提醒的 (結果, 更新)"""
+    status = message.get("status")
+    if status == STATUS_SENT:
+        return REMINDER_SENT, {
+            "$set": {"sent": True, "status": REMINDER_SENT, "sent_at": message.get("sent_at", datetime.now())},
+            "$unset": {"retry_at": "", "send_error": ""}
+        }
+    if status == STATUS_FAILED:
+        return REMINDER_FAILED, {
+            "$set": {"status": REMINDER_FAILED, "send_error": message.get("last_error", "發送失敗"),
+                     "failed_at": message.get("failed_at", datetime.now())},
+            "$unset": {"retry_at": ""}
+        }
+    if status == STATUS_PENDING:
+        return REMINDER_RETRY, {"$set": {
+            "status": REMINDER_RETRY,
+            "retry_at": message.get("next_attempt_at"),
+            "send_error": message.get("last_error", ""),
+            "attempts": message.get("attempts", 0)
+        }}
+    return None
+
+class ReminderStatusWriter:
+    """累積提醒郵件的發送結果（sent / failed / retry_at），按塊用 bulk_write 寫回reminders集合
+
+    record 只在內存中記錄，同一提醒只保留最新的結果；累積滿 chunk_size 個時立即寫回，
+    其餘由後台任務每 flush_interval 秒寫回一次。寫回失敗的結果保留到下一次重試。
+
+    最終結果（sent / failed）以發件箱郵件為準：寫回提醒後把郵件的 reminder_synced 設為True。
+    進程在寫回前崩潰時，啟動後和每 reconcile_interval 秒從 outbox_collection 讀取
+    reminder_synced 仍為False的已完成郵件重新寫回，提醒不會一直停留在未發送狀態。
+    """
+
+    def __init__(self, collection, outbox_collection=None, chunk_size: int = REMINDER_STATUS_CHUNK_SIZE,
+                 flush_interval: float = REMINDER_STATUS_FLUSH_INTERVAL,
+                 reconcile_interval: float = REMINDER_STATUS_RECONCILE_INTERVAL):
+        self.collection = collection
+        self.outbox_collection = outbox_collection
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        # 提醒ID -> (更新, 最終結果對應的發件箱郵件ID；等待重試的結果為None)
+        self._pending: Dict[Any, Tuple[UpdateOne, Any]] = {}
+        self._lock = threading.Lock()
+        # 寫回串行執行，保證同一提醒先後兩次的結果按順序寫入
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = {REMINDER_SENT: 0, REMINDER_FAILED: 0, REMINDER_RETRY: 0}
+        self.written = 0
+        self.chunks = 0
+        self.reconciled = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def record(self, messages: List[Dict[str, Any]]):
+        """記錄一批發件箱郵件的發送結果，非提醒郵件忽略"""
+        with self._lock:
+            for message in messages:
+                reminder_id = message.get("reminder_id")
+                outcome = reminder_outcome(message) if reminder_id is not None else None
+                if outcome is None:
+                    continue
+                result, update = outcome
+                message_id = message.get("_id") if result != REMINDER_RETRY else None
+                self._pending[reminder_id] = (UpdateOne({"_id": reminder_id}, update), message_id)
+                self.recorded[result] += 1
+            full = len(self._pending) >= self.chunk_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """把累積的結果按塊寫回"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = list(self._pending.items()), {}
+            for start in range(0, len(pending), self.chunk_size):
+                chunk = pending[start:start + self.chunk_size]
+                try:
+                    self.collection.bulk_write([update for _, (update, _) in chunk], ordered=False)
+                    synced = [message_id for _, (_, message_id) in chunk if message_id is not None]
+                    if synced and self.outbox_collection is not None:
+                        self.outbox_collection.update_many({"_id": {"$in": synced}}, {"$set": {"reminder_synced": True}})
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    print(f"寫回提醒發送結果時出錯，{len(pending) - start}個結果稍後重試: {e}")
+                    with self._lock:
+                        # 期間記錄的更新的結果優先
+                        for reminder_id, update in pending[start:]:
+                            self._pending.setdefault(reminder_id, update)
+                    return
+                self.written += len(chunk)
+                self.chunks += 1
+
+    def reconcile(self) -> int:
+        """從發件箱補寫已完成但結果還沒有寫回提醒的郵件，返回補寫的數量"""
+        if self.outbox_collection is None:
+            return 0
+        total = 0
+        while True:
+            messages = list(self.outbox_collection.find(
+                {"reminder_synced": False, "status": {"$in": [STATUS_SENT, STATUS_FAILED]}},
+                {"html": 0, "attachments": 0}
+            ).limit(self.chunk_size))
+            if not messages:
+                break
+            errors = self.errors
+            self.record(messages)
+            self.flush()
+            if self.errors != errors:
+                break
+            total += len(messages)
+        if total:
+            self.reconciled += total
+            print(f"從發件箱補寫了{total}個提醒的發送結果")
+        return total
+
+    def start(self):
+        """啟動定時寫回任務"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止定時寫回，並寫回剩餘的結果"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await run_db(self.flush)
+
+    async def _run(self):
+        next_reconcile = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_reconcile:
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+                    await run_db(self.reconcile)
+            except Exception as e:
+                print(f"補寫提醒發送結果時出錯: {e}")
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                await run_db(self.flush)
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回待寫回數量和寫回統計"""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": dict(self.recorded),
+                "written": self.written,
+                "chunks": self.chunks,
+                "chunk_size": self.chunk_size,
+                "reconciled": self.reconciled,
+                "errors": self.errors,
+                "last_error": self.last_error
+            }
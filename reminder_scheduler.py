@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from db import run_db
+
+# 提醒調度配置（可通過環境變量調整）
+# 每次從數據庫加載未來這麼多秒內到期的提醒
+REMINDER_SCHEDULER_HORIZON = float(os.environ.get("REMINDER_SCHEDULER_HORIZON", "3600"))
+# 堆中最多保存的提醒數；積壓超過時只加載最早到期的部分，處理完後再加載下一批
+REMINDER_SCHEDULER_MAX_SCHEDULED = int(os.environ.get("REMINDER_SCHEDULER_MAX_SCHEDULED", "10000"))
+# 重新加載的間隔秒數，用於發現其他進程創建的提醒
+REMINDER_SCHEDULER_REFRESH = float(os.environ.get("REMINDER_SCHEDULER_REFRESH", "60"))
+# 每批處理的到期提醒數
+REMINDER_SCHEDULER_BATCH_SIZE = int(os.environ.get("REMINDER_SCHEDULER_BATCH_SIZE", "100"))
+
+class ReminderScheduler:
+    """持續運行的提醒調度器：按到期時間維護一個最小堆，睡眠到下一個提醒到期，再分批領取並加入發件箱
+
+    load(until, limit) 按到期時間順序返回 until 之前到期、尚未處理的提醒 [(到期時間, 提醒ID)]，
+    包括停機期間已經過期的提醒，因此重啟後會補發。堆中只保存 horizon 秒內到期的提醒，
+    數據庫中有再多待發送的提醒也不需要全表掃描。dispatch(ids) 領取並發送提醒，返回實際處理的數量；
+    已被其他進程處理的提醒由 dispatch 跳過。load 和 dispatch 在線程池中執行。
+    """
+
+    def __init__(self, load: Callable[[datetime, int], List[Tuple[datetime, Hashable]]],
+                 dispatch: Callable[[List[Hashable]], int], enabled: Optional[Callable[[], bool]] = None,
+                 horizon: float = REMINDER_SCHEDULER_HORIZON, max_scheduled: int = REMINDER_SCHEDULER_MAX_SCHEDULED,
+                 refresh_interval: float = REMINDER_SCHEDULER_REFRESH, batch_size: int = REMINDER_SCHEDULER_BATCH_SIZE):
+        self._load = load
+        self._dispatch = dispatch
+        self._enabled = enabled
+        self.horizon = horizon
+        self.max_scheduled = max_scheduled
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self._heap: List[Tuple[datetime, Any]] = []
+        self._scheduled = set()
+        # 堆中包含了這個時間之前到期的所有提醒（本進程之外新建的提醒除外）
+        self._loaded_until: Optional[datetime] = None
+        self._truncated = False
+        self._next_refresh = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.refreshes = 0
+        self.batches = 0
+        self.dispatched = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """啟動調度任務"""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止調度，未處理的提醒在下次啟動時補發"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, reminder_id: Hashable, due: datetime):
+        """本進程新建提醒時調用（可在任意線程中），到期時間在已加載範圍內的直接加入堆"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._push, due, reminder_id)
+
+    def _push(self, due: datetime, reminder_id: Hashable):
+        if reminder_id in self._scheduled or self._loaded_until is None or due > self._loaded_until:
+            return
+        heapq.heappush(self._heap, (due, reminder_id))
+        self._scheduled.add(reminder_id)
+        self._wake.set()
+
+    async def _refresh(self):
+        """從數據庫加載 horizon 內到期的提醒"""
+        until = datetime.now() + timedelta(seconds=self.horizon)
+        rows = await run_db(self._load, until, self.max_scheduled)
+        for due, reminder_id in rows:
+            if reminder_id not in self._scheduled:
+                heapq.heappush(self._heap, (due, reminder_id))
+                self._scheduled.add(reminder_id)
+        # 結果被截斷時，最後一個提醒之後到期的尚未加載
+        self._truncated = len(rows) >= self.max_scheduled
+        self._loaded_until = rows[-1][0] if self._truncated else until
+        self._next_refresh = time.monotonic() + self.refresh_interval
+        self.refreshes += 1
+
+    def _pop_due(self, now: datetime) -> List[Tuple[datetime, Any]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            item = heapq.heappop(self._heap)
+            self._scheduled.discard(item[1])
+            due.append(item)
+        return due
+
+    async def _sleep(self, seconds: float):
+        """等待指定秒數，新提醒加入時提前喚醒"""
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), max(seconds, 0.0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                if time.monotonic() >= self._next_refresh or (self._truncated and not self._heap):
+                    await self._refresh()
+                if self._enabled is not None and not await run_db(self._enabled):
+                    # 提醒功能禁用（或暫時無法發送）時不發送，恢復後補發期間到期的提醒
+                    await self._sleep(self.refresh_interval)
+                    continue
+                now = datetime.now()
+                due = self._pop_due(now)
+                if due:
+                    dispatched = await run_db(self._dispatch, [reminder_id for _, reminder_id in due])
+                    self.batches += 1
+                    self.dispatched += dispatched
+                    self.skipped += len(due) - dispatched
+                    self.last_lag = (now - due[0][0]).total_seconds()
+                    self.max_lag = max(self.max_lag, self.last_lag)
+                    continue
+                wait = self._next_refresh - time.monotonic()
+                if self._heap:
+                    wait = min(wait, (self._heap[0][0] - now).total_seconds())
+                await self._sleep(wait)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 出錯時已取出的提醒不在堆中，下次加載時重新調度
+                self.last_error = str(e)
+                print(f"調度提醒時出錯: {e}")
+                self._next_refresh = time.monotonic() + min(self.refresh_interval, 5.0)
+                await self._sleep(min(self.refresh_interval, 5.0))
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回堆大小、下一個到期時間和發送延遲（從到期到加入發件箱）"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "scheduled": len(self._heap),
+            "next_due": self._heap[0][0].isoformat() if self._heap else None,
+            "loaded_until": self._loaded_until.isoformat() if self._loaded_until else None,
+            "truncated": self._truncated,
+            "refreshes": self.refreshes,
+            "batches": self.batches,
+            "dispatched": self.dispatched,
+            "skipped": self.skipped,
+            "last_lag_ms": self.last_lag * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+            "last_error": self.last_error
+        }
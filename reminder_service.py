@@ -1,15 +1,22 @@
 from fastapi import FastAPI, HTTPException, Depends, Body, Request, status, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel, EmailStr
 from typing import List, Dict, Optional, Any
 import json
 import os
-import pymongo
 from datetime import datetime, timedelta
 import random
 import secrets
+from admin_auth import get_current_admin
+from db import get_collection, pool_stats, run_db
+from mail_outbox import MailOutbox, mail_settings_complete
+from reminder_queue import ReminderQueue, upsert_pending_reminders
+from reminder_scheduler import ReminderScheduler
+from report_views import ReportReminderView, attach_reminder_summaries, find_report
+from settings_cache import SETTINGS_CHANGE_STREAM, SettingsCache
+from template_engine import render_template
 
 # 創建FastAPI應用
 app = FastAPI(title="客戶二次測試提醒系統API")
@@ -23,24 +30,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 安全認證
-security = HTTPBasic()
-
-# 管理員憑證
-ADMIN_USERNAME = "forest"
-ADMIN_PASSWORD = "lillian1231235555"
-
 # 確保數據目錄存在
 os.makedirs("data", exist_ok=True)
 
+# 提醒郵件中重新評估的鏈接
+ASSESSMENT_URL = os.environ.get("ASSESSMENT_URL", "https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer")
+
 # 連接到MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
-    db = client["health_app"]
-    users_collection = db["users"]
-    reports_collection = db["reports"]
-    reminders_collection = db["reminders"]
-    settings_collection = db["settings"]
+    users_collection = get_collection("users")
+    reports_collection = get_collection("reports")
+    reminders_collection = get_collection("reminders")
+    settings_collection = get_collection("settings")
+    settings_cache = SettingsCache(settings_collection)
+    # 提醒郵件加入發件箱，由報告服務的工作任務發送
+    mail_outbox = MailOutbox(get_collection("mail_outbox"))
+    # 到期提醒通過租約領取，多個進程同時處理時不會重複發送
+    reminder_queue = ReminderQueue(
+        reminders_collection,
+        mail_outbox,
+        lambda reminder: generate_reminder_email(reminder),
+        enrich=lambda reminders: attach_reminder_summaries(reports_collection, reminders)
+    )
 except Exception as e:
     print(f"MongoDB連接錯誤: {e}")
     # 如果無法連接到MongoDB，使用內存存儲作為備用
@@ -60,25 +71,11 @@ class Reminder(BaseModel):
     reminder_date: datetime
     sent: bool = False
 
-# 認證函數
-def get_current_admin(credentials: HTTPBasicCredentials = Depends(security)):
-    is_correct_username = secrets.compare_digest(credentials.username, ADMIN_USERNAME)
-    is_correct_password = secrets.compare_digest(credentials.password, ADMIN_PASSWORD)
-    
-    if not (is_correct_username and is_correct_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="認證失敗",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    
-    return credentials.username
-
 # 輔助函數
 def get_reminder_settings():
     """獲取提醒設置"""
     try:
-        settings = settings_collection.find_one({"type": "reminder"})
+        settings = settings_cache.get("reminder")
         if settings:
             return {
                 "days": settings.get("days", 15),
@@ -88,6 +85,7 @@ def get_reminder_settings():
             # 如果設置不存在，創建默認設置
             default_settings = {"type": "reminder", "days": 15, "enabled": True}
             settings_collection.insert_one(default_settings)
+            settings_cache.invalidate("reminder")
             return {"days": 15, "enabled": True}
     except Exception as e:
         print(f"獲取提醒設置時出錯: {e}")
@@ -102,7 +100,7 @@ def get_reminder_settings():
 def get_email_settings():
     """獲取郵件設置"""
     try:
-        settings = settings_collection.find_one({"type": "email"})
+        settings = settings_cache.get("email")
         if settings:
             return {
                 "gmail_user": settings.get("gmail_user", ""),
@@ -130,27 +128,22 @@ def create_reminder(user_email, report_id):
             return
         
         # 獲取報告數據
-        report = reports_collection.find_one({"report_id": report_id})
+        report = find_report(reports_collection, ReportReminderView, report_id)
         if not report:
             print(f"找不到報告: {report_id}")
             return
         
-        # 計算提醒日期
-        reminder_date = datetime.now() + timedelta(days=reminder_settings["days"])
-        
-        # 創建提醒數據
-        reminder_data = {
+        # 寫入用戶的待發送提醒，用戶已有未發送的提醒時改為引用這份報告
+        created_at = datetime.now()
+        result = upsert_pending_reminders(reminders_collection, [{
             "user_email": user_email,
             "report_id": report_id,
-            "created_at": datetime.now(),
-            "reminder_date": reminder_date,
-            "sent": False,
-            "health_data": report.get("health_data", {}),
-            "recommendations": report.get("recommendations", {})
-        }
-        
-        # 保存到數據庫
-        reminders_collection.insert_one(reminder_data)
+            "created_at": created_at,
+            "summary": report.summary()
+        }], reminder_settings["days"])
+        # 新建的提醒到期時間在調度器已加載的範圍內時直接加入調度
+        for reminder_id in result["upserted_ids"]:
+            reminder_scheduler.schedule(reminder_id, created_at + timedelta(days=reminder_settings["days"]))
     except Exception as e:
         print(f"創建提醒時出錯: {e}")
         # 如果數據庫操作失敗，使用內存存儲
@@ -167,66 +160,27 @@ def create_reminder(user_email, report_id):
 def generate_reminder_email(reminder):
     """生成提醒郵件內容"""
     try:
-        # 獲取用戶數據
-        user_email = reminder.get("user_email")
-        health_data = reminder.get("health_data", {})
-        recommendations = reminder.get("recommendations", {})
+        # 提醒中保存的報告摘要（發送前由 attach_reminder_summaries 補充）
+        summary = reminder.get("summary", {})
         
         # 獲取基本信息
-        basic_info = health_data.get("basicInfo", {})
-        gender = "男" if basic_info.get("gender") == "male" else "女" if basic_info.get("gender") == "female" else "其他"
-        age = basic_info.get("age", "")
+        gender = "男" if summary.get("gender") == "male" else "女" if summary.get("gender") == "female" else "其他"
+        age = summary.get("age", "")
         
         # 獲取症狀和推薦
-        symptoms = health_data.get("symptoms", [])
-        supplements = recommendations.get("supplements", [])
+        symptoms = summary.get("symptoms", [])
+        supplements = summary.get("supplements", [])
         
-        # 生成郵件內容
-        html_content = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                h1 {{ color: #2c3e50; }}
-                h2 {{ color: #3498db; }}
-                .highlight {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; }}
-                .button {{ display: inline-block; background-color: #3498db; color: white; padding: 10px 20px; 
-                          text-decoration: none; border-radius: 5px; margin-top: 20px; }}
-                .footer {{ margin-top: 30px; font-size: 12px; color: #7f8c8d; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>健康評估跟進提醒</h1>
-                <p>親愛的用戶：</p>
-                <p>距離您上次的健康評估已經快三個月了，我們建議您進行一次健康重新評估，以了解您的健康狀況變化並調整保健方案。</p>
-                
-                <div class="highlight">
-                    <h2>您上次的健康評估摘要</h2>
-                    <p><strong>基本信息：</strong> {gender}性，{age}歲</p>
-                    <p><strong>主要健康問題：</strong> {', '.join(symptoms) if symptoms else '無特定症狀'}</p>
-                    <p><strong>推薦保健品：</strong> {', '.join(supplements[:3]) if supplements else '無特定推薦'}</p>
-                </div>
-                
-                <p>定期的健康評估可以幫助您：</p>
-                <ul>
-                    <li>追蹤健康狀況的改善情況</li>
-                    <li>調整保健品使用方案</li>
-                    <li>發現潛在的健康問題</li>
-                    <li>獲得更個性化的健康建議</li>
-                </ul>
-                
-                <a href="https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer" class="button">立即進行健康重新評估</a>
-                
-                <div class="footer">
-                    <p>此郵件是系統自動發送的。如果您有任何問題，請回覆此郵件或聯繫我們的客服團隊。</p>
-                    <p>© {datetime.now().year} 健康問卷與保健品推薦系統. 保留所有權利.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        # 使用已編譯的提醒郵件模板渲染
+        html_content = render_template(
+            "reminder_email",
+            gender=gender,
+            age=age,
+            symptoms=symptoms,
+            supplements=supplements,
+            assessment_url=ASSESSMENT_URL,
+            current_year=datetime.now().year
+        )
         
         return html_content
     except Exception as e:
@@ -237,7 +191,7 @@ def generate_reminder_email(reminder):
             <h1>健康評估跟進提醒</h1>
             <p>親愛的用戶：</p>
             <p>距離您上次的健康評估已經快三個月了，我們建議您進行一次健康重新評估，以了解您的健康狀況變化並調整保健方案。</p>
-            <a href="https://3000-i7e87zu064zishv2x26yv-f1b3cae6.manus.computer">立即進行健康重新評估</a>
+            <a href="{ASSESSMENT_URL}">立即進行健康重新評估</a>
         </body>
         </html>
         """
@@ -260,8 +214,8 @@ def send_email(to_email, subject, html_content):
         print(f"發送郵件時出錯: {e}")
         return False
 
-def check_and_send_reminders(background_tasks: BackgroundTasks):
-    """檢查並發送提醒"""
+def check_and_send_reminders():
+    """檢查今天及之前到期的提醒（包括停機期間錯過的），把提醒郵件加入發件箱"""
     try:
         # 獲取提醒設置
         reminder_settings = get_reminder_settings()
@@ -269,54 +223,97 @@ def check_and_send_reminders(background_tasks: BackgroundTasks):
         if not reminder_settings["enabled"]:
             return {"success": True, "message": "提醒功能已禁用"}
         
-        # 獲取今天應該發送的提醒
+        # 郵件設置不完整時不領取提醒，提醒保持待發送，保存設置後再加入發件箱
+        if not mail_settings_complete(get_email_settings()):
+            return {"success": False, "message": "郵件設置不完整，提醒暫不發送，請檢查郵件設置"}
+        
+        # 獲取今天結束前應該發送、尚未加入發件箱的提醒
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         tomorrow = today + timedelta(days=1)
         
-        reminders = reminders_collection.find({
-            "reminder_date": {"$gte": today, "$lt": tomorrow},
-            "sent": False
-        })
+        # 分批領取，多個進程同時檢查時每個提醒只會被一個進程領取
+        queued_count = 0
+        while True:
+            claimed, queued = reminder_queue.dispatch(due_before=tomorrow)
+            if not claimed:
+                break
+            queued_count += queued
         
-        sent_count = 0
-        for reminder in reminders:
-            user_email = reminder.get("user_email")
-            if not user_email:
-                continue
-            
-            # 生成提醒郵件內容
-            html_content = generate_reminder_email(reminder)
-            
-            # 發送郵件
-            background_tasks.add_task(
-                send_email,
-                user_email,
-                "健康評估跟進提醒",
-                html_content
-            )
-            
-            # 更新提醒狀態
-            reminders_collection.update_one(
-                {"_id": reminder["_id"]},
-                {"$set": {"sent": True, "sent_at": datetime.now()}}
-            )
-            
-            sent_count += 1
-        
-        return {"success": True, "message": f"已發送{sent_count}個提醒"}
+        return {"success": True, "message": f"已將{queued_count}個提醒加入發送隊列"}
     except Exception as e:
         print(f"檢查並發送提醒時出錯: {e}")
         return {"success": False, "message": f"發送提醒時出錯: {str(e)}"}
 
+def load_due_reminders(until, limit):
+    """按到期時間順序返回 until 之前到期、尚未加入發件箱的提醒（使用 pending_reminder_date 索引）"""
+    cursor = reminders_collection.find(
+        {"sent": False, "reminder_date": {"$lt": until}, "queued_at": {"$exists": False}},
+        {"reminder_date": 1}
+    ).sort("reminder_date", 1).limit(limit)
+    return [(reminder["reminder_date"], reminder["_id"]) for reminder in cursor]
+
+def dispatch_reminders(reminder_ids):
+    """調度器取出的到期提醒加入發件箱，已被其他進程領取的跳過"""
+    _, queued_count = reminder_queue.dispatch(len(reminder_ids), ids=reminder_ids)
+    if queued_count:
+        print(f"已將{queued_count}個到期提醒加入發送隊列")
+    return queued_count
+
+def reminders_deliverable():
+    """提醒功能已啟用且郵件設置完整；否則調度器不領取提醒，設置完成後補發期間到期的提醒"""
+    return get_reminder_settings()["enabled"] and mail_settings_complete(get_email_settings())
+
+# 提醒調度器：到期的提醒自動加入發件箱，設為0時只能通過 /api/reminders/check 手動檢查
+REMINDER_SCHEDULER = os.environ.get("REMINDER_SCHEDULER", "1") == "1"
+reminder_scheduler = ReminderScheduler(
+    load_due_reminders,
+    dispatch_reminders,
+    enabled=reminders_deliverable
+)
+
+# 生命週期事件
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    """啟動提醒調度器"""
+    if REMINDER_SCHEDULER and 'reminders_collection' in globals():
+        reminder_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    """停止提醒調度器"""
+    await reminder_scheduler.stop()
+
+@app.on_event("startup")
+async def watch_settings():
+    """監聽設置變更，其他服務修改設置後本服務的緩存立即失效"""
+    if SETTINGS_CHANGE_STREAM and 'settings_cache' in globals():
+        settings_cache.watch()
+
+@app.on_event("shutdown")
+async def stop_settings_watch():
+    """停止監聽設置變更"""
+    if 'settings_cache' in globals():
+        settings_cache.stop()
+
 # API端點
 @app.get("/")
 async def root():
     return {"message": "客戶二次測試提醒系統API"}
 
+@app.get("/api/db/metrics", response_model=Dict[str, Any])
+async def get_db_metrics(_: str = Depends(get_current_admin)):
+    """獲取MongoDB連接池統計"""
+    return pool_stats()
+
+@app.get("/api/settings/cache", response_model=Dict[str, Any])
+async def get_settings_cache_metrics(_: str = Depends(get_current_admin)):
+    """獲取設置緩存統計"""
+    return settings_cache.stats() if 'settings_cache' in globals() else {}
+
 @app.get("/api/reminders/settings", response_model=ReminderSettings)
 async def get_reminder_settings_api(_: str = Depends(get_current_admin)):
     """獲取提醒設置"""
-    settings = get_reminder_settings()
+    settings = await run_db(get_reminder_settings)
     return ReminderSettings(**settings)
 
 @app.post("/api/reminders/settings", response_model=ReminderSettings)
@@ -324,11 +321,13 @@ async def update_reminder_settings_api(settings: ReminderSettings, _: str = Depe
     """更新提醒設置"""
     try:
         settings_dict = settings.dict()
-        settings_collection.update_one(
+        await run_db(
+            settings_collection.update_one,
             {"type": "reminder"},
             {"$set": settings_dict},
             upsert=True
         )
+        settings_cache.invalidate("reminder")
         return settings
     except Exception as e:
         print(f"更新提醒設置時出錯: {e}")
@@ -343,7 +342,7 @@ async def update_reminder_settings_api(settings: ReminderSettings, _: str = Depe
 async def get_reminders(_: str = Depends(get_current_admin)):
     """獲取所有提醒"""
     try:
-        reminders = list(reminders_collection.find({}, {"_id": 0}))
+        reminders = await run_db(lambda: list(reminders_collection.find({}, {"_id": 0})))
         return reminders
     except Exception as e:
         print(f"獲取提醒時出錯: {e}")
@@ -353,9 +352,14 @@ async def get_reminders(_: str = Depends(get_current_admin)):
         return []
 
 @app.post("/api/reminders/check", response_model=Dict[str, Any])
-async def check_reminders(background_tasks: BackgroundTasks, _: str = Depends(get_current_admin)):
-    """檢查並發送提醒"""
-    return check_and_send_reminders(background_tasks)
+async def check_reminders(_: str = Depends(get_current_admin)):
+    """檢查今天及之前到期的提醒並加入發件箱"""
+    return await run_db(check_and_send_reminders)
+
+@app.get("/api/reminders/scheduler", response_model=Dict[str, Any])
+async def get_reminder_scheduler_metrics(_: str = Depends(get_current_admin)):
+    """獲取提醒調度器狀態"""
+    return reminder_scheduler.metrics()
 
 @app.post("/api/reminders/test", response_model=Dict[str, Any])
 async def test_reminder_email(data: Dict[str, str] = Body(...), _: str = Depends(get_current_admin)):
@@ -372,17 +376,11 @@ async def test_reminder_email(data: Dict[str, str] = Body(...), _: str = Depends
             "created_at": datetime.now(),
             "reminder_date": datetime.now(),
             "sent": False,
-            "health_data": {
-                "basicInfo": {
-                    "gender": "male",
-                    "age": "35"
-                },
+            "summary": {
+                "gender": "male",
+                "age": "35",
                 "symptoms": ["失眠", "疲勞", "頭痛"],
-                "bodySystemIssues": ["神經系統", "消化系統"],
-                "specificConditions": ["乾眼症"]
-            },
-            "recommendations": {
-                "supplements": ["魚油", "B群", "維他命C", "鈣鎂鋅"]
+                "supplements": ["魚油", "B群", "維他命C"]
             }
         }
         
@@ -390,7 +388,8 @@ async def test_reminder_email(data: Dict[str, str] = Body(...), _: str = Depends
         html_content = generate_reminder_email(test_reminder)
         
         # 發送測試郵件
-        success = send_email(
+        success = await run_in_threadpool(
+            send_email,
             email,
             "【測試】健康評估跟進提醒",
             html_content
@@ -419,7 +418,7 @@ async def create_reminder_api(data: Dict[str, str] = Body(...), _: str = Depends
             raise HTTPException(status_code=400, detail="缺少報告ID")
         
         # 創建提醒
-        create_reminder(email, report_id)
+        await run_db(create_reminder, email, report_id)
         
         return {"success": True, "message": f"已為 {email} 創建提醒"}
     except HTTPException:
@@ -431,7 +430,7 @@ async def create_reminder_api(data: Dict[str, str] = Body(...), _: str = Depends
 async def delete_reminder(reminder_id: str, _: str = Depends(get_current_admin)):
     """刪除提醒"""
     try:
-        result = reminders_collection.delete_one({"_id": reminder_id})
+        result = await run_db(reminders_collection.delete_one, {"_id": reminder_id})
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail=f"找不到提醒: {reminder_id}")
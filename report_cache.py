@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from recommendation_cache import RecommendationCache
+
+def report_content_hash(report) -> str:
+    """報告（ReportRenderView）中參與渲染的內容的哈希"""
+    payload = json.dumps(report.content(), ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def render_key(report, template_version: str) -> str:
+    """渲染結果的緩存鍵：報告ID、模板版本和內容哈希，任一改變都會得到新的鍵"""
+    return f"{report.report_id}-{template_version}-{report_content_hash(report)}"
+
+def etag_for(key: str) -> str:
+    return f'"{key}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判斷If-None-Match請求頭是否包含當前ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # 弱比較：忽略W/前綴
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+class ReportRenderCache:
+    """渲染結果緩存：HTML保存在內存LRU中，PDF保存在磁盤目錄中並按總大小淘汰"""
+
+    def __init__(self, html_maxsize: int = 256, pdf_dir: str = "reports/cache", pdf_max_bytes: int = 512 * 1024 * 1024):
+        self.html = RecommendationCache(maxsize=html_maxsize, ttl=0)
+        self.pdf_dir = pdf_dir
+        self.pdf_max_bytes = pdf_max_bytes
+        self._lock = threading.Lock()
+        self._pdf_sizes: Dict[str, int] = {}
+        self._pdf_bytes = 0
+        self.pdf_hits = 0
+        self.pdf_misses = 0
+        self.pdf_evictions = 0
+        os.makedirs(pdf_dir, exist_ok=True)
+        self._scan_pdf_dir()
+
+    def _scan_pdf_dir(self):
+        """啟動時登記磁盤上已有的PDF，重啟後緩存仍然有效"""
+        for name in os.listdir(self.pdf_dir):
+            if name.endswith(".pdf"):
+                path = os.path.join(self.pdf_dir, name)
+                self._pdf_sizes[path] = os.path.getsize(path)
+        self._pdf_bytes = sum(self._pdf_sizes.values())
+        self._evict_pdfs()
+
+    def get_html(self, key: str) -> Optional[str]:
+        return self.html.get(key)
+
+    def put_html(self, key: str, html: str):
+        self.html.put(key, html)
+
+    def pdf_path(self, key: str) -> str:
+        """PDF在磁盤緩存中的路徑"""
+        return os.path.join(self.pdf_dir, f"{key}.pdf")
+
+    def get_pdf(self, key: str) -> Optional[str]:
+        """返回已緩存PDF的路徑，不存在時返回None"""
+        path = self.pdf_path(key)
+        with self._lock:
+            if path in self._pdf_sizes and os.path.exists(path):
+                self.pdf_hits += 1
+                # 更新修改時間，淘汰時按最近使用排序
+                os.utime(path)
+                return path
+            self._pdf_sizes.pop(path, None)
+            self.pdf_misses += 1
+            return None
+
+    def has_pdf(self, key: str) -> bool:
+        """PDF是否已緩存（不計入命中統計）"""
+        return self.pdf_path(key) in self._pdf_sizes
+
+    def read_pdf(self, key: str) -> Optional[bytes]:
+        """讀取已緩存的PDF內容，不存在時返回None"""
+        path = self.get_pdf(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # 讀取前剛好被淘汰
+            return None
+
+    def put_pdf(self, key: str, data: bytes):
+        """寫入PDF，超出總大小時淘汰最久未使用的文件"""
+        path = self.pdf_path(key)
+        # 先寫同目錄下的文件再改名，其他請求不會讀到寫了一半的PDF
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        size = len(data)
+        with self._lock:
+            self._pdf_bytes += size - self._pdf_sizes.get(path, 0)
+            self._pdf_sizes[path] = size
+            self._evict_pdfs(keep=path)
+
+    def _evict_pdfs(self, keep: Optional[str] = None):
+        if self._pdf_bytes <= self.pdf_max_bytes:
+            return
+        by_age = sorted(self._pdf_sizes, key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in by_age:
+            if self._pdf_bytes <= self.pdf_max_bytes:
+                break
+            if path == keep:
+                continue
+            self._pdf_bytes -= self._pdf_sizes.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.pdf_evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回HTML和PDF兩層緩存的統計數據"""
+        with self._lock:
+            pdf_lookups = self.pdf_hits + self.pdf_misses
+            return {
+                "html": self.html.stats(),
+                "pdf": {
+                    "files": len(self._pdf_sizes),
+                    "bytes": self._pdf_bytes,
+                    "max_bytes": self.pdf_max_bytes,
+                    "hits": self.pdf_hits,
+                    "misses": self.pdf_misses,
+                    "hit_rate": self.pdf_hits / pdf_lookups if pdf_lookups else 0.0,
+                    "evictions": self.pdf_evictions
+                }
+            }
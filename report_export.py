@@ -0,0 +1,339 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from db import run_db
+from report_rendering import render_report_html, render_report_pdf
+from report_views import ReportRenderView
+
+# 導出文件和進度記錄的目錄
+EXPORT_DIR = os.environ.get("REPORT_EXPORT_DIR", "exports")
+# 按 (created_at, report_id) 排序，斷點可以精確續傳
+EXPORT_SORT = [("created_at", 1), ("report_id", 1)]
+# 導出ID是 create_job 生成的uuid十六進制字符串，同時用作文件名，其他值一律視為不存在
+EXPORT_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# 進度記錄中最多保留的錯誤數
+MAX_RECORDED_ERRORS = 1000
+
+def parse_export_date(value: Optional[str]) -> Optional[datetime]:
+    """解析 YYYY-MM-DD 格式的日期"""
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def export_query(start: Optional[str] = None, end: Optional[str] = None, email: Optional[str] = None) -> Dict[str, Any]:
+    """按日期範圍（包含結束日期）和郵箱構建報告查詢"""
+    query: Dict[str, Any] = {}
+    created_at = {}
+    if start:
+        created_at["$gte"] = parse_export_date(start)
+    if end:
+        created_at["$lt"] = parse_export_date(end) + timedelta(days=1)
+    if created_at:
+        query["created_at"] = created_at
+    if email:
+        query["email"] = email
+    return query
+
+def export_token(report: ReportRenderView) -> str:
+    """報告在導出順序中的位置，用於續傳"""
+    return f"{report.created_at.isoformat()}|{report.report_id}"
+
+def after_token_query(query: Dict[str, Any], token: Optional[str]) -> Dict[str, Any]:
+    """在查詢上加上「排在token之後」的條件"""
+    if not token:
+        return query
+    created_at, report_id = token.split("|", 1)
+    created_at = datetime.fromisoformat(created_at)
+    after = {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "report_id": {"$gt": report_id}}
+    ]}
+    return {"$and": [query, after]} if query else after
+
+def entry_name(report: ReportRenderView) -> str:
+    """報告在ZIP中的文件名"""
+    return f"{report.created_at:%Y%m%d-%H%M%S}_{report.report_id}.pdf"
+
+def render_export_pdf(report: ReportRenderView, timeout: float) -> Tuple[Optional[bytes], Optional[str]]:
+    """在工作進程中渲染一份報告的PDF，返回 (PDF字節, 錯誤信息)"""
+    try:
+        return render_report_pdf(render_report_html(report), timeout=timeout), None
+    except Exception as e:
+        return None, str(e)
+
+class ZipStream:
+    """只追加的ZIP輸出緩衝區，zipfile寫入後取出已生成的字節發送給客戶端"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+class ExportJob:
+    """一次導出的過濾條件和進度，保存在 EXPORT_DIR/{export_id}.json 中"""
+
+    def __init__(self, export_id: str, filters: Dict[str, Optional[str]], mode: str):
+        self.export_id = export_id
+        self.filters = filters
+        self.mode = mode
+        self.status = "pending"
+        self.total = 0
+        self.exported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, str]] = []
+        self.last_token: Optional[str] = None
+        self.parts: List[str] = []
+        self.started_at = datetime.now()
+        self.updated_at = self.started_at
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(EXPORT_DIR, f"{self.export_id}.json")
+
+    def record(self, report: ReportRenderView, error: Optional[str]):
+        if error is None:
+            self.exported += 1
+        else:
+            self.failed += 1
+            if len(self.errors) < MAX_RECORDED_ERRORS:
+                self.errors.append({"report_id": report.report_id, "error": error})
+        self.last_token = export_token(report)
+        self.updated_at = datetime.now()
+
+    def to_dict(self) -> Dict[str, Any]:
+        processed = self.exported + self.failed
+        return {
+            "export_id": self.export_id,
+            "filters": self.filters,
+            "mode": self.mode,
+            "status": self.status,
+            "total": self.total,
+            "exported": self.exported,
+            "failed": self.failed,
+            "progress": processed / self.total if self.total else 0.0,
+            "errors": self.errors,
+            "last_token": self.last_token,
+            "parts": self.parts,
+            "started_at": self.started_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def save(self):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, export_id: str) -> Optional["ExportJob"]:
+        if not EXPORT_ID_PATTERN.fullmatch(export_id):
+            return None
+        path = os.path.join(EXPORT_DIR, f"{export_id}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        job = cls(data["export_id"], data["filters"], data["mode"])
+        for field in ("status", "total", "exported", "failed", "errors", "last_token", "parts"):
+            setattr(job, field, data[field])
+        job.started_at = datetime.fromisoformat(data["started_at"])
+        job.updated_at = datetime.fromisoformat(data["updated_at"])
+        if data.get("finished_at"):
+            job.finished_at = datetime.fromisoformat(data["finished_at"])
+        return job
+
+class ReportExporter:
+    """批量導出報告PDF：分批讀取游標，在多個工作進程中並行渲染，邊渲染邊寫出ZIP
+
+    cached_pdf 在主進程中查找已緩存的PDF（沒有時返回None），命中的報告不再渲染。
+    """
+
+    def __init__(self, collection, cached_pdf: Callable[[ReportRenderView], Optional[bytes]],
+                 workers: int = 2, batch_size: int = 50, part_size: int = 500, timeout: float = 30.0):
+        self.collection = collection
+        self.cached_pdf = cached_pdf
+        self.workers = workers
+        self.batch_size = batch_size
+        self.part_size = part_size
+        self.timeout = timeout
+        self.jobs: Dict[str, ExportJob] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn：工作進程不繼承服務進程的MongoDB連接和線程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def create_job(self, start: Optional[str], end: Optional[str], email: Optional[str], mode: str) -> ExportJob:
+        """創建導出任務，日期格式錯誤時拋出ValueError"""
+        export_query(start, end, email)
+        job = ExportJob(uuid.uuid4().hex, {"start": start, "end": end, "email": email}, mode)
+        self.jobs[job.export_id] = job
+        return job
+
+    def get_job(self, export_id: str) -> Optional[ExportJob]:
+        """獲取導出任務，服務重啟後從進度文件恢復"""
+        job = self.jobs.get(export_id)
+        if job is None:
+            job = ExportJob.load(export_id)
+            if job is not None:
+                self.jobs[export_id] = job
+        return job
+
+    async def _batches(self, job: ExportJob) -> AsyncIterator[List[ReportRenderView]]:
+        """從上次的位置開始分批讀取報告"""
+        query = after_token_query(export_query(**job.filters), job.last_token)
+        cursor = self.collection.find(query, ReportRenderView.PROJECTION).sort(EXPORT_SORT).batch_size(self.batch_size)
+
+        def next_batch():
+            batch = []
+            for report in cursor:
+                batch.append(ReportRenderView.from_document(report))
+                if len(batch) >= self.batch_size:
+                    break
+            return batch
+
+        try:
+            while True:
+                batch = await run_db(next_batch)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            await run_db(cursor.close)
+
+    async def _render_batch(self, batch: List[ReportRenderView]):
+        """並行渲染一批報告，按原順序返回 (報告, PDF字節, 錯誤信息)"""
+        loop = asyncio.get_running_loop()
+
+        async def render(report):
+            pdf_bytes = await loop.run_in_executor(None, self.cached_pdf, report)
+            if pdf_bytes is not None:
+                return pdf_bytes, None
+            return await loop.run_in_executor(self._get_executor(), render_export_pdf, report, self.timeout)
+
+        results = await asyncio.gather(*(render(report) for report in batch))
+        return [(report, pdf_bytes, error) for report, (pdf_bytes, error) in zip(batch, results)]
+
+    async def _prepare(self, job: ExportJob):
+        job.status = "running"
+        if not job.total:
+            job.total = await run_db(self.collection.count_documents, export_query(**job.filters))
+        job.save()
+
+    def _finish(self, job: ExportJob, status: str):
+        job.status = status
+        job.finished_at = datetime.now()
+        job.save()
+
+    @staticmethod
+    def _write_errors(archive: zipfile.ZipFile, errors: List[Tuple[str, str]]):
+        if errors:
+            archive.writestr("errors.txt", "\n".join(f"{report_id}\t{error}" for report_id, error in errors))
+
+    async def stream(self, job: ExportJob) -> AsyncIterator[bytes]:
+        """把導出寫成ZIP字節流，每寫完一批報告發送一次；同一時間只在內存中保留一批PDF"""
+        await self._prepare(job)
+        output = ZipStream()
+        errors = []
+        # PDF本身已壓縮，直接存儲
+        archive = zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_STORED)
+        try:
+            async for batch in self._batches(job):
+                results = await self._render_batch(batch)
+                for report, pdf_bytes, error in results:
+                    if pdf_bytes is not None:
+                        archive.writestr(entry_name(report), pdf_bytes)
+                    else:
+                        errors.append((report.report_id, error))
+                yield output.drain()
+                # 這一批的字節交給客戶端之後才推進進度，發送時斷開的批次續傳時重新導出
+                for report, _, error in results:
+                    job.record(report, error)
+                job.save()
+            self._write_errors(archive, errors)
+            archive.close()
+            yield output.drain()
+            self._finish(job, "completed")
+        except BaseException:
+            # 客戶端斷開或出錯：保存進度，可從 last_token 續傳
+            self._finish(job, "interrupted")
+            raise
+
+    async def write_to_disk(self, job: ExportJob):
+        """把導出寫到 EXPORT_DIR/{export_id}/ 下的分卷ZIP中，每個分卷完成後保存進度"""
+        await self._prepare(job)
+        directory = os.path.join(EXPORT_DIR, job.export_id)
+        os.makedirs(directory, exist_ok=True)
+        archive = None
+        part_path = None
+        errors = []
+        in_part = 0
+        try:
+            async for batch in self._batches(job):
+                rendered = await self._render_batch(batch)
+                if archive is None:
+                    part_path = os.path.join(directory, f"part-{len(job.parts) + 1:04d}.zip")
+                    archive = zipfile.ZipFile(part_path, mode="w", compression=zipfile.ZIP_STORED)
+                for report, pdf_bytes, error in rendered:
+                    if pdf_bytes is not None:
+                        archive.writestr(entry_name(report), pdf_bytes)
+                    else:
+                        errors.append((report.report_id, error))
+                    job.record(report, error)
+                    in_part += 1
+                if in_part >= self.part_size:
+                    # 分卷寫完才記錄進度，中斷後從這裡續傳
+                    self._write_errors(archive, errors)
+                    archive.close()
+                    job.parts.append(os.path.basename(part_path))
+                    job.save()
+                    archive, errors, in_part = None, [], 0
+            if archive is not None:
+                self._write_errors(archive, errors)
+                archive.close()
+                job.parts.append(os.path.basename(part_path))
+            self._finish(job, "completed")
+        except BaseException as e:
+            if archive is not None:
+                archive.close()
+                os.remove(part_path)
+            # 回退到最後一個完整分卷的位置
+            saved = ExportJob.load(job.export_id)
+            if saved is not None:
+                for field in ("exported", "failed", "errors", "last_token", "parts"):
+                    setattr(job, field, getattr(saved, field))
+            print(f"導出報告時出錯: {e}")
+            self._finish(job, "interrupted")
+            if not isinstance(e, Exception):
+                raise
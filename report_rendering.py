@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from pdf_pool import run_wkhtmltopdf
+from template_engine import render_template
+
+def render_report_html(report):
+    """用報告模板渲染HTML（report 為 ReportRenderView），出錯時拋出異常"""
+    # 獲取基本信息
+    basic_info = report.basic_info
+    gender_map = {"male": "男", "female": "女", "other": "其他"}
+    gender = gender_map.get(basic_info.get("gender", ""), "未知")
+    
+    # 報告日期取提交時間，同一報告每次渲染結果相同，可以緩存
+    created_at = report.created_at
+    if not isinstance(created_at, datetime):
+        created_at = datetime.now()
+    
+    # 使用已編譯的報告模板渲染
+    html = render_template(
+        "report",
+        report_id=report.report_id or "未知",
+        report_date=created_at.strftime("%Y-%m-%d"),
+        current_year=created_at.year,
+        gender=gender,
+        age=basic_info.get("age", ""),
+        height=basic_info.get("height", ""),
+        weight=basic_info.get("weight", ""),
+        symptoms=report.symptoms,
+        body_systems=report.body_systems,
+        conditions=report.conditions,
+        ai_answers=report.ai_answers,
+        supplements=report.supplements,
+        dosage=report.dosage,
+        usage=report.usage,
+        explanation=report.explanation
+    )
+    
+    return html
+
+def report_error_html(error):
+    """報告渲染失敗時返回的頁面"""
+    return f"""
+        <html>
+        <body>
+            <h1>健康評估與保健品推薦報告</h1>
+            <p>報告生成時出錯: {str(error)}</p>
+        </body>
+        </html>
+        """
+
+def render_report_pdf(html_content, timeout=None):
+    """通過管道把HTML交給wkhtmltopdf並返回PDF字節，不創建臨時文件；超時或出錯時拋出異常"""
+    return run_wkhtmltopdf(html_content, "string", timeout=timeout)
@@ -1,20 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends, Body, Request, status
+from fastapi import FastAPI, HTTPException, Depends, Body, Header, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, EmailStr
 from typing import List, Dict, Optional, Any
+import asyncio
 import json
 import os
-import pymongo
+import secrets
 from datetime import datetime
 import random
-import jinja2
-import pdfkit
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
 import os.path
+from urllib.parse import quote
+from admin_auth import get_current_admin
+from db import get_collection, pool_stats, run_db
+from mail_outbox import MailOutbox, MailSettingsError, OutboxWorker, build_mime_message, mail_settings_complete
+from mail_transport import close_mail_pool, get_mail_pool, mail_pool_metrics
+from pdf_pool import PdfQueueFullError, PdfRenderPool
+from prerender import ReportPrerenderer
+from reminder_queue import ReminderStatusWriter
+from report_export import EXPORT_DIR, ReportExporter
+from report_cache import ReportRenderCache, etag_for, etag_matches, render_key
+from report_rendering import render_report_html, render_report_pdf, report_error_html
+from report_views import ReportRenderView, find_report
+from settings_cache import SETTINGS_CHANGE_STREAM, SettingsCache
+from template_engine import get_templates
 
 # 創建FastAPI應用
 app = FastAPI(title="報告生成與郵件發送API")
@@ -28,21 +39,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 服務之間調用的共享令牌（X-Service-Token），未設置時拒絕服務間接口的請求
+SERVICE_TOKEN = os.environ.get("SERVICE_TOKEN", "")
+
 # 確保數據目錄存在
 os.makedirs("data", exist_ok=True)
 
-# 確保模板目錄存在
-os.makedirs("templates", exist_ok=True)
-
 # 確保報告目錄存在
 os.makedirs("reports", exist_ok=True)
 
+# 渲染結果緩存：HTML在內存中，PDF在reports/cache下，按總大小淘汰
+render_cache = ReportRenderCache(
+    html_maxsize=int(os.environ.get("REPORT_HTML_CACHE_SIZE", "256")),
+    pdf_dir=os.environ.get("REPORT_PDF_CACHE_DIR", "reports/cache"),
+    pdf_max_bytes=int(os.environ.get("REPORT_PDF_CACHE_MAX_MB", "512")) * 1024 * 1024
+)
+
+# PDF渲染池：限制同時運行的wkhtmltopdf進程數，超出隊列容量時返回503
+pdf_pool = PdfRenderPool(
+    workers=int(os.environ.get("PDF_WORKERS", "2")),
+    queue_size=int(os.environ.get("PDF_QUEUE_SIZE", "32")),
+    timeout=float(os.environ.get("PDF_JOB_TIMEOUT", "30"))
+)
+
+# 報告內容提交後不再變化，瀏覽器可以緩存但每次用ETag重新驗證
+REPORT_CACHE_CONTROL = "private, no-cache"
+
 # 連接到MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
-    db = client["health_app"]
-    reports_collection = db["reports"]
-    settings_collection = db["settings"]
+    reports_collection = get_collection("reports")
+    reminders_collection = get_collection("reminders")
+    settings_collection = get_collection("settings")
+    settings_cache = SettingsCache(settings_collection)
+    outbox_collection = get_collection("mail_outbox")
 except Exception as e:
     print(f"MongoDB連接錯誤: {e}")
     # 如果無法連接到MongoDB，使用內存存儲作為備用
@@ -73,204 +102,25 @@ class ReportRequest(BaseModel):
     report_id: str
     email: Optional[str] = None
 
-# 創建報告模板
-report_template = """
-<!DOCTYPE html>
-<html lang="zh-TW">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>健康評估與保健品推薦報告</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        h1, h2, h3 {
-            color: #2c3e50;
-        }
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-            border-bottom: 2px solid #3498db;
-            padding-bottom: 10px;
-        }
-        .section {
-            margin-bottom: 30px;
-            padding: 15px;
-            border-radius: 5px;
-        }
-        .basic-info {
-            background-color: #f8f9fa;
-        }
-        .symptoms {
-            background-color: #e8f4f8;
-        }
-        .recommendations {
-            background-color: #e8f8ef;
-        }
-        .usage {
-            background-color: #f8f4e8;
-        }
-        .footer {
-            margin-top: 50px;
-            font-size: 12px;
-            text-align: center;
-            color: #7f8c8d;
-            border-top: 1px solid #ddd;
-            padding-top: 20px;
-        }
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 15px 0;
-        }
-        th, td {
-            border: 1px solid #ddd;
-            padding: 8px;
-            text-align: left;
-        }
-        th {
-            background-color: #f2f2f2;
-        }
-        .supplement-item {
-            margin-bottom: 15px;
-            padding-bottom: 15px;
-            border-bottom: 1px dashed #ddd;
-        }
-        .supplement-name {
-            font-weight: bold;
-            color: #3498db;
-        }
-        .disclaimer {
-            font-style: italic;
-            color: #7f8c8d;
-        }
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>健康評估與保健品推薦報告</h1>
-        <p>報告生成日期：{{ report_date }}</p>
-        <p>報告編號：{{ report_id }}</p>
-    </div>
-
-    <div class="section basic-info">
-        <h2>基本信息</h2>
-        <table>
-            <tr>
-                <th>性別</th>
-                <td>{{ gender }}</td>
-                <th>年齡</th>
-                <td>{{ age }}</td>
-            </tr>
-            <tr>
-                <th>身高</th>
-                <td>{{ height }} cm</td>
-                <th>體重</th>
-                <td>{{ weight }} kg</td>
-            </tr>
-        </table>
-    </div>
-
-    {% if symptoms %}
-    <div class="section symptoms">
-        <h2>健康狀況摘要</h2>
-        
-        {% if symptoms %}
-        <h3>主要症狀</h3>
-        <ul>
-            {% for symptom in symptoms %}
-            <li>{{ symptom }}</li>
-            {% endfor %}
-        </ul>
-        {% endif %}
-        
-        {% if body_systems %}
-        <h3>需要支持的身體系統</h3>
-        <ul>
-            {% for system in body_systems %}
-            <li>{{ system }}</li>
-            {% endfor %}
-        </ul>
-        {% endif %}
-        
-        {% if conditions %}
-        <h3>特定身體狀況</h3>
-        <ul>
-            {% for condition in conditions %}
-            <li>{{ condition }}</li>
-            {% endfor %}
-        </ul>
-        {% endif %}
-    </div>
-    {% endif %}
-
-    {% if ai_answers %}
-    <div class="section">
-        <h2>深度健康評估</h2>
-        {% for question, answer in ai_answers.items() %}
-        <div style="margin-bottom: 15px;">
-            <p style="font-weight: bold;">{{ question }}</p>
-            <p>{{ answer }}</p>
-        </div>
-        {% endfor %}
-    </div>
-    {% endif %}
-
-    <div class="section recommendations">
-        <h2>保健品推薦</h2>
-        <p>{{ explanation }}</p>
-        
-        {% for supplement in supplements %}
-        <div class="supplement-item">
-            <div class="supplement-name">{{ supplement }}</div>
-            <table>
-                <tr>
-                    <th>建議劑量</th>
-                    <td>{{ dosage[supplement] }}</td>
-                </tr>
-                <tr>
-                    <th>使用方法</th>
-                    <td>{{ usage[supplement] }}</td>
-                </tr>
-            </table>
-        </div>
-        {% endfor %}
-    </div>
-
-    <div class="section usage">
-        <h2>使用建議</h2>
-        <ul>
-            <li>保健品應作為均衡飲食的補充，不能替代正常飲食</li>
-            <li>請按照建議劑量服用，不要過量</li>
-            <li>如有慢性疾病或正在服用藥物，請在服用前諮詢醫生</li>
-            <li>保持規律作息和適當運動，效果更佳</li>
-            <li>建議在3個月後重新評估健康狀況，調整保健方案</li>
-        </ul>
-    </div>
-
-    <div class="footer">
-        <p class="disclaimer">本報告僅供參考，不構成醫療建議。如有健康問題，請諮詢專業醫療人員。</p>
-        <p>© {{ current_year }} 健康問卷與保健品推薦系統. 保留所有權利.</p>
-    </div>
-</body>
-</html>
-"""
-
-# 將模板保存到文件
-with open("templates/report_template.html", "w", encoding="utf-8") as f:
-    f.write(report_template)
+class PrerenderRequest(BaseModel):
+    report_ids: List[str]
+
+class ExportRequest(BaseModel):
+    start: Optional[str] = None
+    end: Optional[str] = None
+    email: Optional[str] = None
+
+def verify_service_token(x_service_token: Optional[str] = Header(None)):
+    """驗證其他服務調用時帶的共享令牌"""
+    if not SERVICE_TOKEN or not x_service_token or not secrets.compare_digest(x_service_token, SERVICE_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="服務令牌無效")
+    return True
 
 # 輔助函數
 def get_email_settings():
     """獲取郵件設置"""
     try:
-        settings = settings_collection.find_one({"type": "email"})
+        settings = settings_cache.get("email")
         if settings:
             return {
                 "gmail_user": settings.get("gmail_user", ""),
@@ -291,165 +141,295 @@ def get_email_settings():
 def generate_report_html(report_data):
     """生成報告HTML"""
     try:
-        # 獲取報告數據
-        report_id = report_data.get("report_id", "未知")
-        health_data = report_data.get("health_data", {})
-        recommendations = report_data.get("recommendations", {})
-        
-        # 獲取基本信息
-        basic_info = health_data.get("basicInfo", {})
-        gender_map = {"male": "男", "female": "女", "other": "其他"}
-        gender = gender_map.get(basic_info.get("gender", ""), "未知")
-        age = basic_info.get("age", "")
-        height = basic_info.get("height", "")
-        weight = basic_info.get("weight", "")
-        
-        # 獲取症狀和身體系統
-        symptoms = health_data.get("symptoms", [])
-        body_systems = health_data.get("bodySystemIssues", [])
-        conditions = health_data.get("specificConditions", [])
-        ai_answers = health_data.get("aiAnswers", {})
-        
-        # 獲取推薦
-        supplements = recommendations.get("supplements", [])
-        dosage = recommendations.get("dosage", {})
-        usage = recommendations.get("usage", {})
-        explanation = recommendations.get("explanation", "")
-        
-        # 創建Jinja2環境
-        env = jinja2.Environment()
-        template = env.from_string(report_template)
-        
-        # 渲染模板
-        html = template.render(
-            report_id=report_id,
-            report_date=datetime.now().strftime("%Y-%m-%d"),
-            current_year=datetime.now().year,
-            gender=gender,
-            age=age,
-            height=height,
-            weight=weight,
-            symptoms=symptoms,
-            body_systems=body_systems,
-            conditions=conditions,
-            ai_answers=ai_answers,
-            supplements=supplements,
-            dosage=dosage,
-            usage=usage,
-            explanation=explanation
-        )
-        
-        return html
+        return render_report_html(report_data)
     except Exception as e:
         print(f"生成報告HTML時出錯: {e}")
-        return f"""
-        <html>
-        <body>
-            <h1>健康評估與保健品推薦報告</h1>
-            <p>報告生成時出錯: {str(e)}</p>
-        </body>
-        </html>
-        """
-
-def generate_report_pdf(report_id, html_content):
-    """生成報告PDF"""
+        return report_error_html(e)
+
+def report_render_key(report_data):
+    """報告渲染結果的緩存鍵，同時用作ETag"""
+    return render_key(report_data, get_templates().version("report"))
+
+def cached_report_html(report_data, key):
+    """從緩存獲取報告HTML，未命中時渲染並緩存（渲染失敗的頁面不緩存）"""
+    html = render_cache.get_html(key)
+    if html is None:
+        try:
+            html = render_report_html(report_data)
+        except Exception as e:
+            print(f"生成報告HTML時出錯: {e}")
+            return report_error_html(e)
+        render_cache.put_html(key, html)
+    return html
+
+async def render_cached_report_pdf(report_data, key):
+    """在渲染池中生成報告PDF字節並寫入磁盤緩存，失敗時返回None"""
+    html = cached_report_html(report_data, key)
     try:
-        # 保存HTML到臨時文件
-        html_path = f"reports/{report_id}.html"
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        
-        # 生成PDF
-        pdf_path = f"reports/{report_id}.pdf"
-        pdfkit.from_file(html_path, pdf_path)
-        
-        return pdf_path
+        # 同一報告的併發請求共享一次渲染
+        pdf_bytes = await pdf_pool.render(key, render_report_pdf, html)
+    except PdfQueueFullError:
+        raise
     except Exception as e:
         print(f"生成報告PDF時出錯: {e}")
         return None
+    await run_in_threadpool(render_cache.put_pdf, key, pdf_bytes)
+    return pdf_bytes
 
-def send_report_email(to_email, report_id, html_content):
-    """發送報告郵件"""
+async def cached_report_pdf_bytes(report_data, key):
+    """獲取報告PDF字節（郵件附件用），優先讀取磁盤緩存"""
+    pdf_bytes = await run_in_threadpool(render_cache.read_pdf, key)
+    if pdf_bytes is None:
+        pdf_bytes = await render_cached_report_pdf(report_data, key)
+    return pdf_bytes
+
+async def prerender_report(report_id):
+    """渲染並緩存報告的HTML和PDF，返回報告提交時間"""
+    report = await run_db(find_report, reports_collection, ReportRenderView, report_id)
+    if not report:
+        return None
+    key = report_render_key(report)
+    cached_report_html(report, key)
+    if not render_cache.has_pdf(key) and await render_cached_report_pdf(report, key) is None:
+        raise RuntimeError("生成PDF失敗")
+    return report.created_at
+
+# 新報告的預渲染：main服務提交後調用 /api/report/prerender，或監聽reports集合的變更流
+REPORT_PRERENDER_CHANGE_STREAM = os.environ.get("REPORT_PRERENDER_CHANGE_STREAM", "0") == "1"
+prerenderer = ReportPrerenderer(
+    prerender_report,
+    workers=int(os.environ.get("REPORT_PRERENDER_WORKERS", "1")),
+    maxsize=int(os.environ.get("REPORT_PRERENDER_QUEUE_SIZE", "1000"))
+)
+
+def cached_export_pdf(report_data):
+    """導出時優先使用渲染緩存中的PDF"""
+    return render_cache.read_pdf(report_render_key(report_data))
+
+# 批量導出：在多個工作進程中渲染，分批寫出ZIP
+exporter = ReportExporter(
+    reports_collection,
+    cached_export_pdf,
+    workers=int(os.environ.get("REPORT_EXPORT_WORKERS", "2")),
+    batch_size=int(os.environ.get("REPORT_EXPORT_BATCH_SIZE", "50")),
+    part_size=int(os.environ.get("REPORT_EXPORT_PART_SIZE", "500")),
+    timeout=pdf_pool.timeout
+)
+_export_tasks = {}
+# 正在流式發送的導出；進度文件中的 running 狀態在服務崩潰或重啟後不再可信
+_export_streams = set()
+
+def start_disk_export(job):
+    """在後台把導出寫到磁盤"""
+    task = asyncio.create_task(exporter.write_to_disk(job))
+    _export_tasks[job.export_id] = task
+    task.add_done_callback(lambda _: _export_tasks.pop(job.export_id, None))
+
+async def stream_export(job):
+    """流式發送導出，結束或客戶端斷開後不再佔用這個導出任務"""
     try:
-        # 獲取郵件設置
-        email_settings = get_email_settings()
-        
-        if not email_settings["gmail_user"] or not email_settings["gmail_password"]:
-            print("郵件設置不完整")
-            return False
-        
-        # 生成PDF
-        pdf_path = generate_report_pdf(report_id, html_content)
-        
-        # 創建郵件
-        msg = MIMEMultipart()
-        msg['From'] = email_settings["gmail_user"]
-        msg['To'] = to_email
-        msg['Subject'] = "您的健康評估與保健品推薦報告"
-        
-        # 添加HTML內容
-        msg.attach(MIMEText(html_content, 'html'))
-        
-        # 如果有PDF附件，添加到郵件
-        if pdf_path and os.path.exists(pdf_path):
-            with open(pdf_path, 'rb') as f:
-                attach = MIMEApplication(f.read(), _subtype="pdf")
-                attach.add_header('Content-Disposition', 'attachment', filename=f"健康評估報告_{report_id}.pdf")
-                msg.attach(attach)
-        
-        # 發送郵件
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(email_settings["gmail_user"], email_settings["gmail_password"])
-        server.send_message(msg)
-        server.quit()
-        
-        return True
-    except Exception as e:
-        print(f"發送報告郵件時出錯: {e}")
-        return False
+        async for chunk in exporter.stream(job):
+            yield chunk
+    finally:
+        _export_streams.discard(job.export_id)
+
+def export_is_live(export_id):
+    """導出是否正在本進程中運行"""
+    return export_id in _export_tasks or export_id in _export_streams
+
+def export_progress(job):
+    """導出進度；進度文件為 running 但本進程中沒有在運行（服務崩潰或重啟）時顯示為 interrupted"""
+    progress = job.to_dict()
+    if progress["status"] == "running" and not export_is_live(job.export_id):
+        progress["status"] = "interrupted"
+    return progress
+
+def pdf_content_disposition(report_id):
+    """PDF下載的Content-Disposition（文件名含中文，按RFC 5987編碼）"""
+    return f"attachment; filename*=utf-8''{quote(f'健康評估報告_{report_id}.pdf')}"
+
+# 發件箱：郵件先寫入mail_outbox集合，由後台工作任務限速發送，失敗時重試
+mail_outbox = MailOutbox(outbox_collection)
+
+def deliver_outbox_message(message):
+    """通過SMTP連接池發送一封發件箱郵件"""
+    email_settings = get_email_settings()
+    if not mail_settings_complete(email_settings):
+        raise MailSettingsError("郵件設置不完整")
+    msg = build_mime_message(message, email_settings["gmail_user"])
+    get_mail_pool(email_settings["gmail_user"], email_settings["gmail_password"]).send(msg)
+
+# 報告服務負責發送所有服務加入發件箱的郵件（包括提醒），設為0時由其他進程發送
+MAIL_OUTBOX_WORKER = os.environ.get("MAIL_OUTBOX_WORKER", "1") == "1"
+# 提醒郵件的發送結果（已發送、失敗、等待重試）累積後按塊寫回提醒
+reminder_status = ReminderStatusWriter(reminders_collection, mail_outbox.collection)
+outbox_worker = OutboxWorker(mail_outbox, deliver_outbox_message, on_complete=reminder_status.record)
+
+def queue_report_email(to_email, report_id, html_content, pdf_bytes=None):
+    """把報告郵件加入發件箱，返回郵件ID"""
+    attachments = []
+    if pdf_bytes:
+        attachments.append({"filename": f"健康評估報告_{report_id}.pdf", "content": pdf_bytes, "subtype": "pdf"})
+    return mail_outbox.enqueue(to_email, "您的健康評估與保健品推薦報告", html_content, attachments, kind="report")
+
+# 生命週期事件
+@app.on_event("startup")
+async def preload_templates():
+    """啟動時編譯所有模板"""
+    get_templates().preload()
+
+@app.on_event("startup")
+async def start_prerenderer():
+    """啟動報告預渲染"""
+    await prerenderer.start()
+    if REPORT_PRERENDER_CHANGE_STREAM:
+        prerenderer.watch(reports_collection)
+
+@app.on_event("shutdown")
+async def stop_prerenderer():
+    """停止報告預渲染"""
+    await prerenderer.stop()
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    """啟動發件箱發送任務"""
+    if MAIL_OUTBOX_WORKER:
+        reminder_status.start()
+        outbox_worker.start()
+
+@app.on_event("shutdown")
+async def stop_outbox_worker():
+    """停止發件箱發送任務，未發送的郵件保留在發件箱中；寫回剩餘的提醒發送結果"""
+    await outbox_worker.stop()
+    await reminder_status.stop()
+
+@app.on_event("shutdown")
+async def close_smtp_connections():
+    """關閉SMTP連接池中的連接"""
+    close_mail_pool()
+
+@app.on_event("shutdown")
+async def stop_exporter():
+    """停止導出工作進程，未完成的導出可以續傳"""
+    for task in list(_export_tasks.values()):
+        task.cancel()
+    exporter.shutdown()
+
+@app.on_event("startup")
+async def watch_settings():
+    """監聽設置變更，其他服務修改設置後本服務的緩存立即失效"""
+    if SETTINGS_CHANGE_STREAM and 'settings_cache' in globals():
+        settings_cache.watch()
+
+@app.on_event("shutdown")
+async def stop_settings_watch():
+    """停止監聽設置變更"""
+    if 'settings_cache' in globals():
+        settings_cache.stop()
 
 # API端點
 @app.get("/")
 async def root():
     return {"message": "報告生成與郵件發送API"}
 
+@app.get("/api/db/metrics", response_model=Dict[str, Any])
+async def get_db_metrics():
+    """獲取MongoDB連接池統計"""
+    return pool_stats()
+
+@app.get("/api/settings/cache", response_model=Dict[str, Any])
+async def get_settings_cache_metrics():
+    """獲取設置緩存統計"""
+    return settings_cache.stats() if 'settings_cache' in globals() else {}
+
+@app.get("/api/mail/metrics", response_model=Dict[str, Any])
+async def get_mail_metrics():
+    """獲取SMTP連接池統計"""
+    return mail_pool_metrics()
+
+@app.get("/api/mail/outbox", response_model=Dict[str, Any])
+async def get_outbox_metrics():
+    """獲取發件箱深度、發送速率和失敗統計"""
+    return {
+        "depth": await run_db(mail_outbox.depth),
+        "worker": outbox_worker.metrics(),
+        "reminder_status": reminder_status.metrics()
+    }
+
+@app.get("/api/reports/cache", response_model=Dict[str, Any])
+async def get_render_cache_stats():
+    """獲取報告渲染緩存統計"""
+    return render_cache.stats()
+
+@app.get("/api/reports/pdf-pool", response_model=Dict[str, Any])
+async def get_pdf_pool_metrics():
+    """獲取PDF渲染池的隊列和延遲統計"""
+    return pdf_pool.metrics()
+
+@app.get("/api/reports/prerender", response_model=Dict[str, Any])
+async def get_prerender_metrics():
+    """獲取預渲染隊列和延遲統計"""
+    return prerenderer.metrics()
+
+@app.post("/api/report/prerender", response_model=Dict[str, Any])
+async def prerender_reports(request: PrerenderRequest, _: bool = Depends(verify_service_token)):
+    """把新提交的報告加入預渲染隊列（由main服務在報告保存後調用），返回因隊列已滿而丟棄的數量"""
+    queued = sum(1 for report_id in request.report_ids if prerenderer.submit(report_id))
+    return {"success": True, "queued": queued, "dropped": len(request.report_ids) - queued}
+
 @app.get("/api/report/{report_id}", response_class=HTMLResponse)
-async def get_report_html(report_id: str):
+async def get_report_html(report_id: str, if_none_match: Optional[str] = Header(None)):
     """獲取報告HTML"""
     try:
         # 獲取報告數據
-        report = reports_collection.find_one({"report_id": report_id})
+        report = await run_db(find_report, reports_collection, ReportRenderView, report_id)
         if not report:
             raise HTTPException(status_code=404, detail=f"找不到報告: {report_id}")
         
-        # 生成報告HTML
-        html = generate_report_html(report)
+        # 客戶端已有相同版本時不返回內容
+        key = report_render_key(report)
+        headers = {"ETag": etag_for(key), "Cache-Control": REPORT_CACHE_CONTROL}
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
         
-        return HTMLResponse(content=html)
+        # 獲取（或生成並緩存）報告HTML
+        html = cached_report_html(report, key)
+        
+        return HTMLResponse(content=html, headers=headers)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取報告時出錯: {str(e)}")
 
 @app.get("/api/report/{report_id}/pdf")
-async def get_report_pdf(report_id: str):
+async def get_report_pdf(report_id: str, if_none_match: Optional[str] = Header(None)):
     """獲取報告PDF"""
     try:
         # 獲取報告數據
-        report = reports_collection.find_one({"report_id": report_id})
+        report = await run_db(find_report, reports_collection, ReportRenderView, report_id)
         if not report:
             raise HTTPException(status_code=404, detail=f"找不到報告: {report_id}")
         
-        # 生成報告HTML
-        html = generate_report_html(report)
+        key = report_render_key(report)
+        headers = {"ETag": etag_for(key), "Cache-Control": REPORT_CACHE_CONTROL}
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        
+        # 磁盤緩存命中時直接從文件流式返回
+        pdf_path = render_cache.get_pdf(key)
+        if pdf_path is not None:
+            return FileResponse(pdf_path, filename=f"健康評估報告_{report_id}.pdf", headers=headers)
         
-        # 生成報告PDF
-        pdf_path = generate_report_pdf(report_id, html)
-        if not pdf_path or not os.path.exists(pdf_path):
+        # 未命中時在內存中生成，字節直接作為響應體返回
+        try:
+            pdf_bytes = await render_cached_report_pdf(report, key)
+        except PdfQueueFullError:
+            raise HTTPException(status_code=503, detail="PDF生成繁忙，請稍後重試", headers={"Retry-After": "5"})
+        if not pdf_bytes:
             raise HTTPException(status_code=500, detail="生成PDF失敗")
         
-        return FileResponse(pdf_path, filename=f"健康評估報告_{report_id}.pdf")
+        headers["Content-Disposition"] = pdf_content_disposition(report_id)
+        return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -465,26 +445,105 @@ async def send_report(request: ReportRequest):
         if not email:
             raise HTTPException(status_code=400, detail="缺少電子郵件地址")
         
+        # 郵件設置不完整時郵件無法發送，不加入發件箱
+        if not mail_settings_complete(await run_db(get_email_settings)):
+            return {"success": False, "message": "發送報告失敗，請檢查郵件設置"}
+        
         # 獲取報告數據
-        report = reports_collection.find_one({"report_id": report_id})
+        report = await run_db(find_report, reports_collection, ReportRenderView, report_id)
         if not report:
             raise HTTPException(status_code=404, detail=f"找不到報告: {report_id}")
         
-        # 生成報告HTML
-        html = generate_report_html(report)
+        # 使用緩存的報告HTML和PDF
+        key = report_render_key(report)
+        html = cached_report_html(report, key)
+        try:
+            pdf_bytes = await cached_report_pdf_bytes(report, key)
+        except PdfQueueFullError:
+            raise HTTPException(status_code=503, detail="PDF生成繁忙，請稍後重試", headers={"Retry-After": "5"})
         
-        # 發送郵件
-        success = send_report_email(email, report_id, html)
+        # 加入發件箱，由後台工作任務發送
+        # PDF生成失敗時不帶附件發送
+        message_id = await run_db(queue_report_email, email, report_id, html, pdf_bytes)
+        outbox_worker.wake()
         
-        if success:
-            return {"success": True, "message": f"報告已成功發送到 {email}"}
-        else:
-            return {"success": False, "message": "發送報告失敗，請檢查郵件設置"}
+        return {"success": True, "message": f"報告將發送到 {email}", "message_id": str(message_id)}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"發送報告時出錯: {str(e)}")
 
+@app.get("/api/admin/reports/export")
+async def export_reports_zip(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    email: Optional[str] = None,
+    export_id: Optional[str] = None,
+    _: str = Depends(get_current_admin)
+):
+    """按日期範圍（YYYY-MM-DD）和郵箱導出報告PDF，以ZIP流返回；帶export_id時從中斷處續傳"""
+    if export_id:
+        job = exporter.get_job(export_id)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"找不到導出任務: {export_id}")
+        if job.mode != "stream" or job.status == "completed" or export_is_live(export_id):
+            raise HTTPException(status_code=409, detail=f"導出任務無法續傳，當前狀態: {job.status}")
+    else:
+        try:
+            job = exporter.create_job(start, end, email, "stream")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"日期格式錯誤: {str(e)}")
+    # 在返回前同步標記，同時到達的續傳請求不會都通過上面的檢查；
+    # 響應結束後的後台任務保證流沒有開始（客戶端立即斷開）時也會取消標記
+    _export_streams.add(job.export_id)
+    return StreamingResponse(
+        stream_export(job),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="reports-{job.export_id}.zip"',
+            "X-Export-Id": job.export_id
+        },
+        background=BackgroundTask(_export_streams.discard, job.export_id)
+    )
+
+@app.post("/api/admin/reports/export", response_model=Dict[str, Any])
+async def export_reports_to_disk(request: ExportRequest, _: str = Depends(get_current_admin)):
+    """在後台把報告PDF導出為磁盤上的分卷ZIP，通過進度接口查看"""
+    try:
+        job = exporter.create_job(request.start, request.end, request.email, "disk")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"日期格式錯誤: {str(e)}")
+    job.save()
+    start_disk_export(job)
+    return job.to_dict()
+
+@app.get("/api/admin/reports/exports/{export_id}", response_model=Dict[str, Any])
+async def get_export_progress(export_id: str, _: str = Depends(get_current_admin)):
+    """獲取導出進度"""
+    job = exporter.get_job(export_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"找不到導出任務: {export_id}")
+    return export_progress(job)
+
+@app.post("/api/admin/reports/exports/{export_id}/resume", response_model=Dict[str, Any])
+async def resume_export(export_id: str, _: str = Depends(get_current_admin)):
+    """從最後一個完整分卷處繼續中斷的磁盤導出"""
+    job = exporter.get_job(export_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"找不到導出任務: {export_id}")
+    if job.mode != "disk" or job.status == "completed" or export_is_live(export_id):
+        raise HTTPException(status_code=409, detail=f"導出任務無法續傳，當前狀態: {job.status}")
+    start_disk_export(job)
+    return job.to_dict()
+
+@app.get("/api/admin/reports/exports/{export_id}/{part}")
+async def download_export_part(export_id: str, part: str, _: str = Depends(get_current_admin)):
+    """下載磁盤導出的分卷"""
+    job = exporter.get_job(export_id)
+    if not job or part not in job.parts:
+        raise HTTPException(status_code=404, detail=f"找不到導出分卷: {part}")
+    return FileResponse(os.path.join(EXPORT_DIR, export_id, part), filename=f"reports-{export_id}-{part}")
+
 # 啟動應用
 if __name__ == "__main__":
     import uvicorn
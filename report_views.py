@@ -0,0 +1,226 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# 各用途只讀取需要的字段，不傳輸 _id 和未使用的內容
+
+# 渲染報告HTML/PDF（以及管理後台的報告詳情）
+RENDER_PROJECTION = {
+    "_id": 0,
+    "report_id": 1,
+    "created_at": 1,
+    "email": 1,
+    "health_data.basicInfo": 1,
+    "health_data.symptoms": 1,
+    "health_data.bodySystemIssues": 1,
+    "health_data.specificConditions": 1,
+    "health_data.aiAnswers": 1,
+    "recommendations.supplements": 1,
+    "recommendations.dosage": 1,
+    "recommendations.usage": 1,
+    "recommendations.explanation": 1
+}
+
+# 管理後台的報告列表：不含AI問答和劑量說明
+LIST_PROJECTION = {
+    "_id": 0,
+    "report_id": 1,
+    "created_at": 1,
+    "email": 1,
+    "health_data.basicInfo": 1,
+    "health_data.symptoms": 1,
+    "recommendations.supplements": 1
+}
+
+# 提醒中保存的報告摘要：提醒郵件只顯示前幾個症狀和前3個推薦保健品
+REMINDER_SUMMARY_SYMPTOMS = 5
+REMINDER_SUMMARY_SUPPLEMENTS = 3
+
+# 創建提醒：只需要提醒郵件中顯示的內容
+REMINDER_PROJECTION = {
+    "_id": 0,
+    "report_id": 1,
+    "email": 1,
+    "health_data.basicInfo": 1,
+    "health_data.symptoms": 1,
+    "recommendations.supplements": 1
+}
+
+def _sections(doc: Dict[str, Any]):
+    return doc.get("health_data") or {}, doc.get("recommendations") or {}
+
+class ReportRenderView:
+    """渲染報告所需的字段"""
+
+    __slots__ = ("report_id", "created_at", "email", "basic_info", "symptoms", "body_systems", "conditions",
+                 "ai_answers", "supplements", "dosage", "usage", "explanation")
+
+    PROJECTION = RENDER_PROJECTION
+
+    def __init__(self, report_id: str, created_at: Optional[datetime], email: Optional[str],
+                 basic_info: Dict[str, str], symptoms: List[str], body_systems: List[str], conditions: List[str],
+                 ai_answers: Dict[str, str], supplements: List[str], dosage: Dict[str, str], usage: Dict[str, str],
+                 explanation: str):
+        self.report_id = report_id
+        self.created_at = created_at
+        self.email = email
+        self.basic_info = basic_info
+        self.symptoms = symptoms
+        self.body_systems = body_systems
+        self.conditions = conditions
+        self.ai_answers = ai_answers
+        self.supplements = supplements
+        self.dosage = dosage
+        self.usage = usage
+        self.explanation = explanation
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "ReportRenderView":
+        health_data, recommendations = _sections(doc)
+        supplements = recommendations.get("supplements", [])
+        dosage = recommendations.get("dosage", {})
+        usage = recommendations.get("usage", {})
+        return cls(
+            report_id=doc.get("report_id", ""),
+            created_at=doc.get("created_at"),
+            email=doc.get("email"),
+            basic_info=health_data.get("basicInfo", {}),
+            symptoms=health_data.get("symptoms", []),
+            body_systems=health_data.get("bodySystemIssues", []),
+            conditions=health_data.get("specificConditions", []),
+            ai_answers=health_data.get("aiAnswers", {}),
+            supplements=supplements,
+            # 模板只顯示推薦保健品的劑量和使用方法
+            dosage={name: dosage[name] for name in supplements if name in dosage},
+            usage={name: usage[name] for name in supplements if name in usage},
+            explanation=recommendations.get("explanation", "")
+        )
+
+    def content(self) -> Dict[str, Any]:
+        """參與渲染的內容，按原報告結構組織"""
+        return {
+            "report_id": self.report_id,
+            "created_at": self.created_at,
+            "health_data": {
+                "basicInfo": self.basic_info,
+                "symptoms": self.symptoms,
+                "bodySystemIssues": self.body_systems,
+                "specificConditions": self.conditions,
+                "aiAnswers": self.ai_answers
+            },
+            "recommendations": {
+                "supplements": self.supplements,
+                "dosage": self.dosage,
+                "usage": self.usage,
+                "explanation": self.explanation
+            }
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.content()
+        data["email"] = self.email
+        return data
+
+class ReportListItem:
+    """報告列表中的一行"""
+
+    __slots__ = ("report_id", "created_at", "email", "basic_info", "symptoms", "supplements")
+
+    PROJECTION = LIST_PROJECTION
+
+    def __init__(self, report_id: str, created_at: Optional[datetime], email: Optional[str],
+                 basic_info: Dict[str, str], symptoms: List[str], supplements: List[str]):
+        self.report_id = report_id
+        self.created_at = created_at
+        self.email = email
+        self.basic_info = basic_info
+        self.symptoms = symptoms
+        self.supplements = supplements
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "ReportListItem":
+        health_data, recommendations = _sections(doc)
+        return cls(
+            report_id=doc.get("report_id", ""),
+            created_at=doc.get("created_at"),
+            email=doc.get("email"),
+            basic_info=health_data.get("basicInfo", {}),
+            symptoms=health_data.get("symptoms", []),
+            supplements=recommendations.get("supplements", [])
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "report_id": self.report_id,
+            "created_at": self.created_at,
+            "email": self.email,
+            "health_data": {"basicInfo": self.basic_info, "symptoms": self.symptoms},
+            "recommendations": {"supplements": self.supplements}
+        }
+
+class ReportReminderView:
+    """創建提醒所需的字段"""
+
+    __slots__ = ("report_id", "email", "basic_info", "symptoms", "supplements")
+
+    PROJECTION = REMINDER_PROJECTION
+
+    def __init__(self, report_id: str, email: Optional[str], basic_info: Dict[str, str],
+                 symptoms: List[str], supplements: List[str]):
+        self.report_id = report_id
+        self.email = email
+        self.basic_info = basic_info
+        self.symptoms = symptoms
+        self.supplements = supplements
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "ReportReminderView":
+        health_data, recommendations = _sections(doc)
+        return cls(
+            report_id=doc.get("report_id", ""),
+            email=doc.get("email"),
+            basic_info=health_data.get("basicInfo", {}),
+            symptoms=health_data.get("symptoms", []),
+            supplements=recommendations.get("supplements", [])
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        """提醒郵件顯示的報告摘要"""
+        return {
+            "gender": self.basic_info.get("gender", ""),
+            "age": self.basic_info.get("age", ""),
+            "symptoms": self.symptoms[:REMINDER_SUMMARY_SYMPTOMS],
+            "supplements": self.supplements[:REMINDER_SUMMARY_SUPPLEMENTS]
+        }
+
+def find_report(collection, view, report_id: str):
+    """按報告ID讀取報告的指定視圖，找不到時返回None"""
+    doc = collection.find_one({"report_id": report_id}, view.PROJECTION)
+    return view.from_document(doc) if doc else None
+
+def find_reports(collection, view, query: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """讀取符合條件的報告的指定視圖"""
+    return [view.from_document(doc) for doc in collection.find(query or {}, view.PROJECTION)]
+
+def attach_reminder_summaries(collection, reminders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """發送前為沒有摘要的提醒補充摘要
+
+    舊提醒中嵌入的報告內容直接轉換；沒有嵌入內容的提醒按 report_id 用一次 $in 查詢批量讀取報告。
+    """
+    missing = set()
+    for reminder in reminders:
+        if "summary" in reminder:
+            continue
+        if "health_data" in reminder or "recommendations" in reminder:
+            reminder["summary"] = ReportReminderView.from_document(reminder).summary()
+        elif reminder.get("report_id"):
+            missing.add(reminder["report_id"])
+    if missing:
+        reports = {
+            report.report_id: report
+            for report in find_reports(collection, ReportReminderView, {"report_id": {"$in": list(missing)}})
+        }
+        for reminder in reminders:
+            report = reports.get(reminder.get("report_id"))
+            if "summary" not in reminder and report is not None:
+                reminder["summary"] = report.summary()
+    return reminders
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# settings集合的緩存時間（秒），設為0時每次都讀取數據庫
+SETTINGS_CACHE_TTL = float(os.environ.get("SETTINGS_CACHE_TTL", "300"))
+# 監聽settings集合的變更流（需要MongoDB副本集），其他服務修改設置後立即失效
+SETTINGS_CHANGE_STREAM = os.environ.get("SETTINGS_CHANGE_STREAM", "0") == "1"
+
+class SettingsCache:
+    """settings集合的進程內緩存：按type緩存設置文檔（包括不存在的設置），熱路徑上不再查詢數據庫
+
+    本服務寫入設置後調用 invalidate；其他服務的修改由變更流立即失效，沒有變更流時最遲在TTL後生效。
+    變更流正常運行期間緩存不會過期。
+    """
+
+    def __init__(self, collection, ttl: float = SETTINGS_CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        self._entries: Dict[str, Any] = {}
+        # 加載時持有鎖，同一設置過期時只有一個線程查詢數據庫
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._watching = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, settings_type: str) -> Optional[Dict[str, Any]]:
+        """返回指定type的設置文檔，不存在時返回None；數據庫錯誤直接拋出，由調用方使用備用設置"""
+        with self._lock:
+            entry = self._entries.get(settings_type)
+            if entry is not None:
+                expires_at, document = entry
+                if self._watching or expires_at > time.monotonic():
+                    self.hits += 1
+                    return document
+            self.misses += 1
+            document = self.collection.find_one({"type": settings_type}, {"_id": 0})
+            self._entries[settings_type] = (time.monotonic() + self.ttl, document)
+            return document
+
+    def invalidate(self, settings_type: Optional[str] = None):
+        """使指定type的設置失效，不指定時清空全部"""
+        with self._lock:
+            if settings_type is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(settings_type, None)
+            self.invalidations += 1
+
+    def watch(self, resume_delay: float = 5.0):
+        """在後台線程中監聽settings集合的變更流，任何修改都清空緩存"""
+        def run():
+            resume_token = None
+            while not self._stop.is_set():
+                try:
+                    with self.collection.watch(resume_after=resume_token, max_await_time_ms=1000) as stream:
+                        # 變更流建立前的修改不會收到通知，先清空一次
+                        self.invalidate()
+                        self._watching = True
+                        while not self._stop.is_set():
+                            change = stream.try_next()
+                            if change is None:
+                                continue
+                            resume_token = stream.resume_token
+                            self.invalidate()
+                except Exception as e:
+                    print(f"監聽設置變更流時出錯，{resume_delay}秒後重試: {e}")
+                finally:
+                    # 變更流中斷期間可能錯過修改，恢復按TTL過期
+                    self._watching = False
+                if not self._stop.is_set():
+                    self._stop.wait(resume_delay)
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=run, name="settings-change-stream", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """停止監聽變更流"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回緩存統計數據"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "ttl": self.ttl,
+                "change_stream": self._watching,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
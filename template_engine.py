@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+from typing import Any, Dict
+
+import jinja2
+
+# 模板目錄和字節碼緩存目錄（可通過環境變量調整）
+TEMPLATE_DIR = os.environ.get(
+    "TEMPLATE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+)
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", "data/template_cache")
+# 開發模式下模板文件修改後自動重新加載
+TEMPLATE_DEV_MODE = os.environ.get("TEMPLATE_DEV_MODE", "0") == "1"
+
+# 模板名稱到文件的對應
+TEMPLATES = {
+    "report": "report.html",
+    "reminder_email": "reminder_email.html",
+}
+
+class TemplateRegistry:
+    """按名稱管理已編譯的模板，每個模板只解析和編譯一次"""
+
+    def __init__(self, directory: str = TEMPLATE_DIR, templates: Dict[str, str] = TEMPLATES,
+                 cache_dir: str = TEMPLATE_CACHE_DIR, dev_mode: bool = TEMPLATE_DEV_MODE):
+        self.templates = dict(templates)
+        self.dev_mode = dev_mode
+        bytecode_cache = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 多進程和重啟後共享編譯結果，省去重新編譯
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        self.env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(directory),
+            bytecode_cache=bytecode_cache,
+            auto_reload=dev_mode
+        )
+        self._lock = threading.Lock()
+        self._compiled: Dict[str, jinja2.Template] = {}
+        self._versions: Dict[str, str] = {}
+
+    def get(self, name: str) -> jinja2.Template:
+        """獲取已編譯的模板；開發模式下每次檢查文件是否修改"""
+        if name not in self.templates:
+            raise KeyError(f"未知的模板: {name}")
+        if self.dev_mode:
+            return self.env.get_template(self.templates[name])
+        template = self._compiled.get(name)
+        if template is None:
+            with self._lock:
+                template = self._compiled.get(name)
+                if template is None:
+                    template = self.env.get_template(self.templates[name])
+                    self._compiled[name] = template
+        return template
+
+    def version(self, name: str) -> str:
+        """模板源碼的哈希，模板修改後改變，用作渲染結果緩存鍵的一部分"""
+        version = None if self.dev_mode else self._versions.get(name)
+        if version is None:
+            source, _, _ = self.env.loader.get_source(self.env, self.templates[name])
+            version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+            self._versions[name] = version
+        return version
+
+    def render(self, name: str, **context: Any) -> str:
+        """渲染指定名稱的模板"""
+        return self.get(name).render(**context)
+
+    def preload(self):
+        """啟動時編譯所有模板，模板有語法錯誤時儘早失敗"""
+        for name in self.templates:
+            self.get(name)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_templates() -> TemplateRegistry:
+    """獲取進程共享的模板註冊表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry()
+    return _registry
+
+def render_template(name: str, **context: Any) -> str:
+    """用共享註冊表渲染模板"""
+    return get_templates().render(name, **context)
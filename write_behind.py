@@ -0,0 +1,237 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import json_util
+
+class QueueFullError(Exception):
+    """寫入隊列已滿且在等待時間內沒有空位"""
+
+class WriteBehindQueue:
+    """有界的後寫隊列：任務先寫入磁盤日誌，再由後台寫入器批量持久化
+
+    transient(錯誤) 返回True的錯誤（如數據庫連接中斷）一直重試；其他錯誤重試 max_attempts 次後，
+    把這一批拆開逐個寫入，仍然失敗的任務移到死信文件（日誌路徑加 .dead），不再阻塞後面的任務。
+    flush 可以返回 {批內位置: 錯誤信息}，表示這些任務重試也無法寫入（其餘任務已經寫入），直接移到死信文件。
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Any]], Awaitable[Optional[Dict[int, str]]]],
+        journal_path: str,
+        maxsize: int = 10000,
+        batch_size: int = 500,
+        batch_wait: float = 0.05,
+        put_timeout: float = 1.0,
+        fsync: bool = False,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 30.0,
+        max_attempts: int = 5,
+        transient: Optional[Callable[[Exception], bool]] = None,
+        close_timeout: float = 30.0
+    ):
+        self._flush = flush
+        self.journal_path = journal_path
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self._transient = transient or (lambda error: False)
+        self.close_timeout = close_timeout
+        self.dead_letter_path = journal_path + ".dead"
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._journal = None
+        self._seq = 0
+        self._closing = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.flush_failures = 0
+        self.dead_lettered = 0
+        self.rejected = 0
+        self.batches = 0
+        self.last_drain_latency = 0.0
+        self.max_drain_latency = 0.0
+        self._total_drain_latency = 0.0
+
+    def _write_journal(self, record: Dict[str, Any]):
+        self._journal.write(json_util.dumps(record) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _replay_journal(self) -> List[Dict[str, Any]]:
+        """讀取上次未確認寫入的任務"""
+        if not os.path.exists(self.journal_path):
+            return []
+        jobs = {}
+        acked = 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json_util.loads(line)
+                except ValueError:
+                    # 崩潰時寫了一半的最後一行
+                    continue
+                if record.get("op") == "job":
+                    jobs[record["seq"]] = record["job"]
+                elif record.get("op") == "ack":
+                    acked = max(acked, record["upto"])
+        return [{"seq": seq, "job": job} for seq, job in sorted(jobs.items()) if seq > acked]
+
+    async def start(self):
+        """恢復日誌中未寫入的任務並啟動後台寫入器"""
+        self._queue = asyncio.Queue()
+        pending = self._replay_journal()
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        # 重寫日誌，只保留未確認的任務
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            for entry in pending:
+                f.write(json_util.dumps({"op": "job", **entry}) + "\n")
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        for entry in pending:
+            self._seq = max(self._seq, entry["seq"])
+            self._queue.put_nowait((entry["seq"], time.perf_counter(), entry["job"]))
+            self.enqueued += 1
+        if pending:
+            print(f"從日誌恢復了{len(pending)}個未寫入的任務")
+        self._closing = False
+        self._writer = asyncio.create_task(self._run())
+
+    async def put(self, job: Any):
+        """加入任務；隊列已滿時等待空位（背壓），超時拋出QueueFullError"""
+        if self._closing or self._queue is None:
+            raise QueueFullError("寫入隊列未運行")
+        deadline = time.perf_counter() + self.put_timeout
+        while self._queue.qsize() >= self.maxsize:
+            if time.perf_counter() >= deadline:
+                self.rejected += 1
+                raise QueueFullError("寫入隊列已滿")
+            await asyncio.sleep(0.01)
+        self._seq += 1
+        self._write_journal({"op": "job", "seq": self._seq, "job": job})
+        self._queue.put_nowait((self._seq, time.perf_counter(), job))
+        self.enqueued += 1
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, jobs, max_attempts) -> Optional[Exception]:
+        """寫入一組 (序號, 任務)，失敗時以指數退避重試，任務仍保留在日誌中；
+        非臨時性錯誤重試 max_attempts 次後返回該錯誤，成功時返回None（flush 拒絕的任務已移到死信文件）"""
+        delay = self.retry_delay
+        attempts = 0
+        while True:
+            try:
+                rejected = await self._flush([job for _, job in jobs])
+                for position, error in (rejected or {}).items():
+                    self._dead_letter(jobs[position][0], jobs[position][1], error)
+                return None
+            except Exception as e:
+                self.flush_failures += 1
+                attempts += 1
+                if not self._transient(e) and attempts >= max_attempts:
+                    return e
+                print(f"批量寫入失敗，{delay:.1f}秒後重試: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _dead_letter(self, seq, job, error):
+        """把無法寫入的任務移到死信文件，修復原因後可手動重新提交"""
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json_util.dumps({"seq": seq, "job": job, "error": str(error), "failed_at": datetime.now()}) + "\n")
+        self.dead_lettered += 1
+        print(f"任務{seq}無法寫入，已移到死信文件 {self.dead_letter_path}: {error}")
+
+    async def _flush_batch(self, batch):
+        """寫入一批任務；整批多次失敗時逐個寫入，找出無法寫入的任務"""
+        error = await self._write([(seq, job) for seq, _, job in batch], self.max_attempts)
+        if error is not None:
+            print(f"批量寫入{self.max_attempts}次失敗，逐個寫入: {error}")
+            for seq, _, job in batch:
+                job_error = await self._write([(seq, job)], 1) if len(batch) > 1 else error
+                if job_error is not None:
+                    self._dead_letter(seq, job, job_error)
+
+        now = time.perf_counter()
+        self._write_journal({"op": "ack", "upto": batch[-1][0]})
+        for _, enqueued_at, _ in batch:
+            latency = now - enqueued_at
+            self._total_drain_latency += latency
+            self.max_drain_latency = max(self.max_drain_latency, latency)
+        self.last_drain_latency = now - batch[0][1]
+        self.flushed += len(batch)
+        self.batches += 1
+        for _ in batch:
+            self._queue.task_done()
+
+        # 隊列清空時截斷日誌，避免無限增長
+        if self._queue.empty():
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._flush_batch(batch)
+
+    async def close(self):
+        """停止接收新任務，寫完隊列中剩餘的任務後關閉；超過 close_timeout 秒（如數據庫不可用）時
+        直接關閉，未寫入的任務保留在日誌中，下次啟動時重放"""
+        if self._queue is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), self.close_timeout)
+        except asyncio.TimeoutError:
+            print(f"關閉時仍有{self.enqueued - self.flushed}個任務未寫入，保留在日誌 {self.journal_path} 中，下次啟動時重放")
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回隊列深度和寫入延遲統計"""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            # 包括已取出、正在寫入的任務
+            "pending": self.enqueued - self.flushed,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "flush_failures": self.flush_failures,
+            "dead_lettered": self.dead_lettered,
+            "rejected": self.rejected,
+            "last_drain_latency_ms": self.last_drain_latency * 1000,
+            "avg_drain_latency_ms": self._total_drain_latency / self.flushed * 1000 if self.flushed else 0.0,
+            "max_drain_latency_ms": self.max_drain_latency * 1000
+        }